@@ -1,3 +1,9 @@
-from .annotator import ManualFeatureAnnotator
-
 __all__ = ["ManualFeatureAnnotator"]
+
+
+def __getattr__(name):
+    # The GUI (and with it Open3D) is only imported when actually requested.
+    if name == "ManualFeatureAnnotator":
+        from .annotator import ManualFeatureAnnotator
+        return ManualFeatureAnnotator
+    raise AttributeError(f"module {__name__!r} has no attribute {name!r}")
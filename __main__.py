@@ -1,9 +1,6 @@
-from .annotator import ManualFeatureAnnotator
+import sys
 
-def main():
-    IMG_FOLDER = ""
-    annotator = ManualFeatureAnnotator(IMG_FOLDER, output_dir="colmap_manual_output")
-    annotator.run()
+from .cli import main
 
 if __name__ == "__main__":
-    main()
+    sys.exit(main())
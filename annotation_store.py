@@ -0,0 +1,403 @@
+import itertools
+import math
+
+import numpy as np
+
+from .constants import DEFAULT_DESCRIPTOR, DEFAULT_SCALE, DEFAULT_ANGLE
+from .descriptor_pool import DESCRIPTOR_DIM, DescriptorPool
+from .spatial_index import GridIndex
+
+RECORD_DTYPE = np.dtype([
+    ('fid', np.int64),
+    ('x', np.float64),
+    ('y', np.float64),
+    ('size', np.float32),
+    ('angle', np.float32),
+    ('point3d_id', np.int64),
+    ('desc_row', np.int64),  # offset in the descriptor pool, -1 for DEFAULT_DESCRIPTOR
+])
+
+# Versions are drawn from one global counter so they stay unique across stores,
+# e.g. after an import replaces the whole AnnotationStore.
+_versions = itertools.count(1)
+
+
+def _grow(array, needed):
+    capacity = max(needed, 2 * len(array), 64)
+    grown = np.empty((capacity,) + array.shape[1:], dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+class ImageAnnotations:
+    """Feature records of one image, kept sorted by feature ID in a structured array.
+
+    Descriptors are uint8 rows of a ``DescriptorPool``, usually shared by the whole
+    store; a record holds only the offset of its row.
+    """
+
+    def __init__(self, pool=None):
+        self._records = np.empty(0, dtype=RECORD_DTYPE)
+        self._count = 0
+        self.pool = pool if pool is not None else DescriptorPool()
+        self._grid = None
+        self._shared = False
+        self.version = next(_versions)
+
+    def __len__(self):
+        return self._count
+
+    def __bool__(self):
+        return self._count > 0
+
+    def __contains__(self, fid):
+        return self._row(fid) is not None
+
+    def __getitem__(self, fid):
+        row = self._row(fid)
+        if row is None:
+            raise KeyError(fid)
+        return self._record_tuple(row)
+
+    def get(self, fid, default=None):
+        row = self._row(fid)
+        return default if row is None else self._record_tuple(row)
+
+    @property
+    def records(self):
+        view = self._records[:self._count]
+        view.flags.writeable = False
+        return view
+
+    def ids(self):
+        return self._records['fid'][:self._count].copy()
+
+    def max_id(self):
+        return int(self._records['fid'][self._count - 1]) if self._count else 0
+
+    def point3d_id(self, fid):
+        row = self._row(fid)
+        return None if row is None else int(self._records['point3d_id'][row])
+
+    def descriptors(self, rows=None):
+        # Dense uint8 (n, 128) matrix; rows without a computed descriptor get DEFAULT_DESCRIPTOR.
+        desc_rows = self._records['desc_row'][:self._count]
+        if rows is not None:
+            desc_rows = desc_rows[rows]
+        has_desc = desc_rows >= 0
+        if has_desc.all():
+            return self.pool.read(desc_rows)
+        out = np.empty((len(desc_rows), DESCRIPTOR_DIM), dtype=np.uint8)
+        out[has_desc] = self.pool.read(desc_rows[has_desc])
+        out[~has_desc] = DEFAULT_DESCRIPTOR
+        return out
+
+    def set(self, fid, x, y, descriptor=None, size=DEFAULT_SCALE, angle=DEFAULT_ANGLE, point3d_id=-1):
+        self._own()
+        row = self._row(fid)
+        if row is None:
+            row = int(np.searchsorted(self._records['fid'][:self._count], fid))
+            self._insert_rows(row, 1)
+            self._records['desc_row'][row] = -1
+        elif self._grid is not None:
+            self._grid.remove(fid, self._records['x'][row], self._records['y'][row])
+
+        if self._grid is not None:
+            self._grid.add(fid, x, y)
+
+        record = self._records[row]
+        record['fid'] = fid
+        record['x'] = x
+        record['y'] = y
+        record['size'] = size
+        record['angle'] = angle
+        record['point3d_id'] = point3d_id
+
+        if descriptor is not None:
+            record['desc_row'] = self.pool.append(descriptor)
+
+        self.version = next(_versions)
+
+    def extend(self, fids, xs, ys, point3d_ids, sizes=DEFAULT_SCALE, angles=DEFAULT_ANGLE, descriptors=None):
+        # Bulk append of new feature IDs, e.g. from an import; existing IDs are not checked.
+        fids = np.asarray(fids, dtype=np.int64)
+        n = len(fids)
+        if n == 0:
+            return
+
+        self._own()
+        start = self._count
+        if start + n > len(self._records):
+            self._records = _grow(self._records[:start], start + n)
+        new = self._records[start:start + n]
+        new['fid'] = fids
+        new['x'] = xs
+        new['y'] = ys
+        new['size'] = sizes
+        new['angle'] = angles
+        new['point3d_id'] = point3d_ids
+
+        if descriptors is None:
+            new['desc_row'] = -1
+        else:
+            desc_start = self.pool.append(descriptors)
+            new['desc_row'] = np.arange(desc_start, desc_start + n)
+
+        self._count += n
+        if self._grid is not None:
+            self._grid.add_many(new['fid'], new['x'], new['y'])
+        if (start and fids.min() <= self._records['fid'][start - 1]) or not np.all(np.diff(fids) > 0):
+            self._records[:self._count] = np.sort(self._records[:self._count], order='fid')
+        self.version = next(_versions)
+
+    def set_descriptors(self, fids, descriptors, xs=None, ys=None):
+        # Fill descriptors of existing records; with xs/ys, records moved since are left alone.
+        if self._count == 0:
+            return 0
+        fids = np.asarray(fids, dtype=np.int64)
+        rows = np.minimum(self._rows_of(fids), self._count - 1)
+        valid = self._records['fid'][rows] == fids
+        if xs is not None:
+            found = np.flatnonzero(valid)
+            valid[found] = ((self._records['x'][rows[found]] == np.asarray(xs)[found]) &
+                            (self._records['y'][rows[found]] == np.asarray(ys)[found]))
+        rows = rows[valid]
+        if len(rows) == 0:
+            return 0
+
+        self._own()
+        start = self.pool.append(np.asarray(descriptors)[valid])
+        self._records['desc_row'][rows] = np.arange(start, start + len(rows))
+        self.version = next(_versions)
+        return len(rows)
+
+    def delete(self, fids):
+        fids = np.atleast_1d(np.asarray(fids, dtype=np.int64))
+        if self._count == 0 or len(fids) == 0:
+            return 0
+        # Records are sorted by ID, so the rows are found by binary search.
+        rows = np.minimum(self._rows_of(fids), self._count - 1)
+        rows = rows[self._records['fid'][rows] == fids]
+        if len(rows) == 0:
+            return 0
+        keep = np.ones(self._count, dtype=bool)
+        keep[rows] = False
+        return self._keep_rows(keep)
+
+    def rows_in_rect(self, x1, y1, x2, y2):
+        # Sorted rows inside the rectangle, answered from the spatial grid.
+        candidates = self._spatial().query_rect(x1, y1, x2, y2)
+        if len(candidates) == 0:
+            return candidates
+        rows = np.sort(self._rows_of(candidates))
+        records = self._records[rows]
+        x_min, x_max = min(x1, x2), max(x1, x2)
+        y_min, y_max = min(y1, y2), max(y1, y2)
+        inside = (records['x'] >= x_min) & (records['x'] <= x_max) & (records['y'] >= y_min) & (records['y'] <= y_max)
+        return rows[inside]
+
+    def delete_in_rect(self, x1, y1, x2, y2):
+        rows = self.rows_in_rect(x1, y1, x2, y2)
+        deleted = self._records['fid'][rows]
+        if len(rows):
+            keep = np.ones(self._count, dtype=bool)
+            keep[rows] = False
+            self._keep_rows(keep)
+        return deleted
+
+    def nearest(self, x, y, max_dist=None):
+        if self._count == 0:
+            return None
+
+        grid = self._spatial()
+        if max_dist is None:
+            max_ring = grid.extent_rings(x, y)
+        else:
+            max_ring = int(math.ceil(max_dist / grid.cell_size)) + 1
+
+        best = None
+        for ring, candidates in grid.query_rings(x, y, max_ring):
+            if len(candidates):
+                rows = self._rows_of(candidates)
+                dist2 = (self._records['x'][rows] - x) ** 2 + (self._records['y'][rows] - y) ** 2
+                i = int(np.argmin(dist2))
+                dist = float(np.sqrt(dist2[i]))
+                if best is None or dist < best[1]:
+                    best = (int(self._records['fid'][rows[i]]), dist)
+            # Points outside the rings searched so far are at least ring * cell_size away.
+            if best is not None and best[1] <= ring * grid.cell_size:
+                break
+
+        if best is None or (max_dist is not None and best[1] > max_dist):
+            return None
+        return best
+
+    def missing_from(self, other):
+        # Sorted feature IDs present here but not in ``other``.
+        return np.setdiff1d(self._records['fid'][:self._count], other.ids(), assume_unique=True)
+
+    def snapshot(self):
+        # Copy-on-write: both sides share the arrays until this instance is mutated.
+        # Pool rows are never rewritten, so the pool itself is shared as is.
+        clone = ImageAnnotations(self.pool)
+        clone._records = self._records[:self._count]
+        clone._count = self._count
+        clone._shared = True
+        clone.version = self.version
+        self._shared = True
+        return clone
+
+    def copy(self):
+        clone = ImageAnnotations(self.pool)
+        clone._records = self._records[:self._count].copy()
+        clone._count = self._count
+        clone.version = self.version
+        return clone
+
+    def to_arrays(self):
+        # Records plus a compact descriptor matrix that their desc_row values index.
+        records = self._records[:self._count].copy()
+        used = records['desc_row'] >= 0
+        descriptors = self.pool.read(records['desc_row'][used])
+        records['desc_row'][used] = np.arange(len(descriptors))
+        return records, descriptors
+
+    @classmethod
+    def from_arrays(cls, records, descriptors, pool=None):
+        # Inverse of ``to_arrays``; takes ownership of ``records``, which must be sorted by feature ID.
+        annotations = cls(pool)
+        annotations._records = np.asarray(records, dtype=RECORD_DTYPE)
+        annotations._count = len(records)
+        used = annotations._records['desc_row'] >= 0
+        if used.any():
+            annotations._records['desc_row'][used] += annotations.pool.append(descriptors)
+        return annotations
+
+    def move_descriptors(self, pool):
+        # Copies the descriptors in use into ``pool`` and points the records at them.
+        if pool is self.pool:
+            return
+        self._own()
+        desc_rows = self._records['desc_row'][:self._count]
+        used = desc_rows >= 0
+        if used.any():
+            start = pool.append(self.pool.read(desc_rows[used]))
+            desc_rows[used] = np.arange(start, start + int(np.count_nonzero(used)))
+        self.pool = pool
+
+    def _row(self, fid):
+        fids = self._records['fid'][:self._count]
+        row = int(np.searchsorted(fids, fid))
+        if row < self._count and fids[row] == fid:
+            return row
+        return None
+
+    def _own(self):
+        if self._shared:
+            self._records = self._records[:self._count].copy()
+            self._shared = False
+
+    def _rows_of(self, fids):
+        return np.searchsorted(self._records['fid'][:self._count], fids)
+
+    def _spatial(self):
+        # Built on first spatial query, then kept up to date by set/extend/delete.
+        if self._grid is None:
+            records = self._records[:self._count]
+            self._grid = GridIndex()
+            self._grid.build(records['fid'], records['x'], records['y'])
+        return self._grid
+
+    def _record_tuple(self, row):
+        record = self._records[row]
+        desc_row = int(record['desc_row'])
+        descriptor = self.pool.row(desc_row) if desc_row >= 0 else DEFAULT_DESCRIPTOR
+        return (float(record['x']), float(record['y']), descriptor,
+                float(record['size']), float(record['angle']), int(record['point3d_id']))
+
+    def _insert_rows(self, row, n):
+        if self._count + n > len(self._records):
+            self._records = _grow(self._records[:self._count], self._count + n)
+        self._records[row + n:self._count + n] = self._records[row:self._count]
+        self._count += n
+
+    def _keep_rows(self, keep):
+        removed = int(self._count - np.count_nonzero(keep))
+        if removed == 0:
+            return 0
+        self._own()
+        if self._grid is not None:
+            dropped = self._records[:self._count][~keep]
+            self._grid.remove_many(dropped['fid'], dropped['x'], dropped['y'])
+        kept = self._records[:self._count][keep]
+        self._records[:len(kept)] = kept
+        self._count = len(kept)
+        self.version = next(_versions)
+        return removed
+
+
+class AnnotationStore:
+    """Per-image feature records keyed by image file name; images are created on first access.
+
+    All images store their descriptors in ``pool``, by default an in-memory one.
+    """
+
+    def __init__(self, pool=None):
+        self._images = {}
+        self.pool = pool if pool is not None else DescriptorPool()
+
+    @classmethod
+    def from_images(cls, images, pool=None):
+        store = cls(pool)
+        store._images = dict(images)
+        return store
+
+    def __getitem__(self, name):
+        annotations = self._images.get(name)
+        if annotations is None:
+            annotations = self._images[name] = ImageAnnotations(self.pool)
+        return annotations
+
+    def __contains__(self, name):
+        return name in self._images
+
+    def get(self, name):
+        # Unlike ``store[name]`` this never creates an entry.
+        annotations = self._images.get(name)
+        return annotations if annotations is not None else ImageAnnotations(self.pool)
+
+    def names(self):
+        return list(self._images.keys())
+
+    def items(self):
+        return self._images.items()
+
+    def version(self, name):
+        annotations = self._images.get(name)
+        return annotations.version if annotations is not None else 0
+
+    def max_feature_id(self):
+        return max((ann.max_id() for ann in self._images.values()), default=0)
+
+    def max_point3d_id(self):
+        return max([0] + [int(ann.records['point3d_id'].max()) for ann in self._images.values() if ann])
+
+    def total_points(self):
+        return sum(len(ann) for ann in self._images.values())
+
+    def snapshot(self):
+        # Cheap, consistent read-only view for background jobs such as exports.
+        clone = AnnotationStore(self.pool)
+        clone._images = {name: ann.snapshot() for name, ann in self._images.items()}
+        return clone
+
+    def copy(self):
+        clone = AnnotationStore(self.pool)
+        clone._images = {name: ann.copy() for name, ann in self._images.items()}
+        return clone
+
+    def move_descriptors(self, pool):
+        # E.g. an import parsed into its own pool, moved into the session's descriptor file.
+        for ann in self._images.values():
+            ann.move_descriptors(pool)
+        self.pool = pool
@@ -1,66 +1,115 @@
 import os
+import time
 
 import cv2
 import open3d.visualization.gui as gui # type: ignore
 
-from .constants import DEFAULT_ZOOM, MIN_ZOOM, MAX_ZOOM
+from .annotation_store import AnnotationStore
+from .constants import DEFAULT_ZOOM, REDRAW_MAX_FPS
+from .descriptor_pool import DescriptorFile
+from .descriptors import DescriptorService
 from .display import DisplayMixin
 from .file_io import FileIOMixin
+from .image_cache import ImageCache
 from .interaction import AnnotationMixin
+from .jobs import JobRunner
+from .journal import AnnotationJournal
+from .layers import PaneLayers
 from .navigation import NavigationMixin
+from .overlay import OverlayRenderer
+from .profiling import ProfiledApp, profiler
+from .project_index import ProjectIndex
+from .pyramid import PyramidCache
+from .scheduler import RedrawScheduler
+from .track_index import TrackIndex
+from .viewport import Viewport
 
 
 class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, DisplayMixin):
-    def __init__(self, image_folder, output_dir="colmap_manual"):
+    def __init__(self, image_folder, output_dir="colmap_manual", max_fps=REDRAW_MAX_FPS):
         self.image_folder = image_folder
         self.output_dir = output_dir
         if not os.path.exists(self.output_dir):
             os.makedirs(self.output_dir)
 
-        self.image_files = sorted([
-            f for f in os.listdir(image_folder)
-            if f.lower().endswith(('.jpg', '.png', '.jpeg'))
-        ])
+        # Reopening an unchanged folder reads the cached manifest instead of listing it.
+        self.project = ProjectIndex.open(image_folder, os.path.join(self.output_dir, "project_cache"))
+        self.image_files = self.project.names
         if len(self.image_files) < 2:
             print("Error: at least two pictures")
 
         self.current_idx = 0
 
-        self.annotations = {f: {} for f in self.image_files}
-        self.image_metadata = {f: None for f in self.image_files}
+        # uint8 descriptors live in a memory-mapped sidecar file rather than on the heap.
+        self.descriptor_file = DescriptorFile(os.path.join(self.output_dir, "descriptors.u8"))
+        self.annotations = AnnotationStore(self.descriptor_file)
+        self.image_metadata = {}
+        self.cameras = {}
+        self.points3d = {}
+        self.db_export_versions = {}
+        self.feature_export_versions = {}
         self.max_point3d_id = 0
 
+        # Reload the work of earlier sessions (including a crashed one) from the journal.
+        self.journal = AnnotationJournal(os.path.join(self.output_dir, "journal"))
+        recovered = self.journal.recover(self.descriptor_file)
+        if recovered is not None:
+            self.annotations, metadata, self.cameras, self.points3d = recovered
+            self.image_metadata.update(metadata)
+            self.max_point3d_id = max([self.annotations.max_point3d_id()] + list(self.points3d))
+
         self.sift = cv2.SIFT_create() # type: ignore
+        self.descriptor_service = DescriptorService(self.sift)
 
-        self.current_feature_id = 1
+        self.current_feature_id = self.annotations.max_feature_id() + 1
+        self.tracks = TrackIndex(self.image_files, positions=self.project.positions)
+        self.point_tracks = TrackIndex(self.image_files, 'point3d_id', self.project.positions)
         self.zoom_factor = DEFAULT_ZOOM
+        self.view_left = Viewport(zoom=self.zoom_factor)
+        self.view_right = Viewport(zoom=self.zoom_factor)
+        self.pan_last_view = None
+        self.pane_layers = {True: PaneLayers(), False: PaneLayers()}
+        self.overlay = OverlayRenderer()
 
         self.delete_mode = False
+        self.assist_mode = False
+        self.proposal = None  # (fid, x, y, score) suggested on the right image
+        self.fundamental = None  # current pair, from imported poses and cameras
         self.drag_start_coord = None
         self.drag_curr_coord = None
         self.drag_is_left = None
 
-        self.app = gui.Application.instance
+        self._create_window(max_fps)
+
+        self.image_cache = ImageCache(self.image_folder)
+        self.pyramids = PyramidCache(self.image_folder, os.path.join(self.output_dir, "pyramid_cache"),
+                                     on_ready=lambda name: self._request_redraw(),
+                                     dimensions=self.project.dimensions)
+        self.cv_img_left = None
+        self.cv_img_right = None
+
+        if len(self.image_files) >= 2:
+            self._load_pair()
+
+    def _create_window(self, max_fps):
+        # Wrapped so the profiler can see how long posted callbacks wait for the GUI thread.
+        self.app = ProfiledApp(gui.Application.instance)
         self.app.initialize()
         self.window = self.app.create_window("Open3D Manual SfM Annotator", 2000, 1200)
+        self.redraw_scheduler = RedrawScheduler(self.app, self.window, self._render_panes, max_fps)
+        self.jobs = JobRunner(lambda fn: self.app.post_to_main_thread(self.window, fn))
 
         # key events callback
         self.window.set_on_key(self._on_key)
 
         self._build_layout()
 
-        self.cv_img_left = None
-        self.cv_img_right = None
-
-        if len(self.image_files) >= 2:
-            self._load_pair()
-
     def _build_layout(self):
         self.main_layout = gui.Vert(0, gui.Margins(10, 10, 10, 10))
 
         controls = gui.Horiz(10)
 
-        self.btn_import = gui.Button("Import images.txt")
+        self.btn_import = gui.Button("Import images.txt/.bin")
         self.btn_import.set_on_clicked(self._on_import_select_file)
         controls.add_child(self.btn_import)
 
@@ -89,18 +138,51 @@ class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, Disp
         self.btn_delete_single.set_on_clicked(lambda: self._on_delete_single())
         controls.add_child(self.btn_delete_single)
 
+        self.btn_assist = gui.Button("Match Assist (A)")
+        self.btn_assist.toggleable = True
+        self.btn_assist.set_on_clicked(self._toggle_assist_mode)
+        controls.add_child(self.btn_assist)
+
+        self.btn_propagate = gui.Button("Propagate Left-only")
+        self.btn_propagate.set_on_clicked(self._on_propagate_matches)
+        controls.add_child(self.btn_propagate)
+
         self.btn_prev = gui.Button("Prev Pair (P)")
         self.btn_prev.set_on_clicked(self._on_prev)
         controls.add_child(self.btn_prev)
 
+        self.btn_next_incomplete = gui.Button("Next Incomplete (J)")
+        self.btn_next_incomplete.set_on_clicked(self._on_next_incomplete)
+        controls.add_child(self.btn_next_incomplete)
+
+        self.btn_under_observed = gui.Button("Under-observed IDs")
+        self.btn_under_observed.set_on_clicked(self._on_show_under_observed)
+        controls.add_child(self.btn_under_observed)
+
         self.btn_next = gui.Button("Next Pair (N)")
         self.btn_next.set_on_clicked(self._on_next)
         controls.add_child(self.btn_next)
 
+        self.btn_recompute = gui.Button("Recompute Descriptors")
+        self.btn_recompute.set_on_clicked(self._on_recompute_descriptors)
+        controls.add_child(self.btn_recompute)
+
         self.btn_export_images = gui.Button("Export Corrected images.txt")
         self.btn_export_images.set_on_clicked(self._on_export_images_txt)
         controls.add_child(self.btn_export_images)
 
+        self.btn_export_bin = gui.Button("Export Binary Model")
+        self.btn_export_bin.set_on_clicked(self._on_export_model_bin)
+        controls.add_child(self.btn_export_bin)
+
+        self.btn_export_features = gui.Button("Export Feature Files")
+        self.btn_export_features.set_on_clicked(self._on_export_feature_files)
+        controls.add_child(self.btn_export_features)
+
+        self.btn_export_db = gui.Button("Export database.db")
+        self.btn_export_db.set_on_clicked(self._on_export_database)
+        controls.add_child(self.btn_export_db)
+
         self.main_layout.add_child(controls)
 
         images_layout = gui.Horiz(10)
@@ -116,6 +198,8 @@ class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, Disp
         self.right_widget = gui.ImageWidget()
         self.right_panel.add_child(self.right_label)
         self.right_panel.add_child(self.right_widget)
+        self.left_widget.set_on_mouse(lambda e: self._on_mouse_event(e, is_left=True))
+        self.right_widget.set_on_mouse(lambda e: self._on_mouse_event(e, is_left=False))
         self.right_panel.add_stretch()
 
         images_layout.add_child(self.left_panel)
@@ -124,11 +208,31 @@ class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, Disp
 
         self.main_layout.add_child(images_layout)
         self.main_layout.add_stretch()
+
+        status_bar = gui.Horiz(10)
+        self.status_label = gui.Label("Ready")
+        status_bar.add_child(self.status_label)
+        status_bar.add_stretch()
+        self.btn_profile = gui.Button("Profiling (F)")
+        self.btn_profile.toggleable = True
+        self.btn_profile.is_on = profiler.enabled
+        self.btn_profile.set_on_clicked(self._toggle_profiling)
+        status_bar.add_child(self.btn_profile)
+        self.btn_dump_profile = gui.Button("Dump Profile")
+        self.btn_dump_profile.set_on_clicked(self._on_dump_profile)
+        status_bar.add_child(self.btn_dump_profile)
+        self.btn_cancel_job = gui.Button("Cancel")
+        self.btn_cancel_job.set_on_clicked(self.jobs.cancel)
+        self.btn_cancel_job.enabled = False
+        status_bar.add_child(self.btn_cancel_job)
+        self.main_layout.add_child(status_bar)
+
         self.window.add_child(self.main_layout)
 
     def _on_id_change(self, new_val):
         self.current_feature_id = int(new_val)
-        self.app.post_to_main_thread(self.window, self._update_display_images)
+        self.proposal = None
+        self._request_redraw()
 
     def _on_zoom_change(self, new_val):
         try:
@@ -136,14 +240,8 @@ class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, Disp
         except Exception:
             zoom_val = self.zoom_factor
 
-        zoom_val = max(MIN_ZOOM, min(MAX_ZOOM, zoom_val))
-        self.zoom_factor = zoom_val
-
-        current_val = getattr(self.zoom_input, 'double_value', zoom_val)
-        if abs(current_val - zoom_val) > 1e-3:
-            self.app.post_to_main_thread(self.window, lambda: setattr(self.zoom_input, 'double_value', zoom_val))
-
-        self.app.post_to_main_thread(self.window, self._update_display_images)
+        self._set_zoom(zoom_val)
+        self._request_redraw()
 
     def _on_key(self, event):
         if event.type == gui.KeyEvent.Type.DOWN:
@@ -153,12 +251,26 @@ class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, Disp
             elif event.key == gui.KeyName.P:
                 self._on_prev()
                 return True
+            elif event.key == gui.KeyName.J:
+                self._on_next_incomplete()
+                return True
             elif event.key == gui.KeyName.U:
                 self._toggle_delete_mode()
                 return True
             elif event.key == gui.KeyName.D:
                 self._on_delete_single()
                 return True
+            elif event.key == gui.KeyName.A:
+                self.btn_assist.is_on = not self.btn_assist.is_on
+                self._toggle_assist_mode()
+                return True
+            elif event.key == gui.KeyName.F:
+                self.btn_profile.is_on = not self.btn_profile.is_on
+                self._toggle_profiling()
+                return True
+            elif event.key == gui.KeyName.ENTER:
+                self._accept_proposal()
+                return True
 
         return False
 
@@ -178,6 +290,71 @@ class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, Disp
 
         self.window.set_needs_layout()
 
+    def _toggle_assist_mode(self):
+        self.assist_mode = self.btn_assist.is_on
+        self.proposal = None
+        print(f"Match assist {'on' if self.assist_mode else 'off'}")
+        self._request_redraw(False)
+
+    def _toggle_profiling(self):
+        profiler.enable(self.btn_profile.is_on)
+        print(f"Profiling {'on' if profiler.enabled else 'off'}")
+        self._request_redraw()
+
+    def _on_dump_profile(self):
+        path, trace_path = self._dump_profile()
+        self._show_message("Profile", f"Saved {path}\nChrome trace: {trace_path}")
+
+    def _dump_profile(self):
+        stamp = time.strftime("%Y%m%d_%H%M%S")
+        path = os.path.join(self.output_dir, f"profile_{stamp}.json")
+        trace_path = os.path.join(self.output_dir, f"profile_{stamp}.trace.json")
+        profiler.dump(path)
+        profiler.dump(trace_path, chrome_trace=True)
+        print(f"Profile saved to {path} and {trace_path}")
+        for line in profiler.summary_lines():
+            print(f"  {line}")
+        return path, trace_path
+
+    def _compact_journal(self, wait=False):
+        def on_error(e):
+            self.app.post_to_main_thread(self.window, lambda: self._show_message(
+                "Error", f"Failed to write the journal snapshot: {e}\nEdits are still kept in the journal."))
+
+        self.journal.compact(self.annotations.snapshot(), dict(self.image_metadata), dict(self.cameras), self.points3d,
+                             wait, on_error)
+
+    def _compact_journal_if_needed(self):
+        if self.journal.needs_compaction():
+            self._compact_journal()
+
+    def _start_job(self, name, work, on_done, on_error=None):
+        def on_failed(e):
+            self._set_status(f"{name} failed")
+            if on_error is not None:
+                on_error(e)
+            else:
+                self._show_message("Error", f"{name} failed: {e}")
+
+        def on_finished(result):
+            self._set_status(f"{name} done")
+            on_done(result)
+
+        job = self.jobs.submit(name, work, on_finished, on_failed,
+                               on_cancelled=lambda: self._set_status(f"{name} cancelled"),
+                               on_progress=lambda j: self._set_status(f"{j.message}: {int(100 * j.fraction)}%", True))
+        if job is None:
+            self._show_message("Busy", f"Cannot start '{name}' while '{self.jobs.current.name}' is running.")
+            return None
+
+        self._set_status(f"{name}...", True)
+        return job
+
+    def _set_status(self, text, running=False):
+        self.status_label.text = text
+        self.btn_cancel_job.enabled = running and self.jobs.busy
+        self.window.set_needs_layout()
+
     def _show_message(self, title, msg):
         dlg = gui.Dialog(title)
         layout = gui.Vert(10, gui.Margins(10, 10, 10, 10))
@@ -190,3 +367,17 @@ class ManualFeatureAnnotator(FileIOMixin, AnnotationMixin, NavigationMixin, Disp
 
     def run(self):
         self.app.run()
+        self.close()
+
+    def close(self):
+        if profiler.enabled:
+            self._dump_profile()
+        print(f"Image cache stats: {self.image_cache.stats()}")
+        self.image_cache.close()
+        self.pyramids.close()
+        self.project.save()
+        self.jobs.close()
+        if self.journal.records:
+            self._compact_journal()
+        self.journal.close()
+        self.descriptor_file.close()
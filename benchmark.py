@@ -0,0 +1,382 @@
+import contextlib
+import gc
+import json
+import os
+import platform
+import queue
+import shutil
+import statistics
+import sys
+import time
+import tracemalloc
+
+import cv2
+import numpy as np
+
+from .annotator import ManualFeatureAnnotator
+from .constants import BENCH_CASES, BENCH_DECODED_IMAGES, BENCH_EDITS, BENCH_REPEAT
+from .jobs import JobRunner
+from .layers import PaneLayers
+from .profiling import ProfiledApp, profiler
+from .scheduler import RedrawScheduler
+
+try:
+    import resource
+except ImportError:  # not available on Windows
+    resource = None
+
+_WIDGETS = ('id_input', 'zoom_input', 'info_label', 'status_label', 'btn_cancel_job', 'btn_assist',
+            'left_label', 'right_label', 'left_widget', 'right_widget')
+
+
+class HeadlessApp:
+    """Stand-in for gui.Application: posted callables wait in a queue until ``process`` runs them."""
+
+    def __init__(self):
+        self._queue = queue.SimpleQueue()
+
+    def post_to_main_thread(self, window, fn):
+        self._queue.put(fn)
+
+    def process(self, timeout=0.0):
+        # Runs everything posted so far, waiting up to ``timeout`` for the first callable.
+        ran = 0
+        try:
+            fn = self._queue.get(timeout=timeout) if timeout else self._queue.get_nowait()
+            while True:
+                fn()
+                ran += 1
+                fn = self._queue.get_nowait()
+        except queue.Empty:
+            return ran
+
+
+class HeadlessWindow:
+    def __init__(self):
+        self.title = "headless"
+        self.layouts = 0
+
+    def set_needs_layout(self):
+        self.layouts += 1
+
+    def show_dialog(self, dialog):
+        pass
+
+    def close_dialog(self):
+        pass
+
+
+class HeadlessWidget:
+    """Labels, inputs and image widgets reduced to the attributes the annotator sets."""
+
+    def __init__(self):
+        self.text = ""
+        self.int_value = 0
+        self.double_value = 0.0
+        self.enabled = True
+        self.is_on = False
+        self.image = None
+        self.updates = 0
+
+    def update_image(self, img):
+        self.image = img
+        self.updates += 1
+
+
+class HeadlessAnnotator(ManualFeatureAnnotator):
+    """The annotator without a window; GUI-thread callbacks run when ``app.process`` is called."""
+
+    def _create_window(self, max_fps):
+        self.app = ProfiledApp(HeadlessApp())
+        self.window = HeadlessWindow()
+        self.redraw_scheduler = RedrawScheduler(self.app, self.window, self._render_panes, max_fps)
+        self.jobs = JobRunner(lambda fn: self.app.post_to_main_thread(self.window, fn))
+        self.messages = []
+        for name in _WIDGETS:
+            setattr(self, name, HeadlessWidget())
+
+    def _set_o3d_image(self, widget, img_rgb):
+        widget.update_image(img_rgb)
+
+    def _show_message(self, title, msg):
+        self.messages.append((title, msg))
+
+    def wait_idle(self):
+        # Runs posted callbacks until no job is left, then waits for journal compaction.
+        while True:
+            busy = self.jobs.busy
+            if not self.app.process(0.01 if busy else 0.0) and not busy:
+                break
+        self.journal.wait()
+
+
+def synthetic_images_txt(path, names, points_per_image, width, height, overlap=0.6, untriangulated=0.2, seed=0):
+    """Write a COLMAP images.txt in which each image shares ``overlap`` of its 3D points with the previous one.
+
+    Cameras sit on a line with identity rotation; keypoints are uniform over the
+    image. Returns the number of observations written.
+    """
+    rng = np.random.default_rng(seed)
+    shared = int(overlap * points_per_image)
+    next_id = 1
+    previous = np.empty(0, dtype=np.int64)
+    with open(path, 'w', encoding='utf-8') as f:
+        f.write("# Image list with two lines of data per image:\n")
+        f.write("#   IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n")
+        f.write("#   POINTS2D[] as (X, Y, POINT3D_ID)\n")
+        for i, name in enumerate(names):
+            inherited = rng.permutation(previous)[:shared]
+            fresh = np.arange(next_id, next_id + points_per_image - len(inherited))
+            next_id += len(fresh)
+            previous = np.concatenate([inherited, fresh])
+
+            point3d_ids = previous.copy()
+            point3d_ids[rng.random(points_per_image) < untriangulated] = -1
+            points = np.column_stack([rng.uniform(0, width, points_per_image),
+                                      rng.uniform(0, height, points_per_image), point3d_ids])
+            f.write(f"{i + 1} 1 0 0 0 {-0.1 * i:.6f} 0 0 1 {name}\n")
+            f.write(("%.2f %.2f %d " * points_per_image % tuple(points.ravel())).rstrip() + "\n")
+    return points_per_image * len(names)
+
+
+def synthetic_image(path, width, height, seed=0):
+    # Smoothed noise: enough texture for SIFT descriptors and template matching.
+    rng = np.random.default_rng(seed)
+    small = rng.integers(0, 256, (max(height // 8, 1), max(width // 8, 1), 3), dtype=np.uint8)
+    cv2.imwrite(path, cv2.resize(small, (width, height), interpolation=cv2.INTER_CUBIC))
+
+
+def synthetic_project(root, images, points_per_image, width, height, decoded=BENCH_DECODED_IMAGES, seed=0):
+    """Image folder and text model under ``root``, regenerated only if the parameters changed.
+
+    Only the first ``decoded`` images get pixels; the others are empty files that
+    are listed but never decoded. Returns ``(image_folder, images_txt, info)``.
+    """
+    params = {'images': images, 'points_per_image': points_per_image, 'width': width, 'height': height,
+              'decoded': decoded, 'seed': seed}
+    image_folder = os.path.join(root, "images")
+    model_dir = os.path.join(root, "sparse")
+    images_txt = os.path.join(model_dir, "images.txt")
+    info_path = os.path.join(root, "project.json")
+
+    if os.path.exists(info_path):
+        with open(info_path, encoding='utf-8') as f:
+            info = json.load(f)
+        if info.get('params') == params:
+            return image_folder, images_txt, info
+        shutil.rmtree(root)
+
+    started = time.perf_counter()
+    os.makedirs(image_folder)
+    os.makedirs(model_dir)
+    names = [f"synthetic_{i:06d}.jpg" for i in range(images)]
+    for i, name in enumerate(names):
+        path = os.path.join(image_folder, name)
+        if i < decoded:
+            synthetic_image(path, width, height, seed + i)
+        else:
+            open(path, 'wb').close()
+
+    with open(os.path.join(model_dir, "cameras.txt"), 'w', encoding='utf-8') as f:
+        focal = 1.2 * max(width, height)
+        f.write(f"1 PINHOLE {width} {height} {focal} {focal} {width / 2} {height / 2}\n")
+    observations = synthetic_images_txt(images_txt, names, points_per_image, width, height, seed=seed)
+
+    info = {'params': params, 'observations': observations, 'model_bytes': os.path.getsize(images_txt),
+            'generate_s': time.perf_counter() - started}
+    with open(info_path, 'w', encoding='utf-8') as f:
+        json.dump(info, f, indent=2)
+    return image_folder, images_txt, info
+
+
+def measure(run, repeat=BENCH_REPEAT, setup=None, teardown=None):
+    """Time ``repeat`` calls of ``run(state)``, then trace one more call for its peak allocation.
+
+    ``setup()`` provides ``state`` and, like ``teardown(state)``, is not timed.
+    Output printed by the measured code is discarded.
+    """
+    seconds = []
+    peak = 0
+    with open(os.devnull, 'w') as devnull:
+        for i in range(repeat + 1):
+            state = setup() if setup is not None else None
+            gc.collect()
+            traced = i == repeat
+            if traced:
+                tracemalloc.start()
+            with contextlib.redirect_stdout(devnull):
+                started = time.perf_counter()
+                run(state)
+                elapsed = time.perf_counter() - started
+            if traced:
+                peak = tracemalloc.get_traced_memory()[1]
+                tracemalloc.stop()
+            else:
+                seconds.append(elapsed)
+            if teardown is not None:
+                with contextlib.redirect_stdout(devnull):
+                    teardown(state)
+
+    return {'repeat': repeat, 'seconds': seconds, 'median_s': statistics.median(seconds) if seconds else None,
+            'min_s': min(seconds) if seconds else None, 'peak_traced_bytes': peak}
+
+
+class BenchmarkSuite:
+    """The benchmark cases, run in order against one headless annotator on a synthetic project."""
+
+    def __init__(self, work_dir, image_folder, model_path, repeat=BENCH_REPEAT, edits=BENCH_EDITS, seed=0):
+        self.work_dir = work_dir
+        self.image_folder = image_folder
+        self.model_path = model_path
+        self.repeat = repeat
+        self.edits = edits
+        self.rng = np.random.default_rng(seed)
+
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            self.annotator = self._open(os.path.join(work_dir, "output"))
+            self.annotator._apply_import(self.annotator._parse_model(model_path))
+            self.annotator.wait_idle()
+
+    def run(self, cases=BENCH_CASES):
+        results = []
+        for case in cases:
+            result = dict(case=case, **getattr(self, f"case_{case}")())
+            results.append(result)
+            print(f"{case:14s} median {1000 * result['median_s']:10.2f} ms   min {1000 * result['min_s']:10.2f} ms   "
+                  f"peak {result['peak_traced_bytes'] / 2 ** 20:8.1f} MiB")
+        return results
+
+    def close(self):
+        with open(os.devnull, 'w') as devnull, contextlib.redirect_stdout(devnull):
+            self.annotator.close()
+
+    def _open(self, output_dir):
+        shutil.rmtree(output_dir, ignore_errors=True)
+        return HeadlessAnnotator(self.image_folder, output_dir=output_dir, max_fps=0)
+
+    def case_open(self):
+        # Reopening a project: a first, untimed open leaves the caches the timed ones find.
+        output_dir = os.path.join(self.work_dir, "output_open")
+        self._open(output_dir).close()
+        opened = []
+        return measure(lambda _: opened.append(HeadlessAnnotator(self.image_folder, output_dir=output_dir, max_fps=0)),
+                       self.repeat, teardown=lambda _: opened.pop().close())
+
+    def case_parse(self):
+        return measure(lambda _: self.annotator._parse_model(self.model_path), self.repeat)
+
+    def case_import(self):
+        # The GUI-thread part, including the snapshot it writes before returning.
+        return measure(self.annotator._apply_import, self.repeat,
+                       setup=lambda: self.annotator._parse_model(self.model_path),
+                       teardown=lambda _: self.annotator.wait_idle())
+
+    def case_export_txt(self):
+        def run(_):
+            self.annotator._on_export_images_txt()
+            self.annotator.wait_idle()
+
+        return measure(run, self.repeat)
+
+    def _cold_render(self, zoom):
+        def setup():
+            annotator = self.annotator
+            annotator.view_left.fit(*annotator.view_left.image_size)
+            annotator.view_right.fit(*annotator.view_right.image_size)
+            annotator._set_zoom(zoom if zoom is not None else min(annotator.view_left.zoom, annotator.view_right.zoom))
+            annotator.pane_layers = {True: PaneLayers(), False: PaneLayers()}
+            annotator.app.process()
+
+        return measure(lambda _: self.annotator._update_display_images(), self.repeat, setup)
+
+    def case_render_fit(self):
+        return self._cold_render(None)
+
+    def case_render_1to1(self):
+        return self._cold_render(1.0)
+
+    def case_render_frame(self):
+        # Selecting another feature only redraws the transient layer over the cached markers.
+        annotator = self.annotator
+        fids = annotator.annotations.get(annotator.image_files[annotator.current_idx]).records['fid']
+
+        def setup():
+            annotator._update_display_images()
+            annotator.current_feature_id = int(self.rng.choice(fids)) if len(fids) else annotator.current_feature_id + 1
+
+        return measure(lambda _: annotator._update_display_images(), self.repeat, setup)
+
+    def case_add_point(self):
+        # Pairs of left and right clicks, each completing one feature.
+        annotator = self.annotator
+        h, w = annotator.cv_img_left.shape[:2]
+
+        def run(_):
+            for _ in range(max(self.edits // 2, 1)):
+                x, y = self.rng.uniform(40, w - 40), self.rng.uniform(40, h - 40)
+                annotator._add_feature_point(True, x, y)
+                annotator._add_feature_point(False, x + self.rng.uniform(-20, 20), y + self.rng.uniform(-20, 20))
+            annotator.app.process()
+
+        result = measure(run, self.repeat)
+        result['operations'] = 2 * max(self.edits // 2, 1)
+        return result
+
+    def case_delete_box(self):
+        # Boxes of a tenth of the image side, alternating between the panes.
+        annotator = self.annotator
+        h, w = annotator.cv_img_left.shape[:2]
+
+        def run(_):
+            for i in range(self.edits):
+                x, y = self.rng.uniform(0, 0.9 * w), self.rng.uniform(0, 0.9 * h)
+                annotator._delete_points_in_box(i % 2 == 0, x, y, x + 0.1 * w, y + 0.1 * h)
+            annotator.app.process()
+
+        result = measure(run, self.repeat)
+        result['operations'] = self.edits
+        return result
+
+
+def environment():
+    info = {'python': sys.version.split()[0], 'platform': platform.platform(), 'machine': platform.machine(),
+            'cpu_count': os.cpu_count(), 'numpy': np.__version__, 'opencv': cv2.__version__}
+    if resource is not None:
+        info['max_rss_bytes'] = resource.getrusage(resource.RUSAGE_SELF).ru_maxrss * 1024
+    return info
+
+
+def run_benchmarks(work_dir, images, points_per_image, width, height, cases=BENCH_CASES, repeat=BENCH_REPEAT,
+                   edits=BENCH_EDITS, seed=0, output=None, profile=None):
+    """Generate (or reuse) a synthetic project under ``work_dir``, run ``cases`` and return the report.
+
+    The report is also written as JSON to ``output`` if given. With ``profile``, the
+    run is profiled and its Chrome trace saved there; timings then include the
+    profiler's own overhead.
+    """
+    image_folder, model_path, project = synthetic_project(os.path.join(work_dir, "project"), images,
+                                                          points_per_image, width, height, seed=seed)
+    print(f"Project: {images} images, {project['observations']} observations, "
+          f"{project['model_bytes'] / 2 ** 20:.1f} MiB images.txt")
+
+    if profile:
+        profiler.reset()
+        profiler.enable()
+    suite = BenchmarkSuite(work_dir, image_folder, model_path, repeat, edits, seed)
+    try:
+        results = suite.run(cases)
+    finally:
+        if profile:
+            profiler.enable(False)
+        suite.close()
+        if profile:
+            profiler.dump(profile, chrome_trace=True)
+            print(f"Chrome trace written to {profile}")
+
+    report = {'created': time.strftime('%Y-%m-%dT%H:%M:%S%z'), 'environment': environment(), 'project': project,
+              'results': results}
+    if output:
+        with open(output, 'w', encoding='utf-8') as f:
+            json.dump(report, f, indent=2)
+        print(f"Results written to {output}")
+    return report
@@ -0,0 +1,245 @@
+import argparse
+import os
+import sys
+import time
+
+import numpy as np
+
+from .colmap_binary import read_model, write_cameras_bin, write_images_bin, write_points3d_bin
+from .colmap_io import iter_matches, write_images_txt, write_matches_txt
+from .constants import BENCH_CASES, BENCH_EDITS, BENCH_REPEAT, MIN_MATCHES, RECOMPUTE_WORKERS
+from .project_index import list_image_files
+from .track_index import TrackIndex
+
+EXPORT_FORMATS = ('txt', 'bin', 'database', 'features')
+
+
+class _AnyName(frozenset):
+    """Name filter that accepts every image of a model when no image folder is given."""
+
+    def __contains__(self, name):
+        return True
+
+
+def _progress(label):
+    state = {'percent': -1}
+
+    def report(done, total):
+        percent = int(100 * done / total) if total else 100
+        if percent != state['percent']:
+            state['percent'] = percent
+            end = "\n" if percent >= 100 else ""
+            print(f"\r{label}: {percent:3d}%", end=end, file=sys.stderr, flush=True)
+
+    return report
+
+
+def _load(args):
+    image_names = list_image_files(args.images) if args.images else None
+    started = time.perf_counter()
+    annotations, metadata, max_point3d_id, cameras, points3d = read_model(
+        args.model, set(image_names) if image_names is not None else _AnyName(),
+        _progress(f"Reading {os.path.basename(args.model)}"))
+    print(f"Loaded {args.model} in {time.perf_counter() - started:.2f}s")
+
+    if image_names is None:
+        image_names = sorted(set(annotations.names()) | set(metadata))
+    return image_names, annotations, metadata, max_point3d_id, cameras, points3d
+
+
+def _recompute(args, names, annotations):
+    from .descriptors import recompute_descriptors
+
+    if not args.images:
+        raise SystemExit("--recompute-descriptors needs --images")
+    checkpoint_dir = os.path.join(args.output_dir, "descriptor_checkpoint")
+    updated = 0
+    for name, records, descriptors, valid in recompute_descriptors(
+            args.images, names, annotations.snapshot(), checkpoint_dir, args.workers,
+            _progress("Recomputing descriptors")):
+        updated += annotations[name].set_descriptors(
+            records['fid'][valid], descriptors[valid], records['x'][valid], records['y'][valid])
+    print(f"Recomputed {updated} descriptors")
+
+
+def _write_bin(model_dir, names, annotations, metadata, cameras, points3d):
+    os.makedirs(model_dir, exist_ok=True)
+    write_images_bin(os.path.join(model_dir, "images.bin"), names, annotations, metadata,
+                     _progress("Writing images.bin"))
+    write_points3d_bin(os.path.join(model_dir, "points3D.bin"), names, annotations, metadata, points3d)
+    if cameras:
+        write_cameras_bin(os.path.join(model_dir, "cameras.bin"), cameras)
+
+
+def cmd_gui(args):
+    from .annotator import ManualFeatureAnnotator
+
+    if not args.images:
+        raise SystemExit("gui needs --images")
+    if args.profile:
+        from .profiling import profiler
+        profiler.enable()
+    ManualFeatureAnnotator(args.images, output_dir=args.output_dir).run()
+    return 0
+
+
+def cmd_import(args):
+    from .descriptor_pool import DescriptorFile
+    from .journal import AnnotationJournal
+
+    # The descriptor sidecar lock keeps this from replacing the journal under an open session.
+    try:
+        session = DescriptorFile(os.path.join(args.output_dir, "descriptors.u8"))
+    except RuntimeError as e:
+        raise SystemExit(str(e))
+    try:
+        names, annotations, metadata, max_point3d_id, cameras, points3d = _load(args)
+        if args.recompute_descriptors:
+            _recompute(args, names, annotations)
+        journal = AnnotationJournal(os.path.join(args.output_dir, "journal"))
+        journal.replace(annotations.snapshot(), metadata, cameras, points3d)
+        journal.close()
+    finally:
+        session.close()
+    print(f"{len(metadata)} images, {annotations.total_points()} keypoints, max 3D ID {max_point3d_id}")
+    print(f"Saved to {os.path.join(args.output_dir, 'journal')}; the annotator opens it on its next start")
+    return 0
+
+
+def cmd_export(args):
+    names, annotations, metadata, _, cameras, points3d = _load(args)
+    if args.recompute_descriptors:
+        _recompute(args, names, annotations)
+    os.makedirs(args.output_dir, exist_ok=True)
+
+    for fmt in args.format:
+        started = time.perf_counter()
+        if fmt == 'txt':
+            write_images_txt(os.path.join(args.output_dir, "corrected_images.txt"), names, annotations, metadata,
+                             _progress("Writing images.txt"))
+            pairs = write_matches_txt(os.path.join(args.output_dir, "matches.txt"),
+                                      iter_matches(names, annotations, args.min_matches))
+            print(f"Wrote {pairs} matched pairs")
+        elif fmt == 'bin':
+            _write_bin(os.path.join(args.output_dir, "sparse"), names, annotations, metadata, cameras, points3d)
+        elif fmt == 'database':
+            from .colmap_database import default_camera, export_database
+
+            fallback = default_camera(*args.camera_size) if args.camera_size else None
+            images, pairs = export_database(os.path.join(args.output_dir, "database.db"), names, annotations,
+                                            metadata, cameras, fallback, None, args.min_matches,
+                                            _progress("Writing database.db"))
+            print(f"Wrote {images} images and {pairs} matched pairs")
+        elif fmt == 'features':
+            from .colmap_features import write_feature_files
+
+            written, skipped = write_feature_files(os.path.join(args.output_dir, "features"), names, annotations,
+                                                   args.workers, _progress("Writing feature files"))
+            print(f"Wrote {written} feature files, {skipped} unchanged")
+        print(f"Exported {fmt} in {time.perf_counter() - started:.2f}s")
+    return 0
+
+
+def cmd_convert(args):
+    names, annotations, metadata, _, cameras, points3d = _load(args)
+    if args.output.lower().endswith('.bin'):
+        _write_bin(os.path.dirname(args.output) or ".", names, annotations, metadata, cameras, points3d)
+    else:
+        write_images_txt(args.output, names, annotations, metadata, _progress("Writing images.txt"))
+    print(f"Converted {args.model} -> {args.output}")
+    return 0
+
+
+def cmd_stats(args):
+    names, annotations, metadata, max_point3d_id, cameras, _ = _load(args)
+    point3d_ids = [ann.records['point3d_id'] for _, ann in annotations.items()]
+    point3d_ids = np.concatenate(point3d_ids) if point3d_ids else np.empty(0, np.int64)
+    observed = point3d_ids[point3d_ids > 0]
+
+    print(f"images:        {len(names)} ({len(metadata)} in model)")
+    print(f"keypoints:     {annotations.total_points()}")
+    print(f"observations:  {len(observed)}")
+    print(f"3D points:     {len(np.unique(observed))} (max ID {max_point3d_id})")
+    print(f"max feature:   {annotations.max_feature_id()}")
+    tracks = TrackIndex(names, 'point3d_id')
+    tracks.refresh(annotations)
+    print(f"single-image:  {len(tracks.under_observed())} 3D points observed in only one image")
+    print(f"cameras:       {len(cameras)}")
+    if args.pairs:
+        pairs = sum(1 for _ in iter_matches(names, annotations, args.min_matches))
+        print(f"matched pairs: {pairs}")
+    return 0
+
+
+def cmd_bench(args):
+    from .benchmark import run_benchmarks
+
+    width, height = args.resolution
+    run_benchmarks(args.work_dir, args.image_count, args.points_per_image, width, height, args.cases,
+                   args.repeat, args.edits, args.seed, args.output, args.profile)
+    return 0
+
+
+def build_parser():
+    parser = argparse.ArgumentParser(prog="manual_annotation",
+                                     description="Manual SfM feature annotation and COLMAP conversion.")
+    common = argparse.ArgumentParser(add_help=False)
+    common.add_argument("--images", help="image folder; restricts the model to these images")
+    common.add_argument("--output-dir", default="colmap_manual_output")
+    common.add_argument("--workers", type=int, default=RECOMPUTE_WORKERS)
+    common.add_argument("--min-matches", type=int, default=MIN_MATCHES)
+
+    subparsers = parser.add_subparsers(dest="command", required=True)
+
+    gui = subparsers.add_parser("gui", parents=[common], help="open the annotation window")
+    gui.add_argument("--profile", action="store_true",
+                     help="start with profiling on; the log is saved to output-dir on exit")
+    gui.set_defaults(func=cmd_gui)
+
+    model_args = argparse.ArgumentParser(add_help=False)
+    model_args.add_argument("model", help="COLMAP images.txt or images.bin")
+
+    import_ = subparsers.add_parser("import", parents=[common, model_args],
+                                    help="read a model into output-dir for the annotator, optionally with recomputed descriptors")
+    import_.add_argument("--recompute-descriptors", action="store_true")
+    import_.set_defaults(func=cmd_import)
+
+    export = subparsers.add_parser("export", parents=[common, model_args], help="export a model to output-dir")
+    export.add_argument("--format", nargs="+", choices=EXPORT_FORMATS, default=['txt'])
+    export.add_argument("--recompute-descriptors", action="store_true")
+    export.add_argument("--camera-size", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"),
+                        help="image size for a default camera when the model has no cameras")
+    export.set_defaults(func=cmd_export)
+
+    convert = subparsers.add_parser("convert", parents=[common, model_args],
+                                    help="convert between images.txt and images.bin")
+    convert.add_argument("output", help="target images.txt or images.bin")
+    convert.set_defaults(func=cmd_convert)
+
+    stats = subparsers.add_parser("stats", parents=[common, model_args], help="print model statistics")
+    stats.add_argument("--pairs", action="store_true", help="also count matched image pairs")
+    stats.set_defaults(func=cmd_stats)
+
+    bench = subparsers.add_parser("bench", help="time the annotator headlessly on a synthetic project")
+    bench.add_argument("--work-dir", default="bench_work", help="synthetic project and annotator output")
+    bench.add_argument("--image-count", type=int, default=100)
+    bench.add_argument("--points-per-image", type=int, default=1000)
+    bench.add_argument("--resolution", type=int, nargs=2, metavar=("WIDTH", "HEIGHT"), default=[4000, 3000])
+    bench.add_argument("--cases", nargs="+", choices=BENCH_CASES, default=list(BENCH_CASES))
+    bench.add_argument("--repeat", type=int, default=BENCH_REPEAT)
+    bench.add_argument("--edits", type=int, default=BENCH_EDITS, help="operations per add/delete run")
+    bench.add_argument("--seed", type=int, default=0)
+    bench.add_argument("--output", default="bench_results.json", help="JSON results file")
+    bench.add_argument("--profile", help="also profile the run and save a Chrome trace here")
+    bench.set_defaults(func=cmd_bench)
+
+    return parser
+
+
+def main(argv=None):
+    args = build_parser().parse_args(argv)
+    return args.func(args)
+
+
+if __name__ == "__main__":
+    sys.exit(main())
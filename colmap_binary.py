@@ -0,0 +1,253 @@
+import mmap
+import os
+import struct
+
+import numpy as np
+
+from .annotation_store import AnnotationStore
+from .colmap_io import atomic_open, read_cameras_txt, read_images_txt, resolve_image_name
+from .constants import PROGRESS_BYTES
+from .profiling import profiled
+
+# Number of parameters per COLMAP camera model id.
+CAMERA_MODEL_NUM_PARAMS = {
+    0: 3,   # SIMPLE_PINHOLE
+    1: 4,   # PINHOLE
+    2: 4,   # SIMPLE_RADIAL
+    3: 5,   # RADIAL
+    4: 8,   # OPENCV
+    5: 8,   # OPENCV_FISHEYE
+    6: 12,  # FULL_OPENCV
+    7: 5,   # FOV
+    8: 4,   # SIMPLE_RADIAL_FISHEYE
+    9: 5,   # RADIAL_FISHEYE
+    10: 12,  # THIN_PRISM_FISHEYE
+}
+
+POINT2D_DTYPE = np.dtype([('x', '<f8'), ('y', '<f8'), ('point3d_id', '<i8')])
+TRACK_ELEMENT_DTYPE = np.dtype([('image_id', '<i4'), ('point2d_idx', '<i4')])
+
+_IMAGE_HEADER = struct.Struct('<i4d3di')
+_CAMERA_HEADER = struct.Struct('<iiQQ')
+_POINT3D_HEADER = struct.Struct('<Q3d3BdQ')
+_UINT64 = struct.Struct('<Q')
+
+
+def _open_mapped(path):
+    # Empty files cannot be mapped; callers treat them as empty models.
+    f = open(path, 'rb')
+    if os.fstat(f.fileno()).st_size == 0:
+        f.close()
+        return None, None
+    return f, mmap.mmap(f.fileno(), 0, access=mmap.ACCESS_READ)
+
+
+def image_id_for(idx, name, metadata):
+    entry = metadata.get(name)
+    return int(entry['IMAGE_ID']) if entry is not None else idx + 1
+
+
+def read_cameras_bin(path):
+    cameras = {}
+    with open(path, 'rb') as f:
+        data = f.read()
+
+    (num_cameras,) = _UINT64.unpack_from(data, 0)
+    offset = _UINT64.size
+    for _ in range(num_cameras):
+        camera_id, model_id, width, height = _CAMERA_HEADER.unpack_from(data, offset)
+        offset += _CAMERA_HEADER.size
+        num_params = CAMERA_MODEL_NUM_PARAMS[model_id]
+        params = struct.unpack_from(f'<{num_params}d', data, offset)
+        offset += 8 * num_params
+        cameras[camera_id] = {'MODEL_ID': model_id, 'WIDTH': width, 'HEIGHT': height, 'PARAMS': list(params)}
+    return cameras
+
+
+def write_cameras_bin(path, cameras):
+    with atomic_open(path, 'wb') as f:
+        f.write(_UINT64.pack(len(cameras)))
+        for camera_id in sorted(cameras):
+            camera = cameras[camera_id]
+            f.write(_CAMERA_HEADER.pack(camera_id, camera['MODEL_ID'], camera['WIDTH'], camera['HEIGHT']))
+            f.write(np.asarray(camera['PARAMS'], dtype='<f8').tobytes())
+
+
+@profiled("colmap.read_images_bin")
+def read_images_bin(path, image_names, progress=None):
+    """Read a COLMAP images.bin through a memory map.
+
+    POINTS2D blocks are viewed in place with ``np.frombuffer`` and copied once,
+    column-wise, into the AnnotationStore. Returns the same
+    ``(annotations, metadata, max_point3d_id)`` triple as ``read_images_txt``.
+    """
+    known_names = image_names if isinstance(image_names, (set, frozenset, dict)) else set(image_names)
+
+    annotations = AnnotationStore()
+    metadata = {}
+    max_point3d_id = 0
+    feature_id_counter = 1
+
+    f, mm = _open_mapped(path)
+    if mm is None:
+        return annotations, metadata, max_point3d_id
+
+    try:
+        total_bytes = len(mm)
+        last_report = 0
+        (num_images,) = _UINT64.unpack_from(mm, 0)
+        offset = _UINT64.size
+
+        for _ in range(num_images):
+            image_id, qw, qx, qy, qz, tx, ty, tz, camera_id = _IMAGE_HEADER.unpack_from(mm, offset)
+            offset += _IMAGE_HEADER.size
+            name_end = mm.find(b'\0', offset)
+            image_name = mm[offset:name_end].decode('utf-8')
+            offset = name_end + 1
+
+            (num_points,) = _UINT64.unpack_from(mm, offset)
+            offset += _UINT64.size
+            points = np.frombuffer(mm, dtype=POINT2D_DTYPE, count=num_points, offset=offset)
+            offset += num_points * POINT2D_DTYPE.itemsize
+
+            matched_name = resolve_image_name(image_name, known_names)
+            if matched_name is not None:
+                metadata[matched_name] = {
+                    'QW': qw, 'QX': qx, 'QY': qy, 'QZ': qz,
+                    'TX': tx, 'TY': ty, 'TZ': tz,
+                    'CAMERA_ID': camera_id,
+                    'IMAGE_ID': image_id
+                }
+                annotations[matched_name].extend(
+                    np.arange(feature_id_counter, feature_id_counter + num_points),
+                    points['x'], points['y'], points['point3d_id']
+                )
+                feature_id_counter += num_points
+                if num_points:
+                    max_point3d_id = max(max_point3d_id, int(points['point3d_id'].max()))
+            # Drop the view before the next block so the mapping can be closed afterwards.
+            del points
+
+            if progress is not None and offset - last_report >= PROGRESS_BYTES:
+                progress(offset, total_bytes)
+                last_report = offset
+
+        if progress is not None:
+            progress(total_bytes, total_bytes)
+    finally:
+        mm.close()
+        f.close()
+
+    return annotations, metadata, max_point3d_id
+
+
+@profiled("colmap.write_images_bin")
+def write_images_bin(path, names, annotations, metadata, progress=None):
+    with atomic_open(path, 'wb') as f:
+        f.write(_UINT64.pack(len(names)))
+        for idx, name in enumerate(names):
+            entry = metadata.get(name)
+            if entry is None:
+                pose = (1.0, 0.0, 0.0, 0.0, 0.0, 0.0, 0.0)
+                camera_id = 1
+            else:
+                pose = tuple(float(entry[key]) for key in ('QW', 'QX', 'QY', 'QZ', 'TX', 'TY', 'TZ'))
+                camera_id = int(entry['CAMERA_ID'])
+
+            f.write(_IMAGE_HEADER.pack(image_id_for(idx, name, metadata), *pose, camera_id))
+            f.write(name.encode('utf-8') + b'\0')
+
+            records = annotations.get(name).records
+            points = np.empty(len(records), dtype=POINT2D_DTYPE)
+            points['x'] = records['x']
+            points['y'] = records['y']
+            points['point3d_id'] = records['point3d_id']
+            f.write(_UINT64.pack(len(points)))
+            f.write(points.tobytes())
+
+            if progress is not None:
+                progress(idx + 1, len(names))
+
+    return len(names)
+
+
+def read_points3d_bin(path):
+    """Read point positions, colours and errors; tracks are skipped (they live in images.bin)."""
+    f, mm = _open_mapped(path)
+    if mm is None:
+        return {}
+
+    points3d = {}
+    try:
+        (num_points,) = _UINT64.unpack_from(mm, 0)
+        offset = _UINT64.size
+        for _ in range(num_points):
+            point3d_id, x, y, z, r, g, b, error, track_length = _POINT3D_HEADER.unpack_from(mm, offset)
+            offset += _POINT3D_HEADER.size + track_length * TRACK_ELEMENT_DTYPE.itemsize
+            points3d[point3d_id] = (x, y, z, r, g, b, error)
+    finally:
+        mm.close()
+        f.close()
+    return points3d
+
+
+def write_points3d_bin(path, names, annotations, metadata, points3d=None):
+    # Tracks are rebuilt from the annotations; positions come from an imported
+    # points3D.bin when available and are left at the origin with error -1 otherwise.
+    points3d = points3d or {}
+    image_ids, point3d_ids, kp_idx = [], [], []
+    for idx, name in enumerate(names):
+        image_point3d = annotations.get(name).records['point3d_id']
+        observed = np.flatnonzero(image_point3d > 0)
+        image_ids.append(np.full(len(observed), image_id_for(idx, name, metadata), dtype=np.int32))
+        point3d_ids.append(image_point3d[observed])
+        kp_idx.append(observed.astype(np.int32))
+
+    image_ids = np.concatenate(image_ids) if image_ids else np.empty(0, np.int32)
+    point3d_ids = np.concatenate(point3d_ids) if point3d_ids else np.empty(0, np.int64)
+    kp_idx = np.concatenate(kp_idx) if kp_idx else np.empty(0, np.int32)
+
+    order = np.argsort(point3d_ids, kind='stable')
+    image_ids, point3d_ids, kp_idx = image_ids[order], point3d_ids[order], kp_idx[order]
+    unique_ids, starts, counts = np.unique(point3d_ids, return_index=True, return_counts=True)
+
+    track = np.empty(len(point3d_ids), dtype=TRACK_ELEMENT_DTYPE)
+    track['image_id'] = image_ids
+    track['point2d_idx'] = kp_idx
+
+    with atomic_open(path, 'wb') as f:
+        f.write(_UINT64.pack(len(unique_ids)))
+        for point3d_id, start, count in zip(unique_ids.tolist(), starts.tolist(), counts.tolist()):
+            x, y, z, r, g, b, error = points3d.get(point3d_id, (0.0, 0.0, 0.0, 0, 0, 0, -1.0))
+            f.write(_POINT3D_HEADER.pack(point3d_id, x, y, z, r, g, b, error, count))
+            f.write(track[start:start + count].tobytes())
+
+    return len(unique_ids)
+
+
+def read_cameras(model_dir, binary=True):
+    # cameras.bin or cameras.txt next to the images file; the images file's own format wins.
+    readers = [("cameras.bin", read_cameras_bin), ("cameras.txt", read_cameras_txt)]
+    for name, reader in (readers if binary else readers[::-1]):
+        path = os.path.join(model_dir, name)
+        if os.path.exists(path):
+            return reader(path)
+    return {}
+
+
+def read_model(path, image_names, progress=None):
+    """Read an images.txt or images.bin plus the cameras.bin/.txt next to it; a binary
+    model also picks up points3D.bin.
+
+    Returns ``(annotations, metadata, max_point3d_id, cameras, points3d)``.
+    """
+    model_dir = os.path.dirname(path)
+    binary = path.lower().endswith('.bin')
+    cameras = read_cameras(model_dir, binary)
+    if not binary:
+        return read_images_txt(path, image_names, progress) + (cameras, {})
+
+    points3d_path = os.path.join(model_dir, "points3D.bin")
+    annotations, metadata, max_point3d_id = read_images_bin(path, image_names, progress)
+    points3d = read_points3d_bin(points3d_path) if os.path.exists(points3d_path) else {}
+    return annotations, metadata, max_point3d_id, cameras, points3d
@@ -0,0 +1,176 @@
+import sqlite3
+
+import numpy as np
+
+from .colmap_binary import image_id_for
+from .colmap_io import iter_matches
+from .constants import MIN_MATCHES
+
+MAX_IMAGE_ID = 2 ** 31 - 1
+SIMPLE_RADIAL = 2
+# Pose prior columns of images tables written before COLMAP 3.9, which dropped them.
+PRIOR_COLUMNS = ('prior_qw', 'prior_qx', 'prior_qy', 'prior_qz', 'prior_tx', 'prior_ty', 'prior_tz')
+
+CREATE_TABLES = """
+CREATE TABLE IF NOT EXISTS cameras (
+    camera_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    model INTEGER NOT NULL,
+    width INTEGER NOT NULL,
+    height INTEGER NOT NULL,
+    params BLOB,
+    prior_focal_length INTEGER NOT NULL);
+CREATE TABLE IF NOT EXISTS images (
+    image_id INTEGER PRIMARY KEY AUTOINCREMENT NOT NULL,
+    name TEXT NOT NULL UNIQUE,
+    camera_id INTEGER NOT NULL,
+    prior_qw REAL, prior_qx REAL, prior_qy REAL, prior_qz REAL,
+    prior_tx REAL, prior_ty REAL, prior_tz REAL,
+    CONSTRAINT image_id_check CHECK(image_id >= 0 and image_id < 2147483647),
+    FOREIGN KEY(camera_id) REFERENCES cameras(camera_id));
+CREATE TABLE IF NOT EXISTS keypoints (
+    image_id INTEGER PRIMARY KEY NOT NULL,
+    rows INTEGER NOT NULL,
+    cols INTEGER NOT NULL,
+    data BLOB,
+    FOREIGN KEY(image_id) REFERENCES images(image_id) ON DELETE CASCADE);
+CREATE TABLE IF NOT EXISTS descriptors (
+    image_id INTEGER PRIMARY KEY NOT NULL,
+    rows INTEGER NOT NULL,
+    cols INTEGER NOT NULL,
+    data BLOB,
+    FOREIGN KEY(image_id) REFERENCES images(image_id) ON DELETE CASCADE);
+CREATE TABLE IF NOT EXISTS matches (
+    pair_id INTEGER PRIMARY KEY NOT NULL,
+    rows INTEGER NOT NULL,
+    cols INTEGER NOT NULL,
+    data BLOB);
+CREATE TABLE IF NOT EXISTS two_view_geometries (
+    pair_id INTEGER PRIMARY KEY NOT NULL,
+    rows INTEGER NOT NULL,
+    cols INTEGER NOT NULL,
+    data BLOB,
+    config INTEGER NOT NULL,
+    F BLOB, E BLOB, H BLOB, qvec BLOB, tvec BLOB);
+CREATE UNIQUE INDEX IF NOT EXISTS index_name ON images(name);
+"""
+
+
+def pair_id(image_id1, image_id2):
+    if image_id1 > image_id2:
+        image_id1, image_id2 = image_id2, image_id1
+    return image_id1 * MAX_IMAGE_ID + image_id2
+
+
+def default_camera(width, height):
+    # Same defaults COLMAP uses for an unknown SIMPLE_RADIAL camera.
+    focal = 1.2 * max(width, height)
+    return {'MODEL_ID': SIMPLE_RADIAL, 'WIDTH': width, 'HEIGHT': height,
+            'PARAMS': [focal, width / 2.0, height / 2.0, 0.0]}
+
+
+def keypoints_blob(records):
+    # COLMAP's 4-column layout: x, y, scale, orientation (radians).
+    keypoints = np.empty((len(records), 4), dtype=np.float32)
+    keypoints[:, 0] = records['x']
+    keypoints[:, 1] = records['y']
+    keypoints[:, 2] = records['size']
+    keypoints[:, 3] = np.deg2rad(records['angle'])
+    return keypoints.tobytes()
+
+
+def export_database(db_path, names, annotations, metadata, cameras, fallback_camera=None,
+                    changed=None, min_matches=MIN_MATCHES, progress=None):
+    """Write keypoints, descriptors and raw matches into a COLMAP database.db.
+
+    Everything happens in one transaction with batched ``executemany`` calls.
+    ``changed`` restricts the upsert to those image names (``None`` writes all);
+    matches are rewritten for every pair touching a changed image. Returns
+    ``(images_written, pairs_written)``.
+    """
+    changed_names = set(names) if changed is None else set(changed) & set(names)
+
+    connection = sqlite3.connect(db_path)
+    try:
+        with connection:
+            connection.executescript(CREATE_TABLES)
+
+            # Reuse the ids COLMAP already assigned; otherwise prefer the model's image id.
+            db_ids = dict(connection.execute("SELECT name, image_id FROM images"))
+            used_ids = set(db_ids.values())
+            known_cameras = {row[0] for row in connection.execute("SELECT camera_id FROM cameras")}
+            # An existing database keeps the images schema of the COLMAP version that made it.
+            image_columns = {row[1] for row in connection.execute("PRAGMA table_info(images)")}
+            priors = [column in image_columns for column in PRIOR_COLUMNS]
+            columns = ('image_id', 'name', 'camera_id') + tuple(c for c, used in zip(PRIOR_COLUMNS, priors) if used)
+
+            image_rows = []
+            for idx, name in enumerate(names):
+                if name in db_ids:
+                    continue
+                image_id = image_id_for(idx, name, metadata)
+                if image_id in used_ids:
+                    image_id = max(used_ids) + 1
+                used_ids.add(image_id)
+                db_ids[name] = image_id
+
+                entry = metadata.get(name)
+                camera_id = int(entry['CAMERA_ID']) if entry is not None else 1
+                pose = [float(entry[key]) for key in ('QW', 'QX', 'QY', 'QZ', 'TX', 'TY', 'TZ')] \
+                    if entry is not None else [None] * 7
+                image_rows.append((image_id, name, camera_id, *[v for v, used in zip(pose, priors) if used]))
+
+            camera_rows = []
+            for camera_id in sorted({row[2] for row in image_rows} - known_cameras):
+                camera = cameras.get(camera_id, fallback_camera)
+                if camera is None:
+                    raise ValueError(f"No intrinsics known for camera {camera_id}")
+                camera_rows.append((camera_id, camera['MODEL_ID'], camera['WIDTH'], camera['HEIGHT'],
+                                    np.asarray(camera['PARAMS'], dtype=np.float64).tobytes(), 0))
+
+            connection.executemany("INSERT INTO cameras (camera_id, model, width, height, params, prior_focal_length) "
+                                   "VALUES (?, ?, ?, ?, ?, ?)", camera_rows)
+            connection.executemany(f"INSERT INTO images ({', '.join(columns)}) "
+                                   f"VALUES ({', '.join('?' * len(columns))})", image_rows)
+
+            def feature_rows(table):
+                for i, name in enumerate(sorted(changed_names)):
+                    annotations_image = annotations.get(name)
+                    if table == 'keypoints':
+                        data = keypoints_blob(annotations_image.records)
+                        cols = 4
+                    else:
+                        data = annotations_image.descriptors().tobytes()
+                        cols = 128
+                        if progress is not None:
+                            progress(i + 1, len(changed_names))
+                    yield db_ids[name], len(annotations_image), cols, data
+
+            connection.executemany("INSERT OR REPLACE INTO keypoints VALUES (?, ?, ?, ?)", feature_rows('keypoints'))
+            connection.executemany("INSERT OR REPLACE INTO descriptors VALUES (?, ?, ?, ?)", feature_rows('descriptors'))
+
+            # Drop stale matches of changed images before writing the current ones.
+            if changed is None:
+                connection.execute("DELETE FROM matches")
+            else:
+                connection.executemany(
+                    "DELETE FROM matches WHERE pair_id / ? = ? OR pair_id % ? = ?",
+                    [(MAX_IMAGE_ID, db_ids[name], MAX_IMAGE_ID, db_ids[name]) for name in changed_names])
+
+            pairs_written = [0]
+
+            def match_rows():
+                for name_i, name_j, kp_i, kp_j in iter_matches(names, annotations, min_matches):
+                    if name_i not in changed_names and name_j not in changed_names:
+                        continue
+                    id_i, id_j = db_ids[name_i], db_ids[name_j]
+                    if id_i > id_j:
+                        kp_i, kp_j = kp_j, kp_i
+                    data = np.column_stack((kp_i, kp_j)).astype(np.uint32)
+                    pairs_written[0] += 1
+                    yield pair_id(id_i, id_j), len(data), 2, data.tobytes()
+
+            connection.executemany("INSERT OR REPLACE INTO matches VALUES (?, ?, ?, ?)", match_rows())
+    finally:
+        connection.close()
+
+    return len(changed_names), pairs_written[0]
@@ -0,0 +1,151 @@
+import hashlib
+import json
+import multiprocessing
+import os
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+from .constants import FEATURE_WRITE_ROWS, RECOMPUTE_WORKERS
+
+MANIFEST_NAME = "features_manifest.json"
+
+# " 0" .. " 255" padded to four bytes, and which of those bytes are used: descriptor
+# values are formatted by table lookup, a whole chunk at a time.
+_VALUE_TOKENS = np.array([f" {v}".encode('ascii') for v in range(256)], dtype='S4')
+_VALUE_USED = np.arange(4) < np.char.str_len(_VALUE_TOKENS)[:, None]
+
+
+def feature_keypoints(records):
+    # x, y, scale and orientation in radians, as read by COLMAP's feature importer.
+    keypoints = np.empty((len(records), 4), dtype=np.float64)
+    keypoints[:, 0] = records['x']
+    keypoints[:, 1] = records['y']
+    keypoints[:, 2] = records['size']
+    keypoints[:, 3] = np.deg2rad(records['angle'])
+    return keypoints
+
+
+def features_digest(keypoints, descriptors):
+    digest = hashlib.blake2b(digest_size=16)
+    digest.update(np.ascontiguousarray(keypoints).tobytes())
+    digest.update(np.ascontiguousarray(descriptors).tobytes())
+    return digest.hexdigest()
+
+
+def format_feature_rows(keypoints, descriptors):
+    """COLMAP text feature lines for ``(n, 4)`` keypoints and ``(n, 128)`` uint8 descriptors, as bytes.
+
+    The lines are assembled in one byte matrix of fixed-width fields, and a single
+    mask drops the padding; only the four keypoint floats of a row go through
+    Python's float formatting.
+    """
+    n = len(keypoints)
+    if n == 0:
+        return b""
+    heads = np.array(["%.6f %.6f %.6f %.6f" % tuple(k) for k in keypoints.tolist()], dtype=np.bytes_)
+    values = np.asarray(descriptors, dtype=np.uint8)
+    width = heads.itemsize
+    chars = np.empty((n, width + 4 * values.shape[1] + 1), dtype=np.uint8)
+    chars[:, :width] = heads.view(np.uint8).reshape(n, width)
+    chars[:, width:-1] = _VALUE_TOKENS[values].view(np.uint8).reshape(n, -1)
+    chars[:, -1] = ord("\n")
+    keep = np.empty(chars.shape, dtype=bool)
+    keep[:, :width] = np.arange(width) < np.char.str_len(heads)[:, None]
+    keep[:, width:-1] = _VALUE_USED[values].reshape(n, -1)
+    keep[:, -1] = True
+    return chars[keep].tobytes()
+
+
+def write_feature_file(path, keypoints, descriptors, chunk_rows=FEATURE_WRITE_ROWS):
+    """Write one ``<image>.txt`` in COLMAP's text feature format, ``chunk_rows`` lines at a time."""
+    os.makedirs(os.path.dirname(path), exist_ok=True)
+    tmp_path = path + ".tmp"
+    with open(tmp_path, 'wb') as f:
+        f.write(f"{len(keypoints)} {descriptors.shape[1]}\n".encode('ascii'))
+        for start in range(0, len(keypoints), chunk_rows):
+            f.write(format_feature_rows(keypoints[start:start + chunk_rows], descriptors[start:start + chunk_rows]))
+    os.replace(tmp_path, path)
+    return path
+
+
+def load_manifest(features_dir):
+    try:
+        with open(os.path.join(features_dir, MANIFEST_NAME)) as f:
+            return json.load(f)
+    except (OSError, ValueError):
+        return {}
+
+
+def save_manifest(features_dir, manifest):
+    path = os.path.join(features_dir, MANIFEST_NAME)
+    with open(path + ".tmp", 'w') as f:
+        json.dump(manifest, f, indent=0, sort_keys=True)
+    os.replace(path + ".tmp", path)
+
+
+def write_feature_files(features_dir, names, annotations, workers=RECOMPUTE_WORKERS, progress=None, unchanged=()):
+    """Write ``<features_dir>/<image>.txt`` for every image, skipping unchanged files.
+
+    Images in ``unchanged`` (not edited since this process last exported them) are
+    skipped without reading them. The others are compared with a manifest of
+    content hashes of what is on disk, so across sessions only images whose
+    keypoints or descriptors changed are rewritten. Changed files are formatted in
+    a process pool with at most ``2 * workers`` images in flight, from the arrays
+    already read for the hash. Returns ``(written, skipped)``.
+    """
+    os.makedirs(features_dir, exist_ok=True)
+    manifest = load_manifest(features_dir)
+    done = 0
+
+    def finished_one():
+        nonlocal done
+        done += 1
+        if progress is not None:
+            progress(done, len(names))
+
+    def changed():
+        for name in names:
+            path = os.path.join(features_dir, name + ".txt")
+            current = name in manifest and os.path.exists(path)
+            if current and name in unchanged:
+                finished_one()
+                continue
+            image_annotations = annotations.get(name)
+            keypoints = feature_keypoints(image_annotations.records)
+            descriptors = image_annotations.descriptors()
+            digest = features_digest(keypoints, descriptors)
+            if current and manifest[name] == digest:
+                finished_one()
+                continue
+            # Drop the entry first so an interrupted export never marks a stale file as current.
+            manifest.pop(name, None)
+            yield name, path, digest, keypoints, descriptors
+
+    written = 0
+    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+    try:
+        queue = changed()
+        in_flight = {}
+        while True:
+            while len(in_flight) < 2 * workers:
+                item = next(queue, None)
+                if item is None:
+                    break
+                name, path, digest, keypoints, descriptors = item
+                in_flight[executor.submit(write_feature_file, path, keypoints, descriptors)] = (name, digest)
+            if not in_flight:
+                break
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, digest = in_flight.pop(future)
+                future.result()
+                manifest[name] = digest
+                written += 1
+                finished_one()
+    finally:
+        executor.shutdown(wait=False, cancel_futures=True)
+        save_manifest(features_dir, manifest)
+
+    return written, len(names) - written
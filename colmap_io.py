@@ -0,0 +1,281 @@
+import os
+import warnings
+from contextlib import ExitStack, contextmanager
+
+import numpy as np
+
+from .annotation_store import AnnotationStore
+from .constants import MIN_MATCHES, READ_CHUNK_BYTES, PROGRESS_BYTES
+from .profiling import profiled
+
+# COLMAP camera model names as written in cameras.txt, by model id.
+CAMERA_MODEL_IDS = {
+    'SIMPLE_PINHOLE': 0, 'PINHOLE': 1, 'SIMPLE_RADIAL': 2, 'RADIAL': 3, 'OPENCV': 4,
+    'OPENCV_FISHEYE': 5, 'FULL_OPENCV': 6, 'FOV': 7, 'SIMPLE_RADIAL_FISHEYE': 8,
+    'RADIAL_FISHEYE': 9, 'THIN_PRISM_FISHEYE': 10,
+}
+
+
+@contextmanager
+def atomic_open(path, mode='w'):
+    """Write through ``path + ".tmp"``, which replaces ``path`` only if the block completes.
+
+    On an error or a cancelled job the temporary file is removed and the previous
+    export at ``path`` is left as it was.
+    """
+    tmp_path = path + ".tmp"
+    try:
+        with open(tmp_path, mode) as f:
+            yield f
+        os.replace(tmp_path, path)
+    except BaseException:
+        try:
+            os.remove(tmp_path)
+        except OSError:
+            pass
+        raise
+
+
+def resolve_image_name(image_name, known_names):
+    # COLMAP may store paths relative to its image root; fall back to the file name.
+    if image_name in known_names:
+        return image_name
+    base_name = os.path.basename(image_name)
+    if base_name in known_names:
+        return base_name
+    return None
+
+
+def parse_points2d(line):
+    """Parse one POINTS2D line into (xs, ys, point3d_ids), or None if malformed."""
+    with warnings.catch_warnings():
+        warnings.simplefilter("error", DeprecationWarning)
+        try:
+            values = np.fromstring(line, dtype=np.float64, sep=' ')
+        except (DeprecationWarning, ValueError):
+            values = None
+
+    if values is not None and values.size % 3 == 0:
+        values = values.reshape(-1, 3)
+        point3d_ids = values[:, 2]
+        # IDs must be exact integers; a token like "3.7" goes to the slow path, which skips its keypoint.
+        if np.all((point3d_ids == np.rint(point3d_ids)) & (np.abs(point3d_ids) < 2 ** 53)):
+            return values[:, 0].copy(), values[:, 1].copy(), point3d_ids.astype(np.int64)
+
+    # Slow path with the old per-keypoint semantics: skip unparsable keypoints.
+    tokens = line.split()
+    if len(tokens) % 3 != 0:
+        return None
+    xs, ys, point3d_ids = [], [], []
+    for j in range(0, len(tokens), 3):
+        try:
+            x, y, point3d_id = float(tokens[j]), float(tokens[j + 1]), int(tokens[j + 2])
+        except ValueError:
+            continue
+        xs.append(x)
+        ys.append(y)
+        point3d_ids.append(point3d_id)
+    return np.array(xs, dtype=np.float64), np.array(ys, dtype=np.float64), np.array(point3d_ids, dtype=np.int64)
+
+
+def read_cameras_txt(path):
+    # Same dict layout as read_cameras_bin; unknown models are skipped.
+    cameras = {}
+    with open(path, encoding='utf-8') as f:
+        for line in f:
+            parts = line.split()
+            if not parts or parts[0].startswith('#') or len(parts) < 5:
+                continue
+            model_id = CAMERA_MODEL_IDS.get(parts[1])
+            if model_id is None:
+                print(f"Skipping camera {parts[0]} with unknown model {parts[1]}")
+                continue
+            cameras[int(parts[0])] = {'MODEL_ID': model_id, 'WIDTH': int(parts[2]), 'HEIGHT': int(parts[3]),
+                                      'PARAMS': [float(v) for v in parts[4:]]}
+    return cameras
+
+
+@profiled("colmap.read_images_txt")
+def read_images_txt(path, image_names, progress=None):
+    """Stream a COLMAP images.txt into an AnnotationStore.
+
+    ``image_names`` should be a set or dict for O(1) name lookups. ``progress`` is
+    called as ``progress(bytes_read, total_bytes)``. Returns
+    ``(annotations, metadata, max_point3d_id)``.
+    """
+    known_names = image_names if isinstance(image_names, (set, frozenset, dict)) else set(image_names)
+
+    annotations = AnnotationStore()
+    metadata = {}
+    max_point3d_id = 0
+    feature_id_counter = 1
+
+    total_bytes = os.path.getsize(path)
+    bytes_read = 0
+    last_report = 0
+    pending_name = None
+    expect_points = False
+
+    with open(path, 'rb', buffering=READ_CHUNK_BYTES) as f:
+        for raw_line in f:
+            bytes_read += len(raw_line)
+            if progress is not None and bytes_read - last_report >= PROGRESS_BYTES:
+                progress(bytes_read, total_bytes)
+                last_report = bytes_read
+
+            line = raw_line.decode('utf-8', errors='replace').strip()
+
+            if expect_points:
+                # The line after an image header is always its POINTS2D line, even if empty.
+                expect_points = False
+                if pending_name is None or line.startswith('#'):
+                    continue
+
+                parsed = parse_points2d(line)
+                if parsed is None:
+                    continue
+                xs, ys, point3d_ids = parsed
+
+                n = len(xs)
+                annotations[pending_name].extend(
+                    np.arange(feature_id_counter, feature_id_counter + n), xs, ys, point3d_ids
+                )
+                feature_id_counter += n
+                if n:
+                    max_point3d_id = max(max_point3d_id, int(point3d_ids.max()))
+                continue
+
+            if not line or line.startswith('#'):
+                continue
+
+            parts = line.split()
+            if len(parts) < 10:
+                continue
+
+            expect_points = True
+            pending_name = resolve_image_name(parts[9], known_names)
+            if pending_name is None:
+                continue
+
+            metadata[pending_name] = {
+                'QW': parts[1], 'QX': parts[2], 'QY': parts[3], 'QZ': parts[4],
+                'TX': parts[5], 'TY': parts[6], 'TZ': parts[7],
+                'CAMERA_ID': parts[8],
+                'IMAGE_ID': parts[0]
+            }
+
+    if progress is not None:
+        progress(total_bytes, total_bytes)
+
+    return annotations, metadata, max_point3d_id
+
+
+def image_header(idx, name, metadata):
+    if metadata is None:
+        return f"{idx + 1} 1.0 0.0 0.0 0.0 0.0 0.0 0.0 1 {name}\n"
+    return (f"{metadata['IMAGE_ID']} {metadata['QW']} {metadata['QX']} {metadata['QY']} {metadata['QZ']} "
+            f"{metadata['TX']} {metadata['TY']} {metadata['TZ']} {metadata['CAMERA_ID']} {name}\n")
+
+
+@profiled("colmap.write_images_txt")
+def write_images_txt(path, names, annotations, metadata, progress=None):
+    # Images are written one block at a time instead of collecting all lines first.
+    with atomic_open(path) as f:
+        f.write("# Corrected image list generated by ManualFeatureAnnotator\n")
+        f.write("# Format: IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n")
+        f.write("#         POINTS2D[] as (X, Y, POINT3D_ID)\n")
+        f.write(f"# Number of images: {len(names)}, mean observations per image: N/A\n")
+
+        for idx, name in enumerate(names):
+            f.write(image_header(idx, name, metadata.get(name)))
+
+            # Records are kept sorted by feature ID, which defines the keypoint index.
+            records = annotations.get(name).records
+            f.write(" ".join(f"{x:.6f} {y:.6f} {point3d_id}" for x, y, point3d_id in zip(
+                records['x'].tolist(), records['y'].tolist(), records['point3d_id'].tolist())))
+            f.write("\n")
+
+            if progress is not None:
+                progress(idx + 1, len(names))
+
+    return len(names)
+
+
+def iter_matches(names, annotations, min_matches=MIN_MATCHES, progress=None):
+    """Yield co-visible image pairs from an inverted point3D_id -> observations index.
+
+    Yields ``(name_i, name_j, kp_idx_i, kp_idx_j)`` ordered by the position of the
+    images in ``names`` and, within a pair, by point3D_id.  Work scales with the
+    number of shared observations rather than with the number of image pairs, and
+    only the pairs of one first image are held in memory at a time.
+    """
+    image_idx, point3d_ids, kp_idx = [], [], []
+    for i, name in enumerate(names):
+        image_point3d = annotations.get(name).records['point3d_id']
+        observed = np.flatnonzero(image_point3d > 0)
+        # The first keypoint of a point3D_id in an image represents it in matches.
+        unique_ids, first = np.unique(image_point3d[observed], return_index=True)
+        image_idx.append(np.full(len(unique_ids), i, dtype=np.int64))
+        point3d_ids.append(unique_ids)
+        kp_idx.append(observed[first])
+
+    if not image_idx:
+        return
+    image_idx = np.concatenate(image_idx)
+    point3d_ids = np.concatenate(point3d_ids)
+    kp_idx = np.concatenate(kp_idx)
+
+    # Inverted index: observations sorted by track, images ascending within a track.
+    order = np.lexsort((image_idx, point3d_ids))
+    image_idx, point3d_ids, kp_idx = image_idx[order], point3d_ids[order], kp_idx[order]
+    total = len(point3d_ids)
+
+    # Positions of each image's observations inside the inverted index.
+    by_image = np.argsort(image_idx, kind='stable')
+    image_bounds = np.searchsorted(image_idx[by_image], np.arange(len(names) + 1))
+
+    for i in range(len(names)):
+        if progress is not None:
+            progress(i, len(names))
+        starts = by_image[image_bounds[i]:image_bounds[i + 1]]
+
+        # Later observations of the same track are the co-visible images j > i.
+        pairs = []
+        offset = 1
+        while len(starts):
+            starts = starts[starts + offset < total]
+            starts = starts[point3d_ids[starts + offset] == point3d_ids[starts]]
+            if len(starts):
+                ends = starts + offset
+                pairs.append((image_idx[ends], point3d_ids[starts], kp_idx[starts], kp_idx[ends]))
+            offset += 1
+
+        if not pairs:
+            continue
+        image_b, pair_point3d, kp_a, kp_b = (np.concatenate(column) for column in zip(*pairs))
+
+        order = np.lexsort((pair_point3d, image_b))
+        image_b, kp_a, kp_b = image_b[order], kp_a[order], kp_b[order]
+
+        boundaries = np.flatnonzero(np.diff(image_b)) + 1
+        for start, end in zip(np.r_[0, boundaries].tolist(), np.r_[boundaries, len(image_b)].tolist()):
+            if end - start >= min_matches:
+                yield names[i], names[image_b[start]], kp_a[start:end], kp_b[start:end]
+
+
+@profiled("colmap.write_matches_txt")
+def write_matches_txt(path, matches):
+    # The file is only created once the first pair arrives; returns the number of pairs.
+    count = 0
+    f = None
+    with ExitStack() as stack:
+        for name_i, name_j, kp_i, kp_j in matches:
+            if f is None:
+                f = stack.enter_context(atomic_open(path))
+                f.write("# COLMAP text matches generated by ManualFeatureAnnotator\n")
+                f.write("# Each block: image_name1 image_name2 followed by lines of keypoint_idx1 keypoint_idx2\n")
+            f.write(f"{name_i} {name_j}\n")
+            f.write("".join(f"{a} {b}\n" for a, b in zip(kp_i.tolist(), kp_j.tolist())))
+            f.write("\n")
+            count += 1
+    return count
@@ -1,8 +1,78 @@
+import os
+
 import numpy as np
 
-DEFAULT_DESCRIPTOR = np.zeros(128, dtype=np.float32)
+DEFAULT_DESCRIPTOR = np.zeros(128, dtype=np.uint8)
 DEFAULT_SCALE = 30.0
 DEFAULT_ANGLE = 0.0
 DEFAULT_ZOOM = 2.0
 MIN_ZOOM = 0.1
 MAX_ZOOM = 100.0  # 最大支持100倍放大，配合0.01精度
+
+IMAGE_CACHE_BYTES = 1 << 30  # 解码图像缓存上限 1 GiB
+PREFETCH_WORKERS = 2
+
+VIEW_WIDTH = 960
+VIEW_HEIGHT = 1080
+VIEW_BACKGROUND = (40, 40, 40)
+WHEEL_ZOOM_STEP = 1.2
+
+# 标注颜色 (RGB)
+COLOR_CURRENT = (0, 255, 0)
+COLOR_TRIANGULATED = (0, 0, 255)
+COLOR_UNTRIANGULATED = (255, 0, 0)
+COLOR_DRAG_BOX = (255, 0, 0)
+
+OVERLAY_LABEL_MAX_POINTS = 500  # 可见点数超过此值时不再显示编号, 只画小点
+OVERLAY_HEATMAP_MIN_POINTS = 20000  # 可见点数超过此值时显示密度热图
+OVERLAY_HEATMAP_CELL = 8  # 热图单元大小 (视图像素)
+LABEL_CACHE_SIZE = 4096
+
+REDRAW_MAX_FPS = 60.0
+
+SPATIAL_CELL_SIZE = 64.0  # 空间网格单元大小 (像素)
+SELECT_RADIUS_PX = 10.0
+
+READ_CHUNK_BYTES = 1 << 20
+PROGRESS_BYTES = 8 << 20  # 每读取 8 MiB 报告一次进度
+PROGRESS_INTERVAL = 0.1  # 进度刷新间隔 (秒)
+MIN_MATCHES = 1  # 导出 matches.txt 时每对图像的最少匹配数
+
+GRAY_CACHE_IMAGES = 4  # 缓存的灰度图数量
+DESCRIPTOR_PATCH_MARGIN = 32  # 局部描述子计算的额外边距 (像素)
+DESCRIPTOR_CACHE_SIZE = 256
+DESCRIPTOR_FILE_GROW_ROWS = 65536  # 描述子映射文件每次至少扩展的行数 (每行 128 字节)
+RECOMPUTE_WORKERS = max(1, (os.cpu_count() or 2) - 1)  # 批量重算描述子的进程数
+FEATURE_WRITE_ROWS = 4096  # 特征文件每次写入的行数
+IMAGE_EXTENSIONS = ('.jpg', '.png', '.jpeg')
+
+JOURNAL_FSYNC_RECORDS = 64  # 日志每累计多少条记录 fsync 一次
+JOURNAL_FSYNC_INTERVAL = 1.0  # 未满批次时最长 fsync 间隔 (秒)
+JOURNAL_COMPACT_RECORDS = 50000  # 日志记录数超过该值时压缩为快照
+
+PYRAMID_MIN_IMAGE_SIZE = 2 * max(VIEW_WIDTH, VIEW_HEIGHT)  # 长边超过视图两倍的图像才建立磁盘金字塔
+PYRAMID_MIN_SIZE = 512  # 最粗一级的长边上限
+PYRAMID_TILE_SIZE = 256
+PYRAMID_WORKERS = 1
+PYRAMID_PREVIEW_IMAGES = 4  # 金字塔建好之前用于缩小显示的降采样解码缓存数
+
+MATCH_TEMPLATE_RADIUS = 15  # 模板半径 (像素, 每一级金字塔相同)
+MATCH_SEARCH_RADIUS = 256  # 右图搜索半径 (原图像素)
+MATCH_PYRAMID_LEVELS = 4
+MATCH_MIN_SCORE = 0.7  # NCC 最低得分
+MATCH_NEIGHBOURS = 8  # 预测位置时使用的最近已匹配特征数
+MATCH_WORKERS = max(1, os.cpu_count() or 1)
+COLOR_PROPOSAL = (255, 255, 0)
+
+EPIPOLAR_BAND_PX = 8.0  # 对极线两侧的搜索带宽 (像素, 忽略畸变的余量)
+COLOR_EPIPOLAR = (255, 0, 255)
+
+PROFILE_LOG_SIZE = 200000  # 性能分析滚动日志保留的事件数
+PROFILE_FPS_WINDOW = 1.0  # 帧率统计窗口 (秒)
+COLOR_PROFILE = (255, 255, 255)
+
+BENCH_CASES = ('open', 'parse', 'import', 'export_txt', 'render_fit', 'render_1to1', 'render_frame',
+               'add_point', 'delete_box')
+BENCH_REPEAT = 5  # 每个基准测试的计时重复次数
+BENCH_EDITS = 100  # 添加/删除基准中每次计时的操作数
+BENCH_DECODED_IMAGES = 3  # 合成项目中真正写出像素的图像数, 其余为空占位文件
@@ -0,0 +1,112 @@
+import os
+import threading
+
+import numpy as np
+
+try:
+    import fcntl
+except ImportError:  # Windows
+    fcntl = None
+    import msvcrt
+
+from .constants import DEFAULT_DESCRIPTOR, DESCRIPTOR_FILE_GROW_ROWS
+from .descriptors import descriptors_to_uint8
+
+DESCRIPTOR_DIM = DEFAULT_DESCRIPTOR.shape[0]
+
+
+def _lock_exclusive(f):
+    # Non-blocking exclusive lock held until ``f`` is closed; False if another process has it.
+    try:
+        if fcntl is not None:
+            fcntl.flock(f.fileno(), fcntl.LOCK_EX | fcntl.LOCK_NB)
+        else:
+            msvcrt.locking(f.fileno(), msvcrt.LK_NBLCK, 1)
+    except OSError:
+        return False
+    return True
+
+
+class DescriptorPool:
+    """Append-only uint8 descriptor rows; a feature record holds the offset of its row.
+
+    Rows are never rewritten: a changed descriptor is appended as a new row, so
+    snapshots and background exports can read the offsets they hold while edits
+    append. Growth replaces the backing array; arrays handed out before stay valid
+    for the rows they already cover.
+    """
+
+    def __init__(self, grow_rows=1024):
+        self.grow_rows = grow_rows
+        self._rows = np.empty((0, DESCRIPTOR_DIM), dtype=np.uint8)
+        self._count = 0
+        self._lock = threading.Lock()
+
+    def __len__(self):
+        return self._count
+
+    def append(self, descriptors):
+        """Quantize and store ``(n, 128)`` descriptors; returns the offset of the first row."""
+        descriptors = descriptors_to_uint8(descriptors).reshape(-1, DESCRIPTOR_DIM)
+        with self._lock:
+            start = self._count
+            if start + len(descriptors) > len(self._rows):
+                self._rows = self._grow(max(start + len(descriptors), 2 * len(self._rows), self.grow_rows))
+            self._rows[start:start + len(descriptors)] = descriptors
+            self._count = start + len(descriptors)
+        return start
+
+    def row(self, offset):
+        return np.array(self._rows[offset])
+
+    def read(self, offsets):
+        # A fresh in-memory (n, 128) matrix of the rows at ``offsets``.
+        return np.asarray(self._rows[np.asarray(offsets, dtype=np.int64)])
+
+    def close(self):
+        pass
+
+    def _grow(self, capacity):
+        grown = np.empty((capacity, DESCRIPTOR_DIM), dtype=np.uint8)
+        grown[:self._count] = self._rows[:self._count]
+        return grown
+
+
+class DescriptorFile(DescriptorPool):
+    """A ``DescriptorPool`` kept in a memory-mapped sidecar file instead of the heap.
+
+    The file is a per-session cache: it is recreated when opened, and the journal
+    remains what carries descriptors across sessions. It grows in doubling steps
+    of at least ``grow_rows`` rows; rows of replaced descriptors stay in it until the
+    next session. An exclusive lock on ``path + ".lock"`` is held while it is open,
+    so a second session on the same output directory fails instead of truncating
+    the first one's descriptors.
+    """
+
+    def __init__(self, path, grow_rows=DESCRIPTOR_FILE_GROW_ROWS):
+        super().__init__(grow_rows)
+        self.path = path
+        os.makedirs(os.path.dirname(os.path.abspath(path)), exist_ok=True)
+        self._lock_file = open(path + ".lock", 'a+b')
+        if not _lock_exclusive(self._lock_file):
+            self._lock_file.close()
+            raise RuntimeError(f"{path} is in use by another annotator session on the same output directory")
+        self._rows = np.memmap(path, dtype=np.uint8, mode='w+', shape=(grow_rows, DESCRIPTOR_DIM))
+
+    def close(self):
+        with self._lock:
+            if self._rows is None:
+                return
+            self._rows.flush()
+            self._rows = None
+        try:
+            os.remove(self.path)
+        except OSError:
+            pass
+        # The lock file itself stays; removing it would race with a session opening it.
+        self._lock_file.close()
+
+    def _grow(self, capacity):
+        # Mapping the file with a larger shape extends it; existing rows stay where they are.
+        self._rows.flush()
+        return np.memmap(self.path, dtype=np.uint8, mode='r+', shape=(capacity, DESCRIPTOR_DIM))
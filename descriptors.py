@@ -0,0 +1,222 @@
+import math
+import multiprocessing
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import FIRST_COMPLETED, ProcessPoolExecutor, wait
+
+import numpy as np
+
+try:
+    import cv2
+except ImportError:  # exporters that only convert descriptors run without OpenCV
+    cv2 = None
+
+from .constants import (DEFAULT_SCALE, DESCRIPTOR_CACHE_SIZE, DESCRIPTOR_PATCH_MARGIN, GRAY_CACHE_IMAGES,
+                        RECOMPUTE_WORKERS)
+from .profiling import profiler
+
+
+def descriptors_to_uint8(descriptors):
+    # OpenCV SIFT already scales descriptors by 512 and saturates them to the
+    # 0..255 range, which is what COLMAP stores as unsigned bytes.
+    descriptors = np.asarray(descriptors)
+    if descriptors.dtype == np.uint8:
+        return descriptors
+    return np.clip(np.rint(descriptors), 0, 255).astype(np.uint8)
+
+
+def to_gray(img):
+    return cv2.cvtColor(img, cv2.COLOR_BGR2GRAY) if len(img.shape) == 3 else img
+
+
+def patch_radius(size, margin=DESCRIPTOR_PATCH_MARGIN):
+    # OpenCV samples a 4x4 grid of 3*sigma wide histograms (sigma = size / 2),
+    # rotated by the keypoint angle; the margin covers the Gaussian pyramid blur.
+    return int(math.ceil(3.0 * size / 2.0 * math.sqrt(2.0) * 5.0 / 2.0)) + margin
+
+
+class DescriptorService:
+    """SIFT descriptors for single clicked keypoints.
+
+    Grayscale copies of the loaded images are cached, and the descriptor is
+    computed on a padded patch around the keypoint only, so the cost does not
+    depend on the image resolution.
+    """
+
+    def __init__(self, sift=None, gray_images=GRAY_CACHE_IMAGES, cache_size=DESCRIPTOR_CACHE_SIZE):
+        self.sift = sift if sift is not None else cv2.SIFT_create()  # type: ignore
+        self.gray_images = gray_images
+        self.cache_size = cache_size
+        self._gray = OrderedDict()
+        self._cache = OrderedDict()
+        self._lock = threading.Lock()
+
+    def gray(self, name, img):
+        # Keyed by the decoded array too, so a re-decoded image replaces a stale copy.
+        key = (name, id(img))
+        with self._lock:
+            gray = self._gray.get(key)
+            if gray is not None:
+                self._gray.move_to_end(key)
+                return gray
+
+        gray = to_gray(img)
+        with self._lock:
+            self._gray[key] = gray
+            while len(self._gray) > self.gray_images:
+                self._gray.popitem(last=False)
+        return gray
+
+    def compute(self, name, img, x, y, size=DEFAULT_SCALE):
+        """Return ``(keypoint, descriptor)`` in full-image coordinates, or ``(None, None)``."""
+        key = (name, id(img), float(x), float(y), float(size))
+        with self._lock:
+            hit = self._cache.get(key)
+            if hit is not None:
+                self._cache.move_to_end(key)
+                return hit
+
+        gray = self.gray(name, img)
+        height, width = gray.shape[:2]
+        radius = patch_radius(size)
+        x0, y0 = max(int(x) - radius, 0), max(int(y) - radius, 0)
+        x1, y1 = min(int(x) + radius + 1, width), min(int(y) + radius + 1, height)
+        if x0 >= x1 or y0 >= y1:
+            return None, None
+
+        patch = gray[y0:y1, x0:x1]
+        with profiler.span('sift.compute'):
+            kps, des = self.sift.compute(patch, [cv2.KeyPoint(float(x) - x0, float(y) - y0, float(size))])
+        if des is None or len(des) == 0:
+            return None, None
+
+        kp = kps[0]
+        kp.pt = (kp.pt[0] + x0, kp.pt[1] + y0)
+        result = (kp, des[0])
+        with self._lock:
+            self._cache[key] = result
+            while len(self._cache) > self.cache_size:
+                self._cache.popitem(last=False)
+        return result
+
+    def clear(self):
+        with self._lock:
+            self._gray.clear()
+            self._cache.clear()
+
+
+_worker_sift = None
+
+
+def compute_image_descriptors(image_path, keypoints):
+    """Worker: SIFT descriptors for ``(n, 4)`` rows of x, y, size, angle in one image.
+
+    Returns ``(descriptors, valid)`` with uint8 descriptors, or None if the image
+    cannot be read.
+    """
+    global _worker_sift
+    gray = cv2.imread(image_path, cv2.IMREAD_GRAYSCALE)
+    if gray is None:
+        return None
+    if _worker_sift is None:
+        _worker_sift = cv2.SIFT_create()  # type: ignore
+
+    # class_id carries the row so dropped keypoints can be told apart.
+    kps = [cv2.KeyPoint(float(x), float(y), float(size), float(angle), 0, 0, i)
+           for i, (x, y, size, angle) in enumerate(keypoints.tolist())]
+    kps, des = _worker_sift.compute(gray, kps)
+
+    descriptors = np.zeros((len(keypoints), 128), dtype=np.uint8)
+    valid = np.zeros(len(keypoints), dtype=bool)
+    if des is not None and len(des):
+        rows = np.array([kp.class_id for kp in kps], dtype=np.int64)
+        descriptors[rows] = descriptors_to_uint8(des)
+        valid[rows] = True
+    return descriptors, valid
+
+
+def _checkpoint_path(checkpoint_dir, name):
+    return os.path.join(checkpoint_dir, name + ".npz")
+
+
+def _load_checkpoint(path, records):
+    # A checkpoint is only reused if the keypoints are still exactly the same.
+    try:
+        with np.load(path) as data:
+            if (np.array_equal(data['fid'], records['fid']) and np.array_equal(data['x'], records['x'])
+                    and np.array_equal(data['y'], records['y'])):
+                return data['descriptors'], data['valid']
+    except (OSError, KeyError, ValueError):
+        pass
+    return None
+
+
+def _save_checkpoint(path, records, descriptors, valid):
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path, fid=records['fid'], x=records['x'], y=records['y'], descriptors=descriptors, valid=valid)
+    os.replace(tmp_path, path)
+
+
+def recompute_descriptors(image_folder, names, annotations, checkpoint_dir=None, workers=RECOMPUTE_WORKERS,
+                          progress=None):
+    """Recompute descriptors of keypoints that still use DEFAULT_DESCRIPTOR.
+
+    Images are spread over a process pool with at most ``2 * workers`` images in
+    flight, so memory stays bounded by a few decoded frames. Each finished image is
+    written to ``checkpoint_dir`` (if given) and later runs reuse it. Yields
+    ``(name, records, descriptors, valid)`` in completion order.
+    """
+    def missing():
+        # Records are filtered one image at a time, as workers free up.
+        for name in names:
+            records = annotations.get(name).records
+            records = records[records['desc_row'] < 0]
+            if len(records):
+                yield name, records
+
+    total = sum(1 for name in names if np.any(annotations.get(name).records['desc_row'] < 0))
+    done = 0
+    if checkpoint_dir is not None:
+        os.makedirs(checkpoint_dir, exist_ok=True)
+
+    # The pool is only started once an image is not covered by a checkpoint.
+    executor = None
+    try:
+        queue = missing()
+        in_flight = {}
+        while True:
+            for name, records in queue:
+                cached = _load_checkpoint(_checkpoint_path(checkpoint_dir, name), records) if checkpoint_dir else None
+                if cached is not None:
+                    done += 1
+                    if progress is not None:
+                        progress(done, total)
+                    yield (name, records) + cached
+                    continue
+                if executor is None:
+                    executor = ProcessPoolExecutor(max_workers=workers, mp_context=multiprocessing.get_context("spawn"))
+                keypoints = np.column_stack((records['x'], records['y'], records['size'], records['angle']))
+                future = executor.submit(compute_image_descriptors, os.path.join(image_folder, name), keypoints)
+                in_flight[future] = (name, records)
+                if len(in_flight) >= 2 * workers:
+                    break
+            if not in_flight:
+                return
+
+            finished, _ = wait(in_flight, return_when=FIRST_COMPLETED)
+            for future in finished:
+                name, records = in_flight.pop(future)
+                result = future.result()
+                done += 1
+                if progress is not None:
+                    progress(done, total)
+                if result is None:
+                    print(f"Could not read {name}, descriptors left unchanged.")
+                    continue
+                if checkpoint_dir is not None:
+                    _save_checkpoint(_checkpoint_path(checkpoint_dir, name), records, *result)
+                yield (name, records) + result
+    finally:
+        if executor is not None:
+            executor.shutdown(wait=False, cancel_futures=True)
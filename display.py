@@ -1,6 +1,13 @@
+import time
+
 import cv2
 import open3d as o3d
 
+from .constants import COLOR_CURRENT, COLOR_DRAG_BOX, COLOR_EPIPOLAR, COLOR_PROFILE, COLOR_PROPOSAL
+from .epipolar import clip_line
+from .profiling import profiled, profiler
+from .pyramid import PREVIEW_LEVELS, ImagePyramid, level_for_zoom
+
 
 class DisplayMixin:
     """Rendering helpers for showing images and mapping coordinates."""
@@ -9,109 +16,199 @@ class DisplayMixin:
         if self.cv_img_left is None or self.cv_img_right is None:
             return
 
-        name_left = self.image_files[self.current_idx]
-        name_right = self.image_files[self.current_idx + 1]
+        self._render_panes((True, False))
 
-        vis_left_orig = self.cv_img_left.copy()
-        vis_right_orig = self.cv_img_right.copy()
+    def _request_redraw(self, is_left=None):
+        # Coalesced through the RedrawScheduler; renders at most once per frame.
+        self.redraw_scheduler.request((True, False) if is_left is None else (is_left,))
 
-        h, w = vis_left_orig.shape[:2]
-        current_zoom = self.zoom_factor
+    def _render_panes(self, panes):
+        if self.cv_img_left is None or self.cv_img_right is None:
+            return
 
-        if current_zoom != 1.0:
-            new_size = (int(w * current_zoom), int(h * current_zoom))
-            vis_left_disp = cv2.resize(vis_left_orig, new_size, interpolation=cv2.INTER_NEAREST)
-            vis_right_disp = cv2.resize(vis_right_orig, new_size, interpolation=cv2.INTER_NEAREST)
+        started = time.perf_counter_ns()
+        uploaded = False
+        for is_left in panes:
+            uploaded |= self._render_pane(is_left)
+
+        if uploaded:
+            self.window.set_needs_layout()
+        profiler.frame(started, time.perf_counter_ns())
+
+    def _render_pane(self, is_left):
+        filename = self.image_files[self.current_idx if is_left else self.current_idx + 1]
+        img = self.cv_img_left if is_left else self.cv_img_right
+        viewport = self._viewport(is_left)
+        layers = self.pane_layers[is_left]
+
+        level, source = self._pyramid_level(filename, viewport)
+        base_key = (filename, id(img), level, type(source), viewport.zoom, viewport.origin_x, viewport.origin_y)
+        base = layers.get_base(base_key, lambda: self._render_base(filename, img, viewport, level, source))
+
+        annotations_key = (base_key, self.annotations.version(filename))
+        annotated = layers.get_annotations(annotations_key, lambda: self._draw_annotation_layer(base, filename, viewport))
+
+        drag_box = None
+        if self.delete_mode and self.drag_start_coord is not None and self.drag_curr_coord is not None \
+                and self.drag_is_left == is_left:
+            drag_box = (self.drag_start_coord, self.drag_curr_coord)
+
+        proposal = None if is_left else self.proposal
+        line = None if is_left else self._epipolar_line(self.current_feature_id)
+        if not layers.needs_frame((annotations_key, self.current_feature_id, drag_box, proposal, line,
+                                   profiler.enabled)):
+            return False
+
+        frame = annotated.copy()
+        self._draw_transient_layer(frame, filename, viewport, drag_box, proposal, line)
+        if profiler.enabled and is_left:
+            self._draw_profile_overlay(frame)
+        self._set_o3d_image(self.left_widget if is_left else self.right_widget, frame)
+        return True
+
+    def _pyramid_level(self, filename, viewport):
+        # Zoomed out views are resampled from the coarsest fitting pyramid level once it
+        # exists, and from a reduced decode of the image until then; the source is the
+        # pyramid, the reduced image, or None for the decoded image itself.
+        if viewport.zoom >= 0.5 or self.pyramids.is_small(filename):
+            return 0, None
+        pyramid = self.pyramids.get(filename)
+        if pyramid is not None:
+            return level_for_zoom(viewport.zoom, len(pyramid.levels)), pyramid
+        level = level_for_zoom(viewport.zoom, PREVIEW_LEVELS)
+        preview = self.pyramids.preview(filename, level) if level > 0 else None
+        return (level, preview) if preview is not None else (0, None)
+
+    @profiled("render.base")
+    def _render_base(self, filename, img, viewport, level, source):
+        if source is None:
+            view = viewport.render(img)
+        elif isinstance(source, ImagePyramid):
+            crop, x0, y0 = source.crop(level, viewport.visible_rect())
+            view = viewport.render(crop, 2 ** level, (x0, y0))
         else:
-            vis_left_disp = vis_left_orig
-            vis_right_disp = vis_right_orig
-
-        def draw_points(img, filename, current_id):
-            for fid, data in self.annotations[filename].items():
-                x, y, _, _, _, point3d_id = data
-
-                draw_x = int(x * current_zoom)
-                draw_y = int(y * current_zoom)
-
-                if fid == current_id:
-                    color = (0, 255, 0)
-                    thickness = 2
-                    radius = 6
-                elif point3d_id > 0:
-                    color = (255, 0, 0)
-                    thickness = 1
-                    radius = 4
-                else:
-                    color = (0, 0, 255)
-                    thickness = 1
-                    radius = 4
-
-                cv2.circle(img, (draw_x, draw_y), radius, color, thickness)
-                cv2.putText(img, str(fid), (draw_x + 5, draw_y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
-
-        draw_points(vis_left_disp, name_left, self.current_feature_id)
-        draw_points(vis_right_disp, name_right, self.current_feature_id)
-
-        if self.delete_mode and self.drag_start_coord is not None and self.drag_curr_coord is not None:
-            target_vis = vis_left_disp if self.drag_is_left else vis_right_disp
-
-            x1 = int(self.drag_start_coord[0] * current_zoom)
-            y1 = int(self.drag_start_coord[1] * current_zoom)
-            x2 = int(self.drag_curr_coord[0] * current_zoom)
-            y2 = int(self.drag_curr_coord[1] * current_zoom)
-
-            cv2.rectangle(target_vis, (x1, y1), (x2, y2), (0, 0, 255), 2)
-
-        self._set_o3d_image(self.left_widget, vis_left_disp)
-        self._set_o3d_image(self.right_widget, vis_right_disp)
-
-        self.left_widget.set_on_mouse(lambda e: self._on_mouse_event(e, is_left=True))
-        self.right_widget.set_on_mouse(lambda e: self._on_mouse_event(e, is_left=False))
+            view = viewport.render(source, 2 ** level)
+        return cv2.cvtColor(view, cv2.COLOR_BGR2RGB)
+
+    @profiled("render.annotations")
+    def _draw_annotation_layer(self, base, filename, viewport):
+        img = base.copy()
+        annotations = self.annotations.get(filename)
+
+        x_min, y_min, x_max, y_max = viewport.visible_rect()
+        margin = 20 / viewport.zoom
+        rows = annotations.rows_in_rect(x_min - margin, y_min - margin, x_max + margin, y_max + margin)
+        self.overlay.draw(img, viewport, annotations.records[rows])
+        return img
+
+    @profiled("render.transient")
+    def _draw_transient_layer(self, img, filename, viewport, drag_box, proposal=None, line=None):
+        if line is not None:
+            segment = clip_line(line, *viewport.visible_rect())
+            if segment is not None:
+                (x1, y1), (x2, y2) = (viewport.image_to_view(*p) for p in segment)
+                cv2.line(img, (int(x1), int(y1)), (int(x2), int(y2)), COLOR_EPIPOLAR, 1, cv2.LINE_AA)
+
+        current = self.annotations.get(filename).get(self.current_feature_id)
+        if current is not None:
+            self._draw_marker(img, viewport, self.current_feature_id, current[0], current[1],
+                              COLOR_CURRENT, radius=6, thickness=2)
+
+        if proposal is not None:
+            fid, x, y, _ = proposal
+            self._draw_marker(img, viewport, fid, x, y, COLOR_PROPOSAL, radius=6, thickness=2)
+
+        if drag_box is not None:
+            x1, y1 = viewport.image_to_view(*drag_box[0])
+            x2, y2 = viewport.image_to_view(*drag_box[1])
+            cv2.rectangle(img, (int(x1), int(y1)), (int(x2), int(y2)), COLOR_DRAG_BOX, 2)
+
+    @staticmethod
+    def _draw_profile_overlay(img):
+        # Frame time, FPS and GUI-thread queue depth as of the previous frame.
+        frame_ms, fps = profiler.frame_stats()
+        text = f"{frame_ms:.1f} ms/frame  {fps:.0f} fps  queue {profiler.counter('main_thread.queue_depth')}"
+        (w, h), baseline = cv2.getTextSize(text, cv2.FONT_HERSHEY_SIMPLEX, 0.5, 1)
+        cv2.rectangle(img, (4, 4), (12 + w, 12 + h + baseline), (0, 0, 0), -1)
+        cv2.putText(img, text, (8, 8 + h), cv2.FONT_HERSHEY_SIMPLEX, 0.5, COLOR_PROFILE, 1, cv2.LINE_AA)
+
+    @staticmethod
+    def _draw_marker(img, viewport, fid, x, y, color, radius, thickness):
+        view_x, view_y = viewport.image_to_view(x, y)
+        if not (-20 <= view_x <= viewport.width + 20 and -20 <= view_y <= viewport.height + 20):
+            return
+        draw_x = int(view_x)
+        draw_y = int(view_y)
 
-        self.window.set_needs_layout()
+        cv2.circle(img, (draw_x, draw_y), radius, color, thickness)
+        cv2.putText(img, str(fid), (draw_x + 5, draw_y - 5), cv2.FONT_HERSHEY_SIMPLEX, 0.5, color, 1)
 
-    def _set_o3d_image(self, widget, cv_img):
-        img_rgb = cv2.cvtColor(cv_img, cv2.COLOR_BGR2RGB)
+    @profiled("render.upload")
+    def _set_o3d_image(self, widget, img_rgb):
         o3d_img = o3d.geometry.Image(img_rgb)
         widget.update_image(o3d_img)
 
-    def _get_img_coords_from_mouse(self, widget, event_x, event_y, is_left):
-        img_orig = self.cv_img_left if is_left else self.cv_img_right
-        if img_orig is None:
-            return None
-
+    def _viewport(self, is_left):
+        return self.view_left if is_left else self.view_right
+
+    def _fit_viewports(self):
+        # Keep zoom and pan across pairs unless the image size changes.
+        refit = False
+        for viewport, img in ((self.view_left, self.cv_img_left), (self.view_right, self.cv_img_right)):
+            h, w = img.shape[:2]
+            if viewport.image_size != (w, h):
+                viewport.fit(w, h)
+                refit = True
+        if refit:
+            self._set_zoom(min(self.view_left.zoom, self.view_right.zoom))
+
+    def _set_zoom(self, zoom, is_left=None, anchor=None):
+        # ``anchor`` (view pixel) only applies to the pane the user zoomed on.
+        for pane_is_left in (True, False):
+            pane_anchor = anchor if pane_is_left == is_left else None
+            self._viewport(pane_is_left).set_zoom(zoom, pane_anchor)
+
+        self.zoom_factor = self.view_left.zoom
+        zoom_val = self.zoom_factor
+
+        current_val = getattr(self.zoom_input, 'double_value', zoom_val)
+        if abs(current_val - zoom_val) > 1e-3:
+            self.app.post_to_main_thread(self.window, lambda: setattr(self.zoom_input, 'double_value', zoom_val))
+
+    def _get_view_coords_from_mouse(self, widget, event_x, event_y, is_left):
+        viewport = self._viewport(is_left)
         widget_frame = widget.frame
-        current_zoom = self.zoom_factor
-        orig_h, orig_w = img_orig.shape[:2]
-
-        displayed_w_pixels = int(orig_w * current_zoom)
-        displayed_h_pixels = int(orig_h * current_zoom)
 
         click_x = event_x - widget_frame.x
         click_y = event_y - widget_frame.y
 
+        # The widget letterboxes the view buffer into its allocated frame.
         allocated_w, allocated_h = widget_frame.width, widget_frame.height
-        img_aspect = displayed_w_pixels / displayed_h_pixels
+        view_aspect = viewport.width / viewport.height
         allocated_aspect = allocated_w / allocated_h
 
         widget_scale = 1.0
         offset_x = 0
         offset_y = 0
 
-        if img_aspect > allocated_aspect:
-            widget_scale = allocated_w / displayed_w_pixels
-            visible_h = displayed_h_pixels * widget_scale
+        if view_aspect > allocated_aspect:
+            widget_scale = allocated_w / viewport.width
+            visible_h = viewport.height * widget_scale
             offset_y = (allocated_h - visible_h) / 2
         else:
-            widget_scale = allocated_h / displayed_h_pixels
-            visible_w = displayed_w_pixels * widget_scale
+            widget_scale = allocated_h / viewport.height
+            visible_w = viewport.width * widget_scale
             offset_x = (allocated_w - visible_w) / 2
 
-        x_in_zoomed_img = (click_x - offset_x) / widget_scale
-        y_in_zoomed_img = (click_y - offset_y) / widget_scale
+        return (click_x - offset_x) / widget_scale, (click_y - offset_y) / widget_scale
+
+    def _get_img_coords_from_mouse(self, widget, event_x, event_y, is_left):
+        img_orig = self.cv_img_left if is_left else self.cv_img_right
+        if img_orig is None:
+            return None
 
-        img_x = x_in_zoomed_img / current_zoom
-        img_y = y_in_zoomed_img / current_zoom
+        view_x, view_y = self._get_view_coords_from_mouse(widget, event_x, event_y, is_left)
+        img_x, img_y = self._viewport(is_left).view_to_image(view_x, view_y)
 
         img_x = round(img_x, 2)
         img_y = round(img_y, 2)
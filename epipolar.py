@@ -0,0 +1,98 @@
+import numpy as np
+
+# Models whose first parameters are f, cx, cy; all others start with fx, fy, cx, cy.
+_SINGLE_FOCAL_MODELS = {0, 2, 3, 8, 9}
+
+
+def camera_matrix(camera):
+    """Pinhole intrinsics of a COLMAP camera; lens distortion is ignored."""
+    params = camera['PARAMS']
+    if camera['MODEL_ID'] in _SINGLE_FOCAL_MODELS:
+        fx = fy = params[0]
+        cx, cy = params[1], params[2]
+    else:
+        fx, fy, cx, cy = params[:4]
+    return np.array([[fx, 0.0, cx], [0.0, fy, cy], [0.0, 0.0, 1.0]])
+
+
+def image_pose(entry):
+    """World-to-camera rotation and translation of an images.txt/.bin entry."""
+    qw, qx, qy, qz = (float(entry[k]) for k in ('QW', 'QX', 'QY', 'QZ'))
+    norm = np.sqrt(qw * qw + qx * qx + qy * qy + qz * qz)
+    if norm == 0:
+        return None, None
+    qw, qx, qy, qz = qw / norm, qx / norm, qy / norm, qz / norm
+    rotation = np.array([
+        [1 - 2 * (qy * qy + qz * qz), 2 * (qx * qy - qw * qz), 2 * (qx * qz + qw * qy)],
+        [2 * (qx * qy + qw * qz), 1 - 2 * (qx * qx + qz * qz), 2 * (qy * qz - qw * qx)],
+        [2 * (qx * qz - qw * qy), 2 * (qy * qz + qw * qx), 1 - 2 * (qx * qx + qy * qy)],
+    ])
+    translation = np.array([float(entry[k]) for k in ('TX', 'TY', 'TZ')])
+    return rotation, translation
+
+
+def fundamental_matrix(entry_left, entry_right, cameras):
+    """F with ``x_right^T F x_left = 0``, or None without poses, intrinsics or baseline."""
+    if entry_left is None or entry_right is None:
+        return None
+    camera_left = cameras.get(int(entry_left['CAMERA_ID']))
+    camera_right = cameras.get(int(entry_right['CAMERA_ID']))
+    if camera_left is None or camera_right is None:
+        return None
+
+    r1, t1 = image_pose(entry_left)
+    r2, t2 = image_pose(entry_right)
+    if r1 is None or r2 is None:
+        return None
+    rotation = r2 @ r1.T
+    translation = t2 - rotation @ t1
+    if np.linalg.norm(translation) < 1e-9:
+        return None
+
+    cross = np.array([[0.0, -translation[2], translation[1]],
+                      [translation[2], 0.0, -translation[0]],
+                      [-translation[1], translation[0], 0.0]])
+    essential = cross @ rotation
+    f = np.linalg.inv(camera_matrix(camera_right)).T @ essential @ np.linalg.inv(camera_matrix(camera_left))
+    return f / np.linalg.norm(f)
+
+
+def epipolar_line(f, x, y):
+    """Right-image line ``(a, b, c)`` of left point (x, y), scaled so that a*x + b*y + c is a distance."""
+    a, b, c = f @ np.array([x, y, 1.0])
+    norm = np.hypot(a, b)
+    if norm == 0:
+        return None
+    return a / norm, b / norm, c / norm
+
+
+def line_distance(line, x, y):
+    a, b, c = line
+    return a * x + b * y + c
+
+
+def project_to_line(line, x, y):
+    a, b, _ = line
+    d = line_distance(line, x, y)
+    return x - d * a, y - d * b
+
+
+def clip_line(line, x0, y0, x1, y1):
+    """End points of the line inside the rectangle, or None if it misses it."""
+    a, b, c = line
+    points = []
+    if abs(b) > 1e-12:
+        for x in (x0, x1):
+            y = -(a * x + c) / b
+            if y0 <= y <= y1:
+                points.append((x, y))
+    if abs(a) > 1e-12:
+        for y in (y0, y1):
+            x = -(b * y + c) / a
+            if x0 <= x <= x1:
+                points.append((x, y))
+    if len(points) < 2:
+        return None
+    # Corner hits show up twice; the two points farthest apart span the segment.
+    points.sort()
+    return points[0], points[-1]
@@ -2,11 +2,18 @@ import os
 
 import open3d.visualization.gui as gui # type: ignore
 
-from .constants import DEFAULT_DESCRIPTOR, DEFAULT_SCALE, DEFAULT_ANGLE
+from .colmap_binary import read_model, write_cameras_bin, write_images_bin, write_points3d_bin
+from .colmap_database import default_camera, export_database
+from .colmap_features import write_feature_files
+from .colmap_io import write_images_txt, iter_matches, write_matches_txt
+from .constants import MIN_MATCHES
+from .descriptors import recompute_descriptors
+from .jobs import JobCancelled
+from .track_index import TrackIndex
 
 
 class FileIOMixin:
-    """Import/export helpers for COLMAP images.txt files."""
+    """Import/export helpers for COLMAP text and binary models."""
 
     def _on_import_select_file(self):
         def on_dialog_done(path):
@@ -17,193 +24,200 @@ class FileIOMixin:
         def on_dialog_cancel():
             self.window.close_dialog()
 
-        dlg = gui.FileDialog(gui.FileDialog.OPEN, "Select COLMAP images.txt", self.window.theme)
+        dlg = gui.FileDialog(gui.FileDialog.OPEN, "Select COLMAP images.txt / images.bin", self.window.theme)
+        dlg.add_filter(".txt .bin", "COLMAP images.txt / images.bin")
         dlg.add_filter(".txt", "COLMAP images.txt")
+        dlg.add_filter(".bin", "COLMAP images.bin")
         dlg.set_path(self.output_dir)
         dlg.set_on_done(on_dialog_done)
         dlg.set_on_cancel(on_dialog_cancel)
         self.window.show_dialog(dlg)
 
-    def _parse_images_txt(self, path):
-        imported_annotations = {f: {} for f in self.image_files}
-        imported_metadata = {f: None for f in self.image_files}
-        local_max_point3d_id = 0
-        feature_id_counter = 1
-
+    def _parse_model(self, path, progress=None):
         try:
-            with open(path, 'r') as f:
-                lines = f.readlines()
-
-            i = 0
-            while i < len(lines):
-                line = lines[i].strip()
-                i += 1
-                if not line or line.startswith('#'):
-                    continue
-
-                parts = line.split()
-                if len(parts) < 10:
-                    continue
-
-                image_name = parts[9]
-
-                matched_name = None
-                if image_name in self.image_files:
-                    matched_name = image_name
-                else:
-                    base_name = os.path.basename(image_name)
-                    if base_name in self.image_files:
-                        matched_name = base_name
-
-                if not matched_name:
-                    continue
-
-                metadata = {
-                    'QW': parts[1], 'QX': parts[2], 'QY': parts[3], 'QZ': parts[4],
-                    'TX': parts[5], 'TY': parts[6], 'TZ': parts[7],
-                    'CAMERA_ID': parts[8],
-                    'IMAGE_ID': parts[0]
-                }
-                imported_metadata[matched_name] = metadata
-
-                if i < len(lines):
-                    line = lines[i].strip()
-                    i += 1
-                    if line.startswith('#'):
-                        continue
-
-                    keypoint_data = line.split()
-
-                    if len(keypoint_data) % 3 != 0:
-                        continue
-
-                    num_keypoints = len(keypoint_data) // 3
-
-                    for j in range(num_keypoints):
-                        try:
-                            x = float(keypoint_data[j * 3])
-                            y = float(keypoint_data[j * 3 + 1])
-                            point3d_id = int(keypoint_data[j * 3 + 2])
-                        except ValueError:
-                            continue
-
-                        imported_annotations[matched_name][feature_id_counter] = (
-                            x, y, DEFAULT_DESCRIPTOR, DEFAULT_SCALE, DEFAULT_ANGLE, point3d_id
-                        )
-
-                        if point3d_id > 0:
-                            local_max_point3d_id = max(local_max_point3d_id, point3d_id)
-
-                        feature_id_counter += 1
-
+            return read_model(path, self.project.positions, progress)
+        except JobCancelled:
+            raise
         except Exception as e:
-            print(f"Error parsing images.txt: {e}")
-            return None, None, 0
-
-        return imported_annotations, imported_metadata, local_max_point3d_id
+            print(f"Error parsing {os.path.basename(path)}: {e}")
+            return None, None, 0, {}, {}
 
     def _on_import_images_txt(self, path):
-        annotations, metadata, max_3d_id = self._parse_images_txt(path)
+        label = f"Importing {os.path.basename(path)}"
+
+        def work(job):
+            return self._parse_model(path, lambda done, total: job.report(done, total))
+
+        self._start_job(label, work, self._apply_import)
+
+    def _apply_import(self, result):
+        # Runs on the GUI thread, so the new state replaces the old one in a single step.
+        annotations, metadata, max_3d_id, cameras, points3d = result
 
         if annotations is None:
-            self._show_message("Error", "Failed to parse images.txt file.")
+            self._show_message("Error", "Failed to parse COLMAP model file.")
             return
 
+        annotations.move_descriptors(self.descriptor_file)
         self.annotations = annotations
         self.image_metadata = metadata
         self.max_point3d_id = max_3d_id
-
-        all_feature_ids = [fid for annots in self.annotations.values() for fid in annots.keys()]
-        if all_feature_ids:
-            self.current_feature_id = max(all_feature_ids) + 1
-        else:
-            self.current_feature_id = 1
+        self.cameras = cameras
+        self.points3d = points3d
+
+        self.tracks = TrackIndex(self.image_files, positions=self.project.positions)
+        self.point_tracks = TrackIndex(self.image_files, 'point3d_id', self.project.positions)
+        self.current_feature_id = self.annotations.max_feature_id() + 1
+        self._update_fundamental()
+        # Imports replace the whole state, so the snapshot must be on disk before any
+        # later edit: replaying post-import edits over the pre-import state would mix both.
+        try:
+            self._compact_journal(wait=True)
+        except Exception as e:
+            self._show_message("Error", f"Failed to save the imported model to the journal: {e}")
 
         self.app.post_to_main_thread(self.window, lambda: setattr(self.id_input, 'int_value', self.current_feature_id))
-        self.app.post_to_main_thread(self.window, self._update_display_images)
+        self._request_redraw()
         self.app.post_to_main_thread(self.window, lambda: self._show_message("Success",
-                                                                            f"Imported images.txt.\nMax 3D ID found: {self.max_point3d_id}"))
+                                                                            f"Imported COLMAP model.\nMax 3D ID found: {self.max_point3d_id}"))
 
     def _on_export_images_txt(self):
         print("正在导出修正后的 images.txt...")
 
-        output_lines = []
         output_filepath = os.path.join(self.output_dir, "corrected_images.txt")
         matches_filepath = os.path.join(self.output_dir, "matches.txt")
 
         all_names = sorted(self.image_files)
+        # Snapshot on the GUI thread; annotating can continue while the export runs.
+        annotations = self.annotations.snapshot()
+        metadata = dict(self.image_metadata)
 
-        exported_count = 0
-        point3d_to_kpidx = {}
-
-        for idx, img_name in enumerate(all_names):
-            metadata = self.image_metadata.get(img_name)
-            annotations = self.annotations.get(img_name, {})
-
-            if metadata is None:
-                image_id = idx + 1
-                qw, qx, qy, qz = 1.0, 0.0, 0.0, 0.0
-                tx, ty, tz = 0.0, 0.0, 0.0
-                camera_id = 1
-            else:
-                image_id = metadata['IMAGE_ID']
-                qw, qx, qy, qz = metadata['QW'], metadata['QX'], metadata['QY'], metadata['QZ']
-                tx, ty, tz = metadata['TX'], metadata['TY'], metadata['TZ']
-                camera_id = metadata['CAMERA_ID']
-
-            line1 = f"{image_id} {qw} {qx} {qy} {qz} {tx} {ty} {tz} {camera_id} {img_name}\n"
-            output_lines.append(line1)
-
-            keypoint_str = []
-            point3d_idx_map = {}
-            if annotations:
-                sorted_annotations = sorted(annotations.items(), key=lambda item: item[0])
-                for kp_idx, (fid, data) in enumerate(sorted_annotations):
-                    x, y, _, _, _, point3d_id = data
-                    keypoint_str.append(f"{x:.6f} {y:.6f} {point3d_id}")
-                    if point3d_id > 0 and point3d_id not in point3d_idx_map:
-                        point3d_idx_map[point3d_id] = kp_idx
-
-            line2 = " ".join(keypoint_str) + "\n"
-            output_lines.append(line2)
-            exported_count += 1
-            point3d_to_kpidx[img_name] = point3d_idx_map
+        def work(job):
+            exported_count = write_images_txt(
+                output_filepath, all_names, annotations, metadata,
+                lambda done, total: job.report(done, total, "Exporting images.txt"))
+            write_matches_txt(matches_filepath, iter_matches(
+                all_names, annotations, MIN_MATCHES,
+                lambda done, total: job.report(done, total, "Exporting matches.txt")))
+            return exported_count
 
-        try:
-            with open(output_filepath, 'w') as f:
-                f.write("# Corrected image list generated by ManualFeatureAnnotator\n")
-                f.write("# Format: IMAGE_ID, QW, QX, QY, QZ, TX, TY, TZ, CAMERA_ID, NAME\n")
-                f.write("#         POINTS2D[] as (X, Y, POINT3D_ID)\n")
-                f.write(f"# Number of images: {exported_count}, mean observations per image: N/A\n")
-                f.writelines(output_lines)
-
-            match_lines = []
-            for i in range(len(all_names)):
-                for j in range(i + 1, len(all_names)):
-                    name_i = all_names[i]
-                    name_j = all_names[j]
-                    map_i = point3d_to_kpidx.get(name_i, {})
-                    map_j = point3d_to_kpidx.get(name_j, {})
-
-                    common_ids = sorted(set(map_i.keys()) & set(map_j.keys()))
-                    if not common_ids:
-                        continue
-
-                    match_lines.append(f"{name_i} {name_j}\n")
-                    for pid in common_ids:
-                        match_lines.append(f"{map_i[pid]} {map_j[pid]}\n")
-                    match_lines.append("\n")
-
-            if match_lines:
-                with open(matches_filepath, 'w') as mf:
-                    mf.write("# COLMAP text matches generated by ManualFeatureAnnotator\n")
-                    mf.write("# Each block: image_name1 image_name2 followed by lines of keypoint_idx1 keypoint_idx2\n")
-                    mf.writelines(match_lines)
-
-            self.app.post_to_main_thread(self.window,
-                                         lambda: self._show_message("Success",
-                                                                    f"Exported {exported_count} images to {output_filepath}\n"
-                                                                    f"Matches saved to {matches_filepath}"))
-        except Exception as e:
-            self.app.post_to_main_thread(self.window,
-                                         lambda: self._show_message("Error", f"Failed to save images.txt: {e}"))
+        def on_done(exported_count):
+            self._show_message("Success",
+                               f"Exported {exported_count} images to {output_filepath}\n"
+                               f"Matches saved to {matches_filepath}")
+
+        def on_error(e):
+            self._show_message("Error", f"Failed to save images.txt: {e}")
+
+        self._start_job("Exporting images.txt", work, on_done, on_error)
+
+    def _on_export_model_bin(self):
+        model_dir = os.path.join(self.output_dir, "sparse")
+        os.makedirs(model_dir, exist_ok=True)
+
+        all_names = sorted(self.image_files)
+        annotations = self.annotations.snapshot()
+        metadata = dict(self.image_metadata)
+        cameras = dict(self.cameras)
+        points3d = self.points3d
+
+        def work(job):
+            exported_count = write_images_bin(
+                os.path.join(model_dir, "images.bin"), all_names, annotations, metadata,
+                lambda done, total: job.report(done, total, "Exporting images.bin"))
+            job.report(0, 1, "Exporting points3D.bin")
+            write_points3d_bin(os.path.join(model_dir, "points3D.bin"), all_names, annotations, metadata, points3d)
+            if cameras:
+                write_cameras_bin(os.path.join(model_dir, "cameras.bin"), cameras)
+            return exported_count
+
+        def on_done(exported_count):
+            self._show_message("Success", f"Exported {exported_count} images to binary model in {model_dir}")
+
+        def on_error(e):
+            self._show_message("Error", f"Failed to save binary model: {e}")
+
+        self._start_job("Exporting binary model", work, on_done, on_error)
+
+    def _on_export_feature_files(self):
+        features_dir = os.path.join(self.output_dir, "features")
+        all_names = sorted(self.image_files)
+        annotations = self.annotations.snapshot()
+
+        # Versions are unique across stores, so an image with the version of its last export is unchanged.
+        versions = {name: annotations.version(name) for name in all_names}
+        unchanged = {name for name in all_names if versions[name] == self.feature_export_versions.get(name)}
+
+        def work(job):
+            return write_feature_files(features_dir, all_names, annotations, unchanged=unchanged,
+                                       progress=lambda done, total: job.report(done, total, "Exporting feature files"))
+
+        def on_done(result):
+            written, skipped = result
+            self.feature_export_versions = versions
+            self._show_message("Success", f"Wrote {written} feature files ({skipped} unchanged) to {features_dir}")
+
+        def on_error(e):
+            self._show_message("Error", f"Failed to export feature files: {e}")
+
+        self._start_job("Exporting feature files", work, on_done, on_error)
+
+    def _on_export_database(self):
+        db_path = os.path.join(self.output_dir, "database.db")
+        os.makedirs(self.output_dir, exist_ok=True)
+
+        all_names = sorted(self.image_files)
+        annotations = self.annotations.snapshot()
+        metadata = dict(self.image_metadata)
+        cameras = dict(self.cameras)
+        fallback_camera = None
+        if self.cv_img_left is not None:
+            fallback_camera = default_camera(self.cv_img_left.shape[1], self.cv_img_left.shape[0])
+
+        # Only images edited since the last export into this database are rewritten.
+        versions = {name: annotations.version(name) for name in all_names}
+        changed = None
+        if self.db_export_versions and os.path.exists(db_path):
+            changed = [name for name in all_names if versions[name] != self.db_export_versions.get(name)]
+
+        def work(job):
+            return export_database(
+                db_path, all_names, annotations, metadata, cameras, fallback_camera, changed,
+                MIN_MATCHES, lambda done, total: job.report(done, total, "Exporting database.db"))
+
+        def on_done(result):
+            images_written, pairs_written = result
+            self.db_export_versions = versions
+            self._show_message("Success",
+                               f"Updated {images_written} images and {pairs_written} matched pairs in {db_path}")
+
+        def on_error(e):
+            self._show_message("Error", f"Failed to export database.db: {e}")
+
+        self._start_job("Exporting database.db", work, on_done, on_error)
+
+    def _on_recompute_descriptors(self):
+        all_names = sorted(self.image_files)
+        annotations = self.annotations.snapshot()
+        checkpoint_dir = os.path.join(self.output_dir, "descriptor_checkpoint")
+
+        def apply(name, records, descriptors, valid):
+            # Points moved or deleted since the snapshot keep their current descriptor.
+            self.annotations[name].set_descriptors(
+                records['fid'][valid], descriptors[valid], records['x'][valid], records['y'][valid])
+
+        def work(job):
+            images = 0
+            for name, records, descriptors, valid in recompute_descriptors(
+                    self.image_folder, all_names, annotations, checkpoint_dir,
+                    progress=lambda done, total: job.report(done, total, "Recomputing descriptors")):
+                self.app.post_to_main_thread(self.window, lambda args=(name, records, descriptors, valid): apply(*args))
+                images += 1
+            return images
+
+        def on_done(images):
+            self._compact_journal()
+            self._request_redraw()
+            self._show_message("Success", f"Recomputed SIFT descriptors for {images} images")
+
+        self._start_job("Recomputing descriptors", work, on_done)
@@ -0,0 +1,115 @@
+import os
+import threading
+from collections import OrderedDict
+from concurrent.futures import CancelledError, ThreadPoolExecutor
+
+import cv2
+
+from .constants import IMAGE_CACHE_BYTES, PREFETCH_WORKERS
+from .profiling import profiler
+
+
+class ImageCache:
+    """Byte-budgeted LRU cache of decoded images with background prefetching."""
+
+    def __init__(self, image_folder, max_bytes=IMAGE_CACHE_BYTES, workers=PREFETCH_WORKERS):
+        self.image_folder = image_folder
+        self.max_bytes = max_bytes
+
+        self._images = OrderedDict()
+        self._pending = {}
+        self._bytes = 0
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="image-prefetch")
+
+        self.hits = 0
+        self.misses = 0
+        self.prefetch_waits = 0
+
+    def get(self, name):
+        with self._lock:
+            img = self._images.get(name)
+            if img is not None:
+                self._images.move_to_end(name)
+                self.hits += 1
+                profiler.count('image_cache.hit')
+                return img
+
+            future = self._pending.get(name)
+            if future is not None:
+                self.prefetch_waits += 1
+            else:
+                self.misses += 1
+            profiler.count('image_cache.miss')
+
+        # A prefetch for this image is already running; wait for it instead of decoding twice.
+        if future is not None:
+            try:
+                return future.result()
+            except CancelledError:
+                # close() cancelled it before it started, so it never clears its own entry.
+                with self._lock:
+                    if self._pending.get(name) is future:
+                        del self._pending[name]
+
+        img = self._decode(name)
+        self._insert(name, img)
+        return img
+
+    def prefetch(self, names):
+        for name in names:
+            if name is None:
+                continue
+            with self._lock:
+                if name in self._images or name in self._pending:
+                    continue
+                self._pending[name] = self._executor.submit(self._prefetch_one, name)
+
+    def stats(self):
+        with self._lock:
+            lookups = self.hits + self.misses + self.prefetch_waits
+            return {
+                'hits': self.hits,
+                'misses': self.misses,
+                'prefetch_waits': self.prefetch_waits,
+                'hit_rate': (self.hits + self.prefetch_waits) / lookups if lookups else 0.0,
+                'entries': len(self._images),
+                'pending': len(self._pending),
+                'bytes': self._bytes,
+                'max_bytes': self.max_bytes,
+            }
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        with self._lock:
+            self._pending = {name: future for name, future in self._pending.items() if not future.cancelled()}
+
+    def _prefetch_one(self, name):
+        try:
+            img = self._decode(name)
+            self._insert(name, img)
+            return img
+        finally:
+            with self._lock:
+                self._pending.pop(name, None)
+
+    def _decode(self, name):
+        with profiler.span('image.decode'):
+            return cv2.imread(os.path.join(self.image_folder, name))
+
+    def _insert(self, name, img):
+        if img is None:
+            return
+
+        with self._lock:
+            old = self._images.pop(name, None)
+            if old is not None:
+                self._bytes -= old.nbytes
+
+            self._images[name] = img
+            self._bytes += img.nbytes
+
+            # Evict least recently used images, but always keep the one just inserted.
+            while self._bytes > self.max_bytes and len(self._images) > 1:
+                _, evicted = self._images.popitem(last=False)
+                self._bytes -= evicted.nbytes
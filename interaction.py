@@ -1,7 +1,9 @@
-import cv2
 import open3d.visualization.gui as gui
 
-from .constants import DEFAULT_SCALE
+from .constants import DEFAULT_SCALE, EPIPOLAR_BAND_PX, MATCH_MIN_SCORE, SELECT_RADIUS_PX, WHEEL_ZOOM_STEP
+from .epipolar import epipolar_line, line_distance
+from .matching import predict_location, propose_match, propose_matches
+from .profiling import profiled
 
 
 class AnnotationMixin:
@@ -13,41 +15,48 @@ class AnnotationMixin:
         name_right = self.image_files[self.current_idx + 1]
 
         deleted = False
-        if current_id in self.annotations[name_left]:
-            del self.annotations[name_left][current_id]
-            deleted = True
-        if current_id in self.annotations[name_right]:
-            del self.annotations[name_right][current_id]
-            deleted = True
+        for name in (name_left, name_right):
+            if self.annotations[name].delete([current_id]):
+                self.journal.record_delete(name, [current_id])
+                deleted = True
 
         if deleted:
-            self.app.post_to_main_thread(self.window, self._update_display_images)
+            self._compact_journal_if_needed()
+            self._request_redraw()
         else:
             print(f"ID {current_id} not found to delete.")
 
+    @profiled("add_feature_point")
     def _add_feature_point(self, is_left, x, y):
         target_img = self.cv_img_left if is_left else self.cv_img_right
         filename = self.image_files[self.current_idx if is_left else self.current_idx + 1]
 
+        annotations = self.annotations[filename]
+        left_annotations = self.annotations[self.image_files[self.current_idx]]
+        # A manual click on either image replaces a pending proposal.
+        self.proposal = None
+
         current_id = self.current_feature_id
         point3d_id = -1
 
-        if current_id in self.annotations[filename]:
-            point3d_id = self.annotations[filename][current_id][5]
+        if current_id in annotations:
+            point3d_id = annotations.point3d_id(current_id)
         elif is_left:
             self.max_point3d_id += 1
             point3d_id = self.max_point3d_id
-        elif not is_left and current_id in self.annotations[self.image_files[self.current_idx]]:
-            point3d_id = self.annotations[self.image_files[self.current_idx]][current_id][5]
+        elif not is_left and current_id in left_annotations:
+            point3d_id = left_annotations.point3d_id(current_id)
+
+        line = None if is_left else self._epipolar_line(current_id)
+        if line is not None and abs(line_distance(line, x, y)) > EPIPOLAR_BAND_PX:
+            print(f"Note: ID {current_id} is {abs(line_distance(line, x, y)):.1f}px off its epipolar line")
 
-        kp = cv2.KeyPoint(float(x), float(y), DEFAULT_SCALE)
-        gray = cv2.cvtColor(target_img, cv2.COLOR_BGR2GRAY) if len(target_img.shape) == 3 else target_img
-        kps, des = self.sift.compute(gray, [kp])
+        kp, des = self.descriptor_service.compute(filename, target_img, x, y, DEFAULT_SCALE)
 
-        if des is not None and len(des) > 0:
-            self.annotations[filename][current_id] = (
-                x, y, des[0], kps[0].size, kps[0].angle, point3d_id
-            )
+        if des is not None:
+            annotations.set(current_id, x, y, des, kp.size, kp.angle, point3d_id)
+            self.journal.record_set(filename, current_id, x, y, kp.size, kp.angle, point3d_id, des)
+            self._compact_journal_if_needed()
             print(f"Marked/Updated ID {current_id} ({'Left' if is_left else 'Right'}). 3D ID: {point3d_id} ({x:.2f}, {y:.2f})")
 
             name_left = self.image_files[self.current_idx]
@@ -57,29 +66,116 @@ class AnnotationMixin:
 
             if has_left and has_right:
                 print(f"Feature {current_id} complete. Auto-incrementing...")
-                self.current_feature_id += 1
+                self.current_feature_id = self._track_index().allocate()
                 self.app.post_to_main_thread(self.window, lambda: setattr(self.id_input, 'int_value', self.current_feature_id))
+            elif is_left and self.assist_mode:
+                self._propose_right_point(current_id, x, y)
         else:
             print(f"Warning: Could not compute SIFT descriptor at ({x:.2f}, {y:.2f}) on {filename}. Point not saved.")
 
-    def _delete_points_in_box(self, is_left, x1, y1, x2, y2):
+    def _propose_right_point(self, fid, x, y):
+        name_left = self.image_files[self.current_idx]
+        name_right = self.image_files[self.current_idx + 1]
+        left_gray = self.descriptor_service.gray(name_left, self.cv_img_left)
+        right_gray = self.descriptor_service.gray(name_right, self.cv_img_right)
+
+        center = predict_location(self.annotations.get(name_left).records, self.annotations.get(name_right).records, x, y)
+        line = epipolar_line(self.fundamental, x, y) if self.fundamental is not None else None
+        result = propose_match(left_gray, right_gray, x, y, center, line)
+        if result is None or result[2] < MATCH_MIN_SCORE:
+            print(f"No match proposal for ID {fid}" + (f" (score {result[2]:.2f})" if result else ""))
+            return
+
+        self.proposal = (fid,) + result
+        print(f"Proposed ID {fid} on the right at ({result[0]:.2f}, {result[1]:.2f}), score {result[2]:.2f}. Enter to accept.")
+        self._request_redraw(False)
+
+    def _accept_proposal(self):
+        if self.proposal is None:
+            return
+        fid, x, y, _ = self.proposal
+        self.current_feature_id = fid
+        self._add_feature_point(False, x, y)
+        self._request_redraw()
+
+    def _on_propagate_matches(self):
+        if self.cv_img_left is None or self.cv_img_right is None:
+            return
+        name_left = self.image_files[self.current_idx]
+        name_right = self.image_files[self.current_idx + 1]
+        left = self.annotations.get(name_left).snapshot()
+        right = self.annotations.get(name_right).snapshot()
+        fids = left.missing_from(right)
+        if len(fids) == 0:
+            self._show_message("Info", "Every left feature is already marked on the right image.")
+            return
+
+        left_gray = self.descriptor_service.gray(name_left, self.cv_img_left)
+        right_gray = self.descriptor_service.gray(name_right, self.cv_img_right)
+        right_img = self.cv_img_right
+        fundamental = self.fundamental
+
+        def work(job):
+            return propose_matches(left_gray, right_gray, left.records, right.records, fids, fundamental,
+                                   progress=lambda done, total: job.report(done, total, "Matching left-only features"))
+
+        def on_done(proposals):
+            added = 0
+            annotations = self.annotations[name_right]
+            left_annotations = self.annotations.get(name_left)
+            for fid, x, y, _ in proposals:
+                # Features marked or removed by hand while matching ran are left alone.
+                if fid in annotations or fid not in left_annotations:
+                    continue
+                kp, des = self.descriptor_service.compute(name_right, right_img, x, y, DEFAULT_SCALE)
+                if des is None:
+                    continue
+                point3d_id = left_annotations.point3d_id(fid)
+                annotations.set(fid, x, y, des, kp.size, kp.angle, point3d_id)
+                self.journal.record_set(name_right, fid, x, y, kp.size, kp.angle, point3d_id, des)
+                added += 1
+
+            self._compact_journal_if_needed()
+            self._request_redraw()
+            self._show_message("Success", f"Propagated {added} of {len(fids)} left-only features")
+
+        self._start_job("Propagating matches", work, on_done)
+
+    def _epipolar_line(self, fid):
+        # Right-image epipolar line of the left point ``fid``, if the pair has poses.
+        if self.fundamental is None:
+            return None
+        left = self.annotations.get(self.image_files[self.current_idx]).get(fid)
+        return None if left is None else epipolar_line(self.fundamental, left[0], left[1])
+
+    def _select_nearest_feature(self, is_left, x, y):
         filename = self.image_files[self.current_idx if is_left else self.current_idx + 1]
+        max_dist = SELECT_RADIUS_PX / self._viewport(is_left).zoom
 
-        x_min, x_max = min(x1, x2), max(x1, x2)
-        y_min, y_max = min(y1, y2), max(y1, y2)
+        hit = self.annotations.get(filename).nearest(x, y, max_dist)
+        if hit is None:
+            print(f"No feature within {max_dist:.1f}px of ({x:.2f}, {y:.2f}) on {filename}")
+            return
 
-        ids_to_delete = []
-        for fid, data in self.annotations[filename].items():
-            fx, fy = data[0], data[1]
-            if x_min <= fx <= x_max and y_min <= fy <= y_max:
-                ids_to_delete.append(fid)
+        self.current_feature_id = hit[0]
+        print(f"Selected ID {hit[0]}, marked in {self._track_index().track_length(hit[0])} images")
+        self.app.post_to_main_thread(self.window, lambda: setattr(self.id_input, 'int_value', self.current_feature_id))
+        self._request_redraw()
 
-        for fid in ids_to_delete:
-            del self.annotations[filename][fid]
+    @profiled("delete_points_in_box")
+    def _delete_points_in_box(self, is_left, x1, y1, x2, y2):
+        filename = self.image_files[self.current_idx if is_left else self.current_idx + 1]
 
-        print(f"Box Delete: Removed {len(ids_to_delete)} points from {filename}")
+        deleted_ids = self.annotations[filename].delete_in_rect(x1, y1, x2, y2)
+        self.journal.record_delete(filename, deleted_ids)
+        self._compact_journal_if_needed()
+
+        print(f"Box Delete: Removed {len(deleted_ids)} points from {filename}")
 
     def _on_mouse_event(self, event, is_left):
+        if self._on_view_mouse_event(event, is_left):
+            return True
+
         if event.type == gui.MouseEvent.Type.BUTTON_DOWN and event.is_button_down(gui.MouseButton.LEFT):
             widget = self.left_widget if is_left else self.right_widget
             coords = self._get_img_coords_from_mouse(widget, event.x, event.y, is_left)
@@ -94,10 +190,12 @@ class AnnotationMixin:
                         self.drag_start_coord = (img_x, img_y)
                         self.drag_curr_coord = (img_x, img_y)
                         self.drag_is_left = is_left
-                        self.app.post_to_main_thread(self.window, self._update_display_images)
+                        self._request_redraw(is_left)
+                    elif event.is_modifier_down(gui.KeyModifier.CTRL):
+                        self._select_nearest_feature(is_left, img_x, img_y)
                     else:
                         self._add_feature_point(is_left, img_x, img_y)
-                        self.app.post_to_main_thread(self.window, self._update_display_images)
+                        self._request_redraw()
 
             return True
 
@@ -108,7 +206,7 @@ class AnnotationMixin:
                     coords = self._get_img_coords_from_mouse(widget, event.x, event.y, is_left)
                     if coords:
                         self.drag_curr_coord = coords
-                        self.app.post_to_main_thread(self.window, self._update_display_images)
+                        self._request_redraw(is_left)
                 return True
 
         elif event.type == gui.MouseEvent.Type.BUTTON_UP:
@@ -122,7 +220,34 @@ class AnnotationMixin:
                 self.drag_start_coord = None
                 self.drag_curr_coord = None
                 self.drag_is_left = None
-                self.app.post_to_main_thread(self.window, self._update_display_images)
+                self._request_redraw()
+                return True
+
+        return False
+
+    def _on_view_mouse_event(self, event, is_left):
+        # Wheel zooms around the cursor, right-button drag pans the pane.
+        widget = self.left_widget if is_left else self.right_widget
+
+        if event.type == gui.MouseEvent.Type.WHEEL:
+            anchor = self._get_view_coords_from_mouse(widget, event.x, event.y, is_left)
+            self._set_zoom(self.zoom_factor * WHEEL_ZOOM_STEP ** (-event.wheel_dy), is_left, anchor)
+            self._request_redraw()
+            return True
+
+        if event.type == gui.MouseEvent.Type.BUTTON_DOWN and event.is_button_down(gui.MouseButton.RIGHT):
+            self.pan_last_view = self._get_view_coords_from_mouse(widget, event.x, event.y, is_left)
+            return True
+
+        if self.pan_last_view is not None:
+            if event.type == gui.MouseEvent.Type.DRAG:
+                view_x, view_y = self._get_view_coords_from_mouse(widget, event.x, event.y, is_left)
+                self._viewport(is_left).pan(view_x - self.pan_last_view[0], view_y - self.pan_last_view[1])
+                self.pan_last_view = (view_x, view_y)
+                self._request_redraw(is_left)
+                return True
+            if event.type == gui.MouseEvent.Type.BUTTON_UP:
+                self.pan_last_view = None
                 return True
 
         return False
@@ -0,0 +1,98 @@
+import threading
+import time
+from concurrent.futures import ThreadPoolExecutor
+
+from .constants import PROGRESS_INTERVAL
+from .profiling import profiler
+
+
+class JobCancelled(Exception):
+    """Raised inside a job once cancellation was requested."""
+
+
+class Job:
+    """Handle of one background job: progress reporting and cancellation."""
+
+    def __init__(self, name, on_progress=None):
+        self.name = name
+        self.fraction = 0.0
+        self.message = name
+        self._on_progress = on_progress
+        self._cancel_event = threading.Event()
+        self._last_report = 0.0
+
+    @property
+    def cancelled(self):
+        return self._cancel_event.is_set()
+
+    def cancel(self):
+        self._cancel_event.set()
+
+    def check(self):
+        if self._cancel_event.is_set():
+            raise JobCancelled(self.name)
+
+    def report(self, done, total, message=None):
+        # Called from the worker; doubles as a cancellation point.
+        self.check()
+        self.fraction = done / total if total else 1.0
+        if message is not None:
+            self.message = message
+
+        now = time.monotonic()
+        if self._on_progress is not None and (now - self._last_report >= PROGRESS_INTERVAL or done >= total):
+            self._last_report = now
+            self._on_progress(self)
+
+
+class JobRunner:
+    """Runs one background job at a time and delivers its outcome on the GUI thread.
+
+    ``post`` schedules a callable on the GUI thread, e.g. a wrapper around
+    ``gui.Application.post_to_main_thread``.
+    """
+
+    def __init__(self, post, workers=1):
+        self.post = post
+        self.current = None
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="annotator-job")
+
+    @property
+    def busy(self):
+        return self.current is not None
+
+    def submit(self, name, work, on_done, on_error=None, on_cancelled=None, on_progress=None):
+        if self.busy:
+            return None
+
+        job = Job(name, (lambda j: self.post(lambda: on_progress(j))) if on_progress else None)
+        self.current = job
+
+        def run():
+            try:
+                with profiler.span(f"job: {name}"):
+                    result = work(job)
+            except JobCancelled:
+                self.post(lambda: self._finish(job, on_cancelled))
+            except Exception as e:
+                # ``e`` is unbound when the except block ends, so it is bound as a default.
+                self.post(lambda e=e: self._finish(job, on_error, e))
+            else:
+                self.post(lambda: self._finish(job, on_done, result))
+
+        self._executor.submit(run)
+        return job
+
+    def cancel(self):
+        if self.current is not None:
+            self.current.cancel()
+
+    def close(self):
+        self.cancel()
+        self._executor.shutdown(wait=False, cancel_futures=True)
+
+    def _finish(self, job, callback, *args):
+        if self.current is job:
+            self.current = None
+        if callback is not None:
+            callback(*args)
@@ -0,0 +1,346 @@
+import glob
+import json
+import os
+import re
+import threading
+import time
+
+import numpy as np
+
+from .annotation_store import RECORD_DTYPE, AnnotationStore, ImageAnnotations
+from .constants import JOURNAL_COMPACT_RECORDS, JOURNAL_FSYNC_INTERVAL, JOURNAL_FSYNC_RECORDS
+from .descriptors import descriptors_to_uint8
+
+OP_NAME = 1
+OP_SET = 2
+OP_DELETE = 3
+
+# Fixed-size records, so a whole segment replays with one np.fromfile call. NAME
+# records register an image name in 128-byte chunks of ``descriptor``; ``fid``
+# holds the chunk index and ``image`` the index the name is referred to by.
+JOURNAL_DTYPE = np.dtype([
+    ('op', '<u1'),
+    ('image', '<u4'),
+    ('fid', '<i8'),
+    ('x', '<f8'),
+    ('y', '<f8'),
+    ('size', '<f4'),
+    ('angle', '<f4'),
+    ('point3d_id', '<i8'),
+    ('descriptor', 'u1', (128,)),
+])
+
+SNAPSHOT_NAME = "snapshot.npz"
+_SEGMENT_PATTERN = re.compile(r"journal-(\d+)\.bin$")
+
+
+def _segment_path(journal_dir, generation):
+    return os.path.join(journal_dir, f"journal-{generation:06d}.bin")
+
+
+def write_snapshot(path, generation, annotations, metadata, cameras, points3d):
+    names, counts, records, descriptors = [], [], [], []
+    desc_offset = 0
+    for name, image_annotations in annotations.items():
+        if not image_annotations:
+            continue
+        image_records, image_descriptors = image_annotations.to_arrays()
+        image_records['desc_row'][image_records['desc_row'] >= 0] += desc_offset
+        desc_offset += len(image_descriptors)
+        names.append(name)
+        counts.append(len(image_records))
+        records.append(image_records)
+        descriptors.append(image_descriptors)
+
+    point3d_ids = np.array(sorted(points3d), dtype=np.int64)
+    point3d_values = np.array([points3d[i] for i in point3d_ids.tolist()], dtype=np.float64).reshape(-1, 7)
+    state = {'metadata': metadata, 'cameras': {str(k): v for k, v in cameras.items()}}
+
+    tmp_path = path + ".tmp.npz"
+    np.savez(tmp_path,
+             generation=np.int64(generation),
+             names=np.array(names, dtype=str),
+             counts=np.array(counts, dtype=np.int64),
+             records=np.concatenate(records) if records else np.empty(0, dtype=RECORD_DTYPE),
+             descriptors=np.concatenate(descriptors) if descriptors else np.empty((0, 128), dtype=np.uint8),
+             point3d_ids=point3d_ids,
+             point3d_values=point3d_values,
+             state=np.array(json.dumps(state)))
+    with open(tmp_path, 'rb') as f:
+        os.fsync(f.fileno())
+    os.replace(tmp_path, path)
+
+
+def read_snapshot(path, pool=None):
+    images = {}
+    with np.load(path) as data:
+        generation = int(data['generation'])
+        records = data['records']
+        descriptors = data['descriptors']
+        counts = data['counts']
+        names = data['names'].tolist()
+        point3d_ids = data['point3d_ids'].tolist()
+        point3d_values = data['point3d_values']
+        state = json.loads(str(data['state']))
+
+    starts = np.r_[0, np.cumsum(counts)]
+    for name, start, end in zip(names, starts[:-1].tolist(), starts[1:].tolist()):
+        image_records = records[start:end].copy()
+        used = image_records['desc_row'] >= 0
+        image_descriptors = descriptors[image_records['desc_row'][used]]
+        image_records['desc_row'][used] = np.arange(len(image_descriptors))
+        images[name] = ImageAnnotations.from_arrays(image_records, image_descriptors, pool)
+
+    points3d = {}
+    for point3d_id, (x, y, z, r, g, b, error) in zip(point3d_ids, point3d_values.tolist()):
+        points3d[point3d_id] = (x, y, z, int(r), int(g), int(b), error)
+    cameras = {int(k): v for k, v in state['cameras'].items()}
+    return generation, AnnotationStore.from_images(images, pool), state['metadata'], cameras, points3d
+
+
+def replay_segment(path, annotations):
+    """Apply one journal segment; only the last edit of each feature is applied."""
+    # A record cut short by a crash is ignored.
+    records = np.fromfile(path, dtype=JOURNAL_DTYPE, count=os.path.getsize(path) // JOURNAL_DTYPE.itemsize)
+
+    names = {}
+    is_name = records['op'] == OP_NAME
+    for record in records[is_name]:
+        names[int(record['image'])] = names.get(int(record['image']), b"") if record['fid'] else b""
+        names[int(record['image'])] += record['descriptor'].tobytes().rstrip(b'\0')
+
+    edits = records[~is_name]
+    if len(edits) == 0:
+        return len(records)
+    # Stable sort by (image, fid) keeps journal order within a feature; the last edit wins.
+    order = np.lexsort((edits['fid'], edits['image']))
+    edits = edits[order]
+    last = np.ones(len(edits), dtype=bool)
+    last[:-1] = (edits['image'][1:] != edits['image'][:-1]) | (edits['fid'][1:] != edits['fid'][:-1])
+    edits = edits[last]
+
+    boundaries = np.flatnonzero(np.diff(edits['image'])) + 1
+    for image_edits in np.split(edits, boundaries):
+        image_annotations = annotations[names[int(image_edits['image'][0])].decode('utf-8')]
+        # Updated features are re-inserted in bulk after removing their old records.
+        image_annotations.delete(image_edits['fid'])
+        sets = image_edits[image_edits['op'] == OP_SET]
+        image_annotations.extend(sets['fid'], sets['x'], sets['y'], sets['point3d_id'], sets['size'], sets['angle'],
+                                 sets['descriptor'])
+    return len(records)
+
+
+class AnnotationJournal:
+    """Append-only log of annotation edits, compacted into a snapshot from time to time.
+
+    Edits are appended to ``journal-<generation>.bin`` and fsynced in batches of
+    ``fsync_records`` records or after ``fsync_interval`` seconds. Compaction starts
+    a new segment and writes the snapshot in a background thread; the snapshot
+    records which segment it is followed by, so a crash at any point still replays
+    to the last synced edit.
+    """
+
+    def __init__(self, journal_dir, fsync_records=JOURNAL_FSYNC_RECORDS, fsync_interval=JOURNAL_FSYNC_INTERVAL,
+                 compact_records=JOURNAL_COMPACT_RECORDS):
+        self.journal_dir = journal_dir
+        self.fsync_records = fsync_records
+        self.fsync_interval = fsync_interval
+        self.compact_records = compact_records
+        os.makedirs(journal_dir, exist_ok=True)
+
+        self.generation = 0
+        self.records = 0
+        self._file = None
+        self._names = {}
+        self._unsynced = 0
+        self._timer = None
+        self._compactor = None
+        self._lock = threading.Lock()
+
+    def recover(self, pool=None):
+        """Load snapshot plus journal; returns ``(annotations, metadata, cameras, points3d)`` or None.
+
+        Recovered descriptors are stored in ``pool`` if given.
+        """
+        started = time.perf_counter()
+        snapshot_path = os.path.join(self.journal_dir, SNAPSHOT_NAME)
+        if os.path.exists(snapshot_path):
+            generation, annotations, metadata, cameras, points3d = read_snapshot(snapshot_path, pool)
+        else:
+            generation, annotations, metadata, cameras, points3d = 0, AnnotationStore(pool), None, {}, {}
+
+        replayed = 0
+        segments = self._segments()
+        for segment_generation, path in segments:
+            if segment_generation >= generation:
+                replayed += replay_segment(path, annotations)
+            else:
+                os.remove(path)
+
+        # New edits never append to a segment that may end in a torn record.
+        self.generation = max([generation] + [g for g, _ in segments]) + 1
+        self._start_segment()
+        self.records = replayed
+
+        if metadata is None and not replayed:
+            return None
+        print(f"Recovered {annotations.total_points()} points ({replayed} journal records) "
+              f"in {time.perf_counter() - started:.2f}s")
+        return annotations, metadata or {}, cameras, points3d
+
+    def record_set(self, name, fid, x, y, size, angle, point3d_id, descriptor):
+        record = np.zeros(1, dtype=JOURNAL_DTYPE)
+        record['op'] = OP_SET
+        record['image'] = self._image_index(name)
+        record['fid'] = fid
+        record['x'] = x
+        record['y'] = y
+        record['size'] = size
+        record['angle'] = angle
+        record['point3d_id'] = point3d_id
+        record['descriptor'] = descriptors_to_uint8(descriptor)
+        self._append(record)
+
+    def record_delete(self, name, fids):
+        fids = np.atleast_1d(np.asarray(fids, dtype=np.int64))
+        if len(fids) == 0:
+            return
+        records = np.zeros(len(fids), dtype=JOURNAL_DTYPE)
+        records['op'] = OP_DELETE
+        records['image'] = self._image_index(name)
+        records['fid'] = fids
+        self._append(records)
+
+    def needs_compaction(self):
+        return self.records >= self.compact_records and self._compactor is None
+
+    def compact(self, annotations, metadata, cameras, points3d, wait=False, on_error=None):
+        """Start a new segment and write a snapshot of the given state behind it.
+
+        ``annotations`` should be a snapshot taken on the GUI thread; edits made
+        after this call go to the new segment. If the snapshot cannot be written
+        the older segments are kept, so recovery still replays every edit; the
+        error is raised here with ``wait``, otherwise passed to ``on_error`` on
+        the compaction thread.
+        """
+        self.wait()
+
+        with self._lock:
+            self._sync_locked()
+            if self._file is not None:
+                self._file.close()
+            self.generation += 1
+            self._start_segment()
+            self.records = 0
+            generation = self.generation
+
+        errors = []
+
+        def run():
+            try:
+                write_snapshot(os.path.join(self.journal_dir, SNAPSHOT_NAME), generation,
+                               annotations, metadata, cameras, points3d)
+                for segment_generation, path in self._segments():
+                    if segment_generation < generation:
+                        os.remove(path)
+            except Exception as e:
+                print(f"Journal snapshot failed: {e}")
+                errors.append(e)
+                if on_error is not None and not wait:
+                    on_error(e)
+            finally:
+                self._compactor = None
+
+        compactor = threading.Thread(target=run, name="annotator-journal-compact", daemon=True)
+        self._compactor = compactor
+        compactor.start()
+        if wait:
+            compactor.join()
+            if errors:
+                raise errors[0]
+
+    def replace(self, annotations, metadata, cameras, points3d):
+        """Write the given state as the snapshot that replaces everything recorded so far.
+
+        For tools that import a model outside a session; the next ``recover`` returns it.
+        """
+        generation = 0
+        snapshot_path = os.path.join(self.journal_dir, SNAPSHOT_NAME)
+        if os.path.exists(snapshot_path):
+            with np.load(snapshot_path) as data:
+                generation = int(data['generation'])
+        # compact() moves past every existing segment, so none of them is replayed over the new state.
+        self.generation = max([generation] + [g for g, _ in self._segments()])
+        self.compact(annotations, metadata, cameras, points3d, wait=True)
+
+    def wait(self):
+        # Blocks until a running compaction has written its snapshot.
+        compactor = self._compactor
+        if compactor is not None:
+            compactor.join()
+
+    def sync(self):
+        with self._lock:
+            self._sync_locked()
+
+    def close(self):
+        self.wait()
+        with self._lock:
+            if self._timer is not None:
+                self._timer.cancel()
+            if self._file is not None:
+                self._sync_locked()
+                self._file.close()
+                self._file = None
+
+    def _segments(self):
+        segments = []
+        for path in glob.glob(os.path.join(self.journal_dir, "journal-*.bin")):
+            match = _SEGMENT_PATTERN.search(path)
+            if match:
+                segments.append((int(match.group(1)), path))
+        return sorted(segments)
+
+    def _start_segment(self):
+        # Every segment registers its own names, so it can be replayed on its own.
+        # The file itself is only created by the first edit.
+        self._file = None
+        self._names = {}
+
+    def _image_index(self, name):
+        index = self._names.get(name)
+        if index is None:
+            index = self._names[name] = len(self._names)
+            encoded = name.encode('utf-8')
+            chunks = [encoded[i:i + 128] for i in range(0, len(encoded), 128)] or [b""]
+            records = np.zeros(len(chunks), dtype=JOURNAL_DTYPE)
+            records['op'] = OP_NAME
+            records['image'] = index
+            records['fid'] = np.arange(len(chunks))
+            for record, chunk in zip(records, chunks):
+                record['descriptor'][:len(chunk)] = np.frombuffer(chunk, dtype=np.uint8)
+            self._append(records)
+        return index
+
+    def _append(self, records):
+        with self._lock:
+            if self._file is None:
+                self._file = open(_segment_path(self.journal_dir, self.generation), 'ab')
+            self._file.write(records.tobytes())
+            self.records += len(records)
+            self._unsynced += len(records)
+            if self._unsynced >= self.fsync_records:
+                self._sync_locked()
+            elif self._timer is None:
+                self._timer = threading.Timer(self.fsync_interval, self.sync)
+                self._timer.daemon = True
+                self._timer.start()
+
+    def _sync_locked(self):
+        if self._timer is not None:
+            self._timer.cancel()
+            self._timer = None
+        if self._unsynced and self._file is not None:
+            self._file.flush()
+            os.fsync(self._file.fileno())
+            self._unsynced = 0
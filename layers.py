@@ -0,0 +1,39 @@
+class PaneLayers:
+    """Cached render layers for one image pane.
+
+    ``base`` is the viewport crop converted to RGB, ``annotations`` is the base with
+    every feature marker drawn on it, and the transient layer (drag box, current-ID
+    highlight) is composited on a copy of it for each frame.  Each layer remembers
+    the key it was built for, so only layers whose inputs changed are rebuilt.
+    """
+
+    def __init__(self):
+        self.base_key = None
+        self.base = None
+        self.annotations_key = None
+        self.annotations = None
+        self.frame_key = None
+
+    def get_base(self, key, build):
+        if self.base_key != key:
+            self.base = build()
+            self.base_key = key
+        return self.base
+
+    def get_annotations(self, key, build):
+        if self.annotations_key != key:
+            self.annotations = build()
+            self.annotations_key = key
+        return self.annotations
+
+    def needs_frame(self, key):
+        # Returns False when the last uploaded frame is still current.
+        if self.frame_key == key:
+            return False
+        self.frame_key = key
+        return True
+
+    def invalidate(self):
+        self.base_key = None
+        self.annotations_key = None
+        self.frame_key = None
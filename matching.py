@@ -0,0 +1,165 @@
+import math
+from concurrent.futures import ThreadPoolExecutor
+
+import cv2
+import numpy as np
+
+from .constants import (EPIPOLAR_BAND_PX, MATCH_MIN_SCORE, MATCH_NEIGHBOURS, MATCH_PYRAMID_LEVELS,
+                        MATCH_SEARCH_RADIUS, MATCH_TEMPLATE_RADIUS, MATCH_WORKERS)
+from .epipolar import clip_line, epipolar_line, line_distance, project_to_line
+from .profiling import profiled
+
+
+def _crop(img, cx, cy, radius):
+    # Square crop around (cx, cy); None if it does not fit inside the image.
+    x0, y0 = int(round(cx)) - radius, int(round(cy)) - radius
+    x1, y1 = x0 + 2 * radius + 1, y0 + 2 * radius + 1
+    if x0 < 0 or y0 < 0 or x1 > img.shape[1] or y1 > img.shape[0]:
+        return None, x0, y0
+    return img[y0:y1, x0:x1], x0, y0
+
+
+def _crop_clamped(img, cx, cy, radius, line=None, margin=0):
+    x0, y0 = max(int(round(cx)) - radius, 0), max(int(round(cy)) - radius, 0)
+    x1 = min(int(round(cx)) + radius + 1, img.shape[1])
+    y1 = min(int(round(cy)) + radius + 1, img.shape[0])
+    if line is not None:
+        # Only the bounding box of the epipolar band is searched.
+        segment = clip_line(line, x0 - margin, y0 - margin, x1 + margin, y1 + margin)
+        if segment is None:
+            return None, x0, y0
+        (sx0, sy0), (sx1, sy1) = segment
+        x0, x1 = max(x0, int(min(sx0, sx1)) - margin), min(x1, int(max(sx0, sx1)) + margin + 1)
+        y0, y1 = max(y0, int(min(sy0, sy1)) - margin), min(y1, int(max(sy0, sy1)) + margin + 1)
+    return img[y0:y1, x0:x1], x0, y0
+
+
+def _downsample(patch, factor):
+    if factor == 1:
+        return patch
+    return cv2.resize(patch, (max(patch.shape[1] // factor, 1), max(patch.shape[0] // factor, 1)),
+                      interpolation=cv2.INTER_AREA)
+
+
+def _subpixel_peak(scores, px, py):
+    # Quadratic fit through the peak and its direct neighbours, separately per axis.
+    def offset(a, b, c):
+        denom = a - 2.0 * b + c
+        return 0.0 if abs(denom) < 1e-12 else max(-0.5, min(0.5, 0.5 * (a - c) / denom))
+
+    dx = offset(scores[py, px - 1], scores[py, px], scores[py, px + 1]) if 0 < px < scores.shape[1] - 1 else 0.0
+    dy = offset(scores[py - 1, px], scores[py, px], scores[py + 1, px]) if 0 < py < scores.shape[0] - 1 else 0.0
+    return px + dx, py + dy
+
+
+def _match_level(left, right, x, y, cx, cy, factor, template_radius, search_radius, line=None,
+                 band=EPIPOLAR_BAND_PX):
+    """NCC search at one pyramid level; coordinates in and out are full-resolution pixels."""
+    template, _, _ = _crop(left, x, y, template_radius * factor)
+    if template is None:
+        return None
+    band = max(band, factor)
+    region, rx0, ry0 = _crop_clamped(right, cx, cy, (search_radius + template_radius) * factor, line,
+                                     int(math.ceil(band)) + template_radius * factor)
+    if region is None:
+        return None
+
+    template = _downsample(template, factor)
+    region = _downsample(region, factor)
+    if region.shape[0] < template.shape[0] or region.shape[1] < template.shape[1]:
+        return None
+
+    # Template centre of score pixel (i, j) in full-resolution image coordinates. The template
+    # was cut around the rounded left point, so its fractional part is added back.
+    half = template.shape[1] // 2, template.shape[0] // 2
+    offset_x = rx0 + (half[0] + 0.5) * factor - 0.5 + (x - round(x))
+    offset_y = ry0 + (half[1] + 0.5) * factor - 0.5 + (y - round(y))
+
+    scores = cv2.matchTemplate(region, template, cv2.TM_CCOEFF_NORMED)
+    if line is not None:
+        xs = offset_x + factor * np.arange(scores.shape[1], dtype=np.float32)
+        ys = offset_y + factor * np.arange(scores.shape[0], dtype=np.float32)
+        outside = np.abs(line_distance(line, xs[None, :], ys[:, None])) > band
+        if outside.all():
+            return None
+        scores[outside] = -1.0
+    _, score, _, (px, py) = cv2.minMaxLoc(scores)
+    sx, sy = _subpixel_peak(scores, px, py)
+    return offset_x + sx * factor, offset_y + sy * factor, float(score)
+
+
+@profiled("match.propose")
+def propose_match(left_gray, right_gray, x, y, center=None, line=None, template_radius=MATCH_TEMPLATE_RADIUS,
+                  search_radius=MATCH_SEARCH_RADIUS, levels=MATCH_PYRAMID_LEVELS):
+    """Find the right-image location of left point (x, y) by coarse-to-fine NCC.
+
+    The search covers ``search_radius`` pixels around ``center`` (default: the same
+    coordinates), restricted to a band around the epipolar ``line`` if one is given.
+    Only local crops are resampled, so the cost does not depend on the image size.
+    Returns ``(x, y, score)`` with sub-pixel coordinates, or None.
+    """
+    cx, cy = (x, y) if center is None else center
+    if line is not None:
+        cx, cy = project_to_line(line, cx, cy)
+    # Coarsest level that still leaves a few pixels of search range.
+    coarsest = max(0, min(levels - 1, int(math.log2(max(search_radius / 4.0, 1.0)))))
+
+    radius = search_radius
+    result = None
+    for level in range(coarsest, -1, -1):
+        factor = 2 ** level
+        result = _match_level(left_gray, right_gray, x, y, cx, cy, factor, template_radius,
+                              int(math.ceil(radius / factor)), line)
+        if result is None:
+            return None
+        cx, cy, _ = result
+        # Finer levels only refine around the previous estimate.
+        radius = 2 * factor
+    return result
+
+
+def predict_location(left_records, right_records, x, y, neighbours=MATCH_NEIGHBOURS):
+    """Predict the right-image position of (x, y) from features already marked in both images.
+
+    Uses the median displacement of the ``neighbours`` closest shared features, or
+    the same coordinates if the pair has none yet.
+    """
+    shared, left_rows, right_rows = np.intersect1d(left_records['fid'], right_records['fid'],
+                                                   assume_unique=True, return_indices=True)
+    if len(shared) == 0:
+        return x, y
+    lx, ly = left_records['x'][left_rows], left_records['y'][left_rows]
+    dx = right_records['x'][right_rows] - lx
+    dy = right_records['y'][right_rows] - ly
+    if len(shared) > neighbours:
+        nearest = np.argpartition((lx - x) ** 2 + (ly - y) ** 2, neighbours)[:neighbours]
+        dx, dy = dx[nearest], dy[nearest]
+    return x + float(np.median(dx)), y + float(np.median(dy))
+
+
+def propose_matches(left_gray, right_gray, left_records, right_records, fids, fundamental=None,
+                    min_score=MATCH_MIN_SCORE, workers=MATCH_WORKERS, progress=None):
+    """Batch variant: proposals for the left features ``fids``, matched in a thread pool.
+
+    Returns ``[(fid, x, y, score)]`` for proposals scoring at least ``min_score``.
+    With a ``fundamental`` matrix every search is limited to its epipolar band.
+    ``progress(done, total)`` is called per feature and may raise to cancel.
+    """
+    rows = np.searchsorted(left_records['fid'], fids)
+    points = [(int(fid), float(left_records['x'][row]), float(left_records['y'][row]))
+              for fid, row in zip(np.asarray(fids).tolist(), rows.tolist())]
+
+    def work(item):
+        index, (fid, x, y) = item
+        if progress is not None:
+            progress(index, len(points))
+        center = predict_location(left_records, right_records, x, y)
+        line = epipolar_line(fundamental, x, y) if fundamental is not None else None
+        result = propose_match(left_gray, right_gray, x, y, center, line)
+        if result is None or result[2] < min_score:
+            return None
+        return (fid,) + result
+
+    # cv2.matchTemplate releases the GIL, so threads scale without copying the images.
+    with ThreadPoolExecutor(max_workers=workers, thread_name_prefix="match") as executor:
+        return [proposal for proposal in executor.map(work, enumerate(points)) if proposal is not None]
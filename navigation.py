@@ -1,6 +1,5 @@
-import os
-
-import cv2
+from .epipolar import fundamental_matrix
+from .profiling import profiled
 
 
 class NavigationMixin:
@@ -17,17 +16,15 @@ class NavigationMixin:
         else:
             new_right_name = None
 
-        ids_on_new_left = set(self.annotations[new_left_name].keys())
-        ids_on_new_right = set(self.annotations[new_right_name].keys()) if new_right_name and new_right_name in self.annotations else set()
+        annotations_new_left = self.annotations.get(new_left_name)
+        annotations_new_right = self.annotations.get(new_right_name)
 
-        if ids_on_new_left:
-            missing_ids = sorted(list(ids_on_new_left - ids_on_new_right))
-            if missing_ids:
-                self.current_feature_id = missing_ids[0]
-            else:
-                self.current_feature_id = max(ids_on_new_left) + 1
+        missing_ids = annotations_new_left.missing_from(annotations_new_right)
+        if len(missing_ids):
+            self.current_feature_id = int(missing_ids[0])
         else:
-            self.current_feature_id = 1
+            # IDs are global, so a new one must be unused in every image, not just this pair.
+            self.current_feature_id = self._track_index().allocate()
 
         self.current_idx += 1
         self.app.post_to_main_thread(self.window, lambda: setattr(self.id_input, 'int_value', self.current_feature_id))
@@ -43,6 +40,48 @@ class NavigationMixin:
 
         self.app.post_to_main_thread(self.window, self._load_pair)
 
+    def _on_next_incomplete(self):
+        # Jump to the next pair containing a 3D point observed in only one image.
+        tracks = self._point_track_index()
+        idx = tracks.next_incomplete_pair(self.current_idx)
+        if idx is None:
+            self._show_message("Info", "Every 3D point is observed in at least two images.")
+            return
+
+        self.current_idx = idx
+        for image_idx in (idx, idx + 1):
+            singles = tracks.singles(image_idx)
+            if len(singles):
+                records = self.annotations.get(self.image_files[image_idx]).records
+                self.current_feature_id = int(records['fid'][records['point3d_id'] == singles[0]][0])
+                break
+        print(f"Jumped to pair {idx} & {idx + 1}: "
+              f"{len(tracks.singles(idx)) + len(tracks.singles(idx + 1))} unmatched 3D points")
+
+        self.app.post_to_main_thread(self.window, lambda: setattr(self.id_input, 'int_value', self.current_feature_id))
+        self.app.post_to_main_thread(self.window, self._load_pair)
+
+    def _on_show_under_observed(self):
+        tracks = self._point_track_index()
+        point3d_ids = tracks.under_observed()
+        if not len(point3d_ids):
+            self._show_message("Info", "Every 3D point is observed in at least two images.")
+            return
+        shown = [f"{point3d_id}: {tracks.images_of(point3d_id)[0]}" for point3d_id in point3d_ids[:10].tolist()]
+        more = f"\n... and {len(point3d_ids) - 10} more" if len(point3d_ids) > 10 else ""
+        self._show_message("Under-observed 3D points",
+                           f"{len(point3d_ids)} 3D points are observed in only one image:\n" + "\n".join(shown) + more)
+
+    def _track_index(self):
+        # Brings the feature ID index up to date with every edit since the last query.
+        self.tracks.refresh(self.annotations)
+        return self.tracks
+
+    def _point_track_index(self):
+        self.point_tracks.refresh(self.annotations)
+        return self.point_tracks
+
+    @profiled("load_pair")
     def _load_pair(self):
         if self.current_idx >= len(self.image_files) - 1:
             self.app.post_to_main_thread(self.window, lambda: setattr(self.left_label, 'text', "End of Images"))
@@ -51,19 +90,52 @@ class NavigationMixin:
 
         name_left = self.image_files[self.current_idx]
         name_right = self.image_files[self.current_idx + 1]
+        self.proposal = None
+        self._update_fundamental()
 
-        path_left = os.path.join(self.image_folder, name_left)
-        path_right = os.path.join(self.image_folder, name_right)
+        # The new left image of a Next/Prev step is usually still cached from the previous pair.
+        self.cv_img_left = self.image_cache.get(name_left)
+        self.cv_img_right = self.image_cache.get(name_right)
 
-        self.cv_img_left = cv2.imread(path_left)
-        self.cv_img_right = cv2.imread(path_right)
+        neighbours = self._neighbour_image_names()
+        self.image_cache.prefetch(neighbours)
 
         if self.cv_img_left is None or self.cv_img_right is None:
             print(f"Error loading images: {name_left} or {name_right}")
             return
 
+        # Grayscale copies are built once per loaded image for descriptor computation.
+        self.descriptor_service.gray(name_left, self.cv_img_left)
+        self.descriptor_service.gray(name_right, self.cv_img_right)
+
+        # Pyramids for zoomed-out views: the pair from its decoded images, neighbours from reduced decodes.
+        self.pyramids.ensure(name_left, self.cv_img_left)
+        self.pyramids.ensure(name_right, self.cv_img_right)
+        for name in neighbours:
+            self.pyramids.ensure(name)
+
+        self._fit_viewports()
+
         self.app.post_to_main_thread(self.window, lambda: self._set_pair_labels(name_left, name_right))
-        self.app.post_to_main_thread(self.window, self._update_display_images)
+        self._request_redraw()
+
+    def _update_fundamental(self):
+        # Fundamental matrix of the current pair from the imported poses and cameras, if any.
+        if self.current_idx >= len(self.image_files) - 1:
+            self.fundamental = None
+            return
+        self.fundamental = fundamental_matrix(self.image_metadata.get(self.image_files[self.current_idx]),
+                                              self.image_metadata.get(self.image_files[self.current_idx + 1]),
+                                              self.cameras)
+
+    def _neighbour_image_names(self):
+        # Images needed by the next pair (idx+1, idx+2) and the previous pair (idx-1, idx).
+        names = []
+        if self.current_idx + 2 < len(self.image_files):
+            names.append(self.image_files[self.current_idx + 2])
+        if self.current_idx - 1 >= 0:
+            names.append(self.image_files[self.current_idx - 1])
+        return names
 
     def _set_pair_labels(self, name_left, name_right):
         self.left_label.text = f"Left: {name_left} (Index {self.current_idx})"
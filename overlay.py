@@ -0,0 +1,172 @@
+from collections import OrderedDict
+
+import cv2
+import numpy as np
+
+from .constants import (COLOR_TRIANGULATED, COLOR_UNTRIANGULATED, LABEL_CACHE_SIZE, OVERLAY_HEATMAP_CELL,
+                        OVERLAY_HEATMAP_MIN_POINTS, OVERLAY_LABEL_MAX_POINTS)
+
+LABEL_FONT = cv2.FONT_HERSHEY_SIMPLEX
+LABEL_SCALE = 0.5
+LABEL_OFFSET = (5, -5)  # from the point to the label's baseline origin, as cv2.putText is used
+
+
+def sprite_offsets(radius, thickness):
+    """Pixel offsets ``(dy, dx)`` of a circle as cv2.circle draws it (thickness -1 fills)."""
+    size = 2 * radius + 2 * max(thickness, 1) + 1
+    canvas = np.zeros((size, size), dtype=np.uint8)
+    cv2.circle(canvas, (size // 2, size // 2), radius, 255, thickness)
+    dy, dx = np.nonzero(canvas)
+    return dy - size // 2, dx - size // 2
+
+
+def paint(img, px, py, color, coverage=None):
+    # Flat-index assignment per channel, optionally blended by a uint8 ``coverage`` as
+    # cv2's anti-aliased text is; pixels outside the image are dropped.
+    h, w = img.shape[:2]
+    inside = (px >= 0) & (px < w) & (py >= 0) & (py < h)
+    index = py[inside] * w + px[inside]
+    channels = img.reshape(-1)
+    if coverage is not None:
+        coverage = coverage[inside]
+        solid = coverage == 255
+        blend_index, alpha = index[~solid], coverage[~solid].astype(np.uint16)
+        index = index[solid]
+    for c, value in enumerate(color):
+        channel = channels[c::len(color)]
+        channel[index] = value
+        if coverage is not None:
+            channel[blend_index] = (channel[blend_index] * (255 - alpha) + value * alpha + 127) // 255
+
+
+def stamp(img, xs, ys, offsets, color):
+    # Draws the sprite at every (x, y).
+    dy, dx = offsets
+    paint(img, (xs[:, None] + dx[None, :]).ravel(), (ys[:, None] + dy[None, :]).ravel(), color)
+
+
+class LabelAtlas:
+    """ID labels rasterized once with cv2.putText and cached as pixel offsets and coverage."""
+
+    def __init__(self, capacity=LABEL_CACHE_SIZE):
+        self.capacity = capacity
+        (_, self.ascent), self.descent = cv2.getTextSize("0123456789", LABEL_FONT, LABEL_SCALE, 1)
+        self.height = self.ascent + self.descent
+        self._labels = OrderedDict()
+
+    def offsets(self, label):
+        cached = self._labels.get(label)
+        if cached is not None:
+            self._labels.move_to_end(label)
+            return cached
+        text = str(label)
+        (width, _), _ = cv2.getTextSize(text, LABEL_FONT, LABEL_SCALE, 1)
+        canvas = np.zeros((self.height + 2, width + 2), dtype=np.uint8)
+        cv2.putText(canvas, text, (1, self.ascent + 1), LABEL_FONT, LABEL_SCALE, 255, 1)
+        dy, dx = np.nonzero(canvas)
+        cached = self._labels[label] = (dy - self.ascent - 1, dx - 1, canvas[dy, dx], width)
+        if len(self._labels) > self.capacity:
+            self._labels.popitem(last=False)
+        return cached
+
+    def width(self, label):
+        return self.offsets(label)[3]
+
+    def draw(self, img, labels, xs, ys, color):
+        # ``(xs, ys)`` are baseline origins, as for cv2.putText; all labels go in one assignment.
+        if len(labels) == 0:
+            return
+        offsets = [self.offsets(label) for label in labels]
+        counts = [len(dy) for dy, _, _, _ in offsets]
+        paint(img, np.repeat(xs, counts) + np.concatenate([dx for _, dx, _, _ in offsets]),
+              np.repeat(ys, counts) + np.concatenate([dy for dy, _, _, _ in offsets]), color,
+              np.concatenate([coverage for _, _, coverage, _ in offsets]))
+
+
+class OverlayRenderer:
+    """Feature markers for one view, with a level of detail chosen from the visible point count.
+
+    Up to ``label_max_points`` visible points get rings and ID labels, one label per
+    label-sized cell so they never pile up; denser views collapse points that share a
+    view pixel into small dots, and from ``heatmap_min_points`` on a density heatmap
+    replaces the markers. The cost follows the number of visible points.
+    """
+
+    def __init__(self, label_max_points=OVERLAY_LABEL_MAX_POINTS, heatmap_min_points=OVERLAY_HEATMAP_MIN_POINTS,
+                 heatmap_cell=OVERLAY_HEATMAP_CELL):
+        self.label_max_points = label_max_points
+        self.heatmap_min_points = heatmap_min_points
+        self.heatmap_cell = heatmap_cell
+        self.labels = LabelAtlas()
+        self._ring = sprite_offsets(4, 1)
+        self._dot = sprite_offsets(1, -1)
+
+    def draw(self, img, viewport, records):
+        if len(records) == 0:
+            return
+        view_x, view_y = viewport.image_to_view(records['x'], records['y'])
+        view_x = view_x.astype(np.int64)
+        view_y = view_y.astype(np.int64)
+        triangulated = records['point3d_id'] > 0
+
+        if len(records) >= self.heatmap_min_points:
+            self._draw_heatmap(img, view_x, view_y)
+        elif len(records) > self.label_max_points:
+            self._draw_dots(img, view_x, view_y, triangulated)
+        else:
+            stamp(img, view_x[triangulated], view_y[triangulated], self._ring, COLOR_TRIANGULATED)
+            stamp(img, view_x[~triangulated], view_y[~triangulated], self._ring, COLOR_UNTRIANGULATED)
+            self._draw_labels(img, records['fid'], view_x, view_y, triangulated)
+
+    def _draw_dots(self, img, view_x, view_y, triangulated):
+        # Points sharing a view pixel are drawn once, a triangulated one if there is any.
+        h, w = img.shape[:2]
+        inside = np.flatnonzero((view_x >= -1) & (view_x <= w) & (view_y >= -1) & (view_y <= h))
+        order = inside[np.argsort(~triangulated[inside], kind='stable')]
+        _, first = np.unique((view_y[order] + 1) * (w + 2) + view_x[order] + 1, return_index=True)
+        rows = order[first]
+        tri = triangulated[rows]
+        stamp(img, view_x[rows[tri]], view_y[rows[tri]], self._dot, COLOR_TRIANGULATED)
+        stamp(img, view_x[rows[~tri]], view_y[rows[~tri]], self._dot, COLOR_UNTRIANGULATED)
+
+    def _draw_labels(self, img, fids, view_x, view_y, triangulated):
+        # Greedy placement on a coarse occupancy grid: a label is skipped if it would
+        # overlap one already placed, so dense clusters show a readable subset.
+        cell = 4
+        h, w = img.shape[:2]
+        occupied = np.zeros((h // cell + 2, w // cell + 2), dtype=bool)
+        label_x = view_x + LABEL_OFFSET[0]
+        label_y = view_y + LABEL_OFFSET[1]
+        kept = []
+        for row, fid in enumerate(fids.tolist()):
+            x0, y0 = label_x[row], label_y[row] - self.labels.ascent
+            x1, y1 = x0 + self.labels.width(fid), y0 + self.labels.height
+            if x1 <= 0 or y1 <= 0 or x0 >= w or y0 >= h:
+                continue
+            cells = occupied[max(y0, 0) // cell:min(y1, h) // cell + 1, max(x0, 0) // cell:min(x1, w) // cell + 1]
+            if cells.any():
+                continue
+            cells[:] = True
+            kept.append(row)
+
+        kept = np.array(kept, dtype=np.int64)
+        for mask, color in ((triangulated[kept], COLOR_TRIANGULATED), (~triangulated[kept], COLOR_UNTRIANGULATED)):
+            rows = kept[mask]
+            self.labels.draw(img, fids[rows].tolist(), label_x[rows], label_y[rows], color)
+
+    def _draw_heatmap(self, img, view_x, view_y):
+        cell = self.heatmap_cell
+        grid_h, grid_w = -(-img.shape[0] // cell), -(-img.shape[1] // cell)
+        inside = (view_x >= 0) & (view_x < img.shape[1]) & (view_y >= 0) & (view_y < img.shape[0])
+        counts = np.bincount((view_y[inside] // cell) * grid_w + view_x[inside] // cell,
+                             minlength=grid_h * grid_w).reshape(grid_h, grid_w)
+        if not counts.any():
+            return
+        level = np.log1p(counts) / np.log1p(counts.max())
+        heat = cv2.applyColorMap((255 * level).astype(np.uint8), cv2.COLORMAP_JET)
+        heat = cv2.cvtColor(heat, cv2.COLOR_BGR2RGB)
+        h, w = img.shape[:2]
+        heat = cv2.resize(heat, (grid_w * cell, grid_h * cell), interpolation=cv2.INTER_NEAREST)[:h, :w]
+        occupied = cv2.resize((counts > 0).astype(np.uint8), (grid_w * cell, grid_h * cell),
+                              interpolation=cv2.INTER_NEAREST)[:h, :w]
+        cv2.copyTo(cv2.addWeighted(img, 0.4, heat, 0.6, 0.0), occupied, img)
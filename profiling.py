@@ -0,0 +1,227 @@
+import functools
+import json
+import threading
+import time
+from collections import deque
+
+from .constants import PROFILE_FPS_WINDOW, PROFILE_LOG_SIZE
+
+
+class _Span:
+    __slots__ = ('profiler', 'name', 'start')
+
+    def __init__(self, profiler, name):
+        self.profiler = profiler
+        self.name = name
+
+    def __enter__(self):
+        self.start = time.perf_counter_ns()
+        return self
+
+    def __exit__(self, *exc):
+        self.profiler.record(self.name, self.start, time.perf_counter_ns())
+        return False
+
+
+class _NullSpan:
+    __slots__ = ()
+
+    def __enter__(self):
+        return self
+
+    def __exit__(self, *exc):
+        return False
+
+
+_NULL_SPAN = _NullSpan()
+
+
+class Profiler:
+    """Switchable scoped timers, counters and gauges kept in a rolling event log.
+
+    While disabled, ``span`` hands out one shared no-op context manager and
+    ``count``/``gauge`` return at once, so instrumented code costs an attribute
+    check per call. The log holds the last ``capacity`` events and can be written
+    as plain JSON or in the Chrome trace-event format (chrome://tracing, Perfetto).
+    """
+
+    def __init__(self, capacity=PROFILE_LOG_SIZE):
+        self.enabled = False
+        self.capacity = capacity
+        self._lock = threading.Lock()
+        self.reset()
+
+    def enable(self, enabled=True):
+        self.enabled = enabled
+
+    def reset(self):
+        with self._lock:
+            self._events = deque(maxlen=self.capacity)  # (phase, name, thread id, ns, duration or value)
+            self._totals = {}  # name -> [calls, total ns, max ns]
+            self._counters = {}
+            self._frames = deque()  # (end ns, duration ns) within the FPS window
+            self._threads = {}
+            self._origin = time.perf_counter_ns()
+
+    def span(self, name):
+        return _Span(self, name) if self.enabled else _NULL_SPAN
+
+    def record(self, name, start, end):
+        # A finished span; also used for intervals measured elsewhere (e.g. queue waits).
+        if not self.enabled:
+            return
+        duration = end - start
+        thread = threading.get_ident()
+        with self._lock:
+            self._events.append(('X', name, thread, start, duration))
+            totals = self._totals.get(name)
+            if totals is None:
+                totals = self._totals[name] = [0, 0, 0]
+            totals[0] += 1
+            totals[1] += duration
+            totals[2] = max(totals[2], duration)
+            if thread not in self._threads:
+                self._threads[thread] = threading.current_thread().name
+
+    def count(self, name, value=1):
+        if not self.enabled:
+            return
+        with self._lock:
+            total = self._counters[name] = self._counters.get(name, 0) + value
+            self._events.append(('C', name, threading.get_ident(), time.perf_counter_ns(), total))
+
+    def gauge(self, name, value):
+        if not self.enabled:
+            return
+        with self._lock:
+            self._counters[name] = value
+            self._events.append(('C', name, threading.get_ident(), time.perf_counter_ns(), value))
+
+    def frame(self, start, end):
+        """Record one rendered frame for the frame-time / FPS overlay."""
+        if not self.enabled:
+            return
+        self.record('frame', start, end)
+        with self._lock:
+            self._frames.append((end, end - start))
+            window_start = end - int(PROFILE_FPS_WINDOW * 1e9)
+            while self._frames and self._frames[0][0] < window_start:
+                self._frames.popleft()
+
+    def frame_stats(self):
+        # Mean frame time (ms) and frames per second over the last FPS window.
+        with self._lock:
+            frames = list(self._frames)
+        if not frames:
+            return 0.0, 0.0
+        return sum(d for _, d in frames) / len(frames) / 1e6, len(frames) / PROFILE_FPS_WINDOW
+
+    def counter(self, name, default=0):
+        return self._counters.get(name, default)
+
+    def summary(self):
+        with self._lock:
+            spans = {name: {'calls': calls, 'total_ms': total / 1e6, 'mean_ms': total / calls / 1e6, 'max_ms': peak / 1e6}
+                     for name, (calls, total, peak) in self._totals.items()}
+            return {'spans': spans, 'counters': dict(self._counters)}
+
+    def summary_lines(self, limit=10):
+        # The spans with the most total time, then every counter.
+        summary = self.summary()
+        spans = sorted(summary['spans'].items(), key=lambda item: -item[1]['total_ms'])[:limit]
+        lines = [f"{name}: {s['calls']} calls, {s['total_ms']:.1f} ms total, {s['mean_ms']:.2f} ms mean, "
+                 f"{s['max_ms']:.2f} ms max" for name, s in spans]
+        return lines + [f"{name}: {value}" for name, value in sorted(summary['counters'].items())]
+
+    def to_json(self):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+            origin = self._origin
+        rows = []
+        for phase, name, thread, ns, value in events:
+            row = {'name': name, 'thread': threads.get(thread, str(thread)), 'ts_ms': (ns - origin) / 1e6}
+            if phase == 'X':
+                row['duration_ms'] = value / 1e6
+            else:
+                row['value'] = value
+            rows.append(row)
+        report = self.summary()
+        report['events'] = rows
+        return report
+
+    def to_chrome_trace(self):
+        with self._lock:
+            events = list(self._events)
+            threads = dict(self._threads)
+            origin = self._origin
+        trace = [{'name': 'thread_name', 'ph': 'M', 'pid': 0, 'tid': thread, 'args': {'name': name}}
+                 for thread, name in threads.items()]
+        for phase, name, thread, ns, value in events:
+            event = {'name': name, 'ph': phase, 'pid': 0, 'tid': thread, 'ts': (ns - origin) / 1e3}
+            if phase == 'X':
+                event['dur'] = value / 1e3
+            else:
+                event['args'] = {name: value}
+            trace.append(event)
+        return {'traceEvents': trace, 'displayTimeUnit': 'ms'}
+
+    def dump(self, path, chrome_trace=False):
+        with open(path, 'w', encoding='utf-8') as f:
+            json.dump(self.to_chrome_trace() if chrome_trace else self.to_json(), f)
+
+
+profiler = Profiler()
+
+
+def profiled(name):
+    """Decorator timing each call as span ``name`` while the profiler is enabled."""
+    def decorate(fn):
+        @functools.wraps(fn)
+        def wrapper(*args, **kwargs):
+            if not profiler.enabled:
+                return fn(*args, **kwargs)
+            start = time.perf_counter_ns()
+            try:
+                return fn(*args, **kwargs)
+            finally:
+                profiler.record(name, start, time.perf_counter_ns())
+        return wrapper
+    return decorate
+
+
+class ProfiledApp:
+    """Wraps an application object so posted GUI-thread callbacks report queue depth and wait time.
+
+    Everything except ``post_to_main_thread`` is delegated to the wrapped app.
+    """
+
+    def __init__(self, app, profiler=profiler):
+        self._app = app
+        self._profiler = profiler
+        self._pending = 0
+        self._lock = threading.Lock()
+
+    def __getattr__(self, name):
+        return getattr(self._app, name)
+
+    def post_to_main_thread(self, window, fn):
+        if not self._profiler.enabled:
+            return self._app.post_to_main_thread(window, fn)
+
+        posted = time.perf_counter_ns()
+        with self._lock:
+            self._pending += 1
+            depth = self._pending
+        self._profiler.gauge('main_thread.queue_depth', depth)
+
+        def run():
+            with self._lock:
+                self._pending -= 1
+                depth = self._pending
+            self._profiler.gauge('main_thread.queue_depth', depth)
+            self._profiler.record('main_thread.wait', posted, time.perf_counter_ns())
+            with self._profiler.span('main_thread.callback'):
+                fn()
+
+        return self._app.post_to_main_thread(window, run)
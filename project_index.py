@@ -0,0 +1,199 @@
+import os
+import struct
+
+import numpy as np
+
+from .constants import IMAGE_EXTENSIONS
+
+MANIFEST_NAME = "manifest.npz"
+MANIFEST_VERSION = 1
+
+# JPEG start-of-frame markers (every 0xC0-0xCF except DHT, JPG and DAC).
+_SOF_MARKERS = set(range(0xC0, 0xD0)) - {0xC4, 0xC8, 0xCC}
+
+
+def _is_image(name):
+    return name.lower().endswith(IMAGE_EXTENSIONS)
+
+
+def list_image_files(image_folder):
+    with os.scandir(image_folder) as entries:
+        return sorted(entry.name for entry in entries if _is_image(entry.name) and entry.is_file())
+
+
+def _exif_orientation(segment):
+    # Orientation tag (0x0112) of an APP1 Exif segment, 1 if absent or malformed.
+    if not segment.startswith(b'Exif\0\0') or len(segment) < 14:
+        return 1
+    tiff = segment[6:]
+    order = '<' if tiff[:2] == b'II' else '>'
+    try:
+        ifd = struct.unpack(order + 'I', tiff[4:8])[0]
+        count = struct.unpack(order + 'H', tiff[ifd:ifd + 2])[0]
+        for k in range(count):
+            entry = ifd + 2 + 12 * k
+            tag, _, _, value = struct.unpack(order + 'HHIH', tiff[entry:entry + 10])
+            if tag == 0x0112:
+                return value
+    except struct.error:
+        pass
+    return 1
+
+
+def read_image_size(path):
+    """``(width, height)`` as cv2.imread returns the image, from the JPEG/PNG header alone; None if unknown."""
+    try:
+        with open(path, 'rb') as f:
+            head = f.read(24)
+            if head.startswith(b'\x89PNG\r\n\x1a\n') and head[12:16] == b'IHDR':
+                return struct.unpack('>II', head[16:24])
+            if not head.startswith(b'\xff\xd8'):
+                return None
+
+            f.seek(2)
+            orientation = 1
+            while True:
+                marker = f.read(2)
+                if len(marker) < 2 or marker[0] != 0xFF:
+                    return None
+                code = marker[1]
+                while code == 0xFF:  # fill bytes
+                    fill = f.read(1)
+                    if not fill:
+                        return None
+                    code = fill[0]
+                if code == 0x01 or 0xD0 <= code <= 0xD8:
+                    continue
+                if code == 0xD9 or code == 0xDA:
+                    return None
+                length = struct.unpack('>H', f.read(2))[0]
+                if code in _SOF_MARKERS:
+                    height, width = struct.unpack('>xHH', f.read(5))
+                    # EXIF orientations 5-8 are rotated by 90 degrees when decoded.
+                    return (height, width) if orientation >= 5 else (width, height)
+                if code == 0xE1 and orientation == 1:
+                    orientation = _exif_orientation(f.read(length - 2))
+                else:
+                    f.seek(length - 2, 1)
+    except (OSError, struct.error):
+        return None
+
+
+def _scan(image_folder):
+    # Sorted names with their sizes and mtimes, one scandir pass.
+    found = []
+    with os.scandir(image_folder) as entries:
+        for entry in entries:
+            if not _is_image(entry.name):
+                continue
+            try:
+                if not entry.is_file():
+                    continue
+                st = entry.stat()
+            except OSError:
+                continue
+            found.append((entry.name, st.st_size, st.st_mtime_ns))
+    found.sort()
+    names = [name for name, _, _ in found]
+    sizes = np.array([size for _, size, _ in found], dtype=np.int64)
+    mtimes = np.array([mtime for _, _, mtime in found], dtype=np.int64)
+    return names, sizes, mtimes
+
+
+class ProjectIndex:
+    """Sorted image names of a folder with a name->index map and per-file size, mtime and dimensions.
+
+    ``open`` reuses the manifest cached in ``cache_dir`` while the folder's mtime is
+    unchanged, so reopening an unchanged folder costs a stat and one file read.
+    Otherwise the folder is rescanned; dimensions already known are kept for files
+    whose size and mtime still match. Files rewritten in place do not change the
+    folder's mtime and are not detected. Dimensions are read from the file header
+    on first request (-1: not read yet, 0: unreadable) and cached by ``save``.
+    """
+
+    def __init__(self, image_folder, names, sizes, mtimes, widths=None, heights=None, folder_mtime=0,
+                 manifest_path=None):
+        self.image_folder = image_folder
+        self.names = names
+        self.positions = dict(zip(names, range(len(names))))
+        self.sizes = sizes
+        self.mtimes = mtimes
+        self.widths = widths if widths is not None else np.full(len(names), -1, dtype=np.int32)
+        self.heights = heights if heights is not None else np.full(len(names), -1, dtype=np.int32)
+        self.folder_mtime = folder_mtime
+        self.manifest_path = manifest_path
+        self._dirty = False
+
+    @classmethod
+    def open(cls, image_folder, cache_dir=None):
+        folder_mtime = os.stat(image_folder).st_mtime_ns
+        manifest_path = os.path.join(cache_dir, MANIFEST_NAME) if cache_dir else None
+        cached = cls._load(manifest_path, image_folder) if manifest_path else None
+        if cached is not None and cached.folder_mtime == folder_mtime:
+            return cached
+
+        index = cls(image_folder, *_scan(image_folder), folder_mtime=folder_mtime, manifest_path=manifest_path)
+        if cached is not None:
+            index._keep_dimensions(cached)
+        print(f"Indexed {len(index.names)} images in {image_folder}")
+        if manifest_path:
+            index._dirty = True
+            index.save()
+        return index
+
+    def __len__(self):
+        return len(self.names)
+
+    def __contains__(self, name):
+        return name in self.positions
+
+    def index(self, name):
+        return self.positions.get(name)
+
+    def dimensions(self, name):
+        """``(width, height)`` of ``name`` from its header, or None if unknown or unreadable."""
+        i = self.positions.get(name)
+        if i is None:
+            return None
+        if self.widths[i] < 0:
+            size = read_image_size(os.path.join(self.image_folder, name)) or (0, 0)
+            self.widths[i], self.heights[i] = size
+            self._dirty = True
+        if self.widths[i] <= 0:
+            return None
+        return int(self.widths[i]), int(self.heights[i])
+
+    def save(self):
+        if not self._dirty or not self.manifest_path:
+            return
+        os.makedirs(os.path.dirname(self.manifest_path), exist_ok=True)
+        tmp_path = self.manifest_path + ".tmp"
+        with open(tmp_path, 'wb') as f:
+            # Names are '\0'-separated in one byte array, which loads far faster than an object array.
+            np.savez(f, version=MANIFEST_VERSION, folder=os.path.abspath(self.image_folder),
+                     folder_mtime=self.folder_mtime,
+                     names=np.frombuffer('\0'.join(self.names).encode('utf-8'), dtype=np.uint8),
+                     sizes=self.sizes, mtimes=self.mtimes, widths=self.widths, heights=self.heights)
+        os.replace(tmp_path, self.manifest_path)
+        self._dirty = False
+
+    @classmethod
+    def _load(cls, manifest_path, image_folder):
+        try:
+            with np.load(manifest_path) as manifest:
+                if int(manifest['version']) != MANIFEST_VERSION or str(manifest['folder']) != os.path.abspath(image_folder):
+                    return None
+                blob = manifest['names'].tobytes().decode('utf-8')
+                names = blob.split('\0') if blob else []
+                return cls(image_folder, names, manifest['sizes'], manifest['mtimes'], manifest['widths'],
+                           manifest['heights'], int(manifest['folder_mtime']), manifest_path)
+        except (OSError, ValueError, KeyError):
+            return None
+
+    def _keep_dimensions(self, old):
+        # Dimensions of files that are unchanged since the old manifest.
+        for i, name in enumerate(self.names):
+            j = old.positions.get(name)
+            if j is not None and old.sizes[j] == self.sizes[i] and old.mtimes[j] == self.mtimes[i]:
+                self.widths[i] = old.widths[j]
+                self.heights[i] = old.heights[j]
@@ -0,0 +1,295 @@
+import hashlib
+import json
+import math
+import os
+import shutil
+import threading
+from collections import OrderedDict
+from concurrent.futures import ThreadPoolExecutor
+
+import numpy as np
+
+from .constants import (PYRAMID_MIN_IMAGE_SIZE, PYRAMID_MIN_SIZE, PYRAMID_PREVIEW_IMAGES, PYRAMID_TILE_SIZE,
+                        PYRAMID_WORKERS)
+
+META_NAME = "pyramid.json"
+
+# cv2.IMREAD_REDUCED_COLOR_{2,4,8}; kept as numbers so this module imports without cv2.
+_REDUCED_FLAGS = {2: 17, 4: 33, 8: 65}
+PREVIEW_LEVELS = 4  # level 0 plus the three reduced decodes
+
+
+def level_count(width, height, min_size=PYRAMID_MIN_SIZE):
+    # Level k is 2**k times smaller; stop once the whole image fits into min_size.
+    longest = max(width, height)
+    return max(1, int(math.ceil(math.log2(longest / min_size))) + 1) if longest > min_size else 1
+
+
+def level_for_zoom(zoom, levels):
+    # Coarsest level that still has at least one source pixel per view pixel.
+    if zoom >= 0.5:
+        return 0
+    return min(int(math.floor(math.log2(1.0 / zoom))), levels - 1)
+
+
+def decode_reduced(path, factor):
+    """Decode at 1/2, 1/4 or 1/8 resolution; JPEG decoders skip most of the work."""
+    import cv2
+    return cv2.imread(path, _REDUCED_FLAGS[factor])
+
+
+class TiledLevel:
+    """One pyramid level stored as ``(tiles_y, tiles_x, T, T, C)`` in a memory-mapped .npy."""
+
+    def __init__(self, tiles, width, height):
+        self.tiles = tiles
+        self.width = width
+        self.height = height
+        self.tile_size = tiles.shape[2]
+
+    @classmethod
+    def write(cls, path, img, tile_size=PYRAMID_TILE_SIZE):
+        height, width = img.shape[:2]
+        channels = img.shape[2] if img.ndim == 3 else 1
+        tiles_y = -(-height // tile_size)
+        tiles_x = -(-width // tile_size)
+        tiles = np.lib.format.open_memmap(path, mode='w+', dtype=img.dtype,
+                                          shape=(tiles_y, tiles_x, tile_size, tile_size, channels))
+        src = img.reshape(height, width, channels)
+        for ty in range(tiles_y):
+            block = src[ty * tile_size:(ty + 1) * tile_size]
+            for tx in range(tiles_x):
+                part = block[:, tx * tile_size:(tx + 1) * tile_size]
+                tiles[ty, tx, :part.shape[0], :part.shape[1]] = part
+        tiles.flush()
+        return cls(tiles, width, height)
+
+    @classmethod
+    def open(cls, path, width, height):
+        return cls(np.load(path, mmap_mode='r'), width, height)
+
+    def read(self, x0, y0, x1, y1):
+        """Copy the pixels of ``[x0, x1) x [y0, y1)`` (clamped) out of the tiles touching it."""
+        x0, y0 = max(int(x0), 0), max(int(y0), 0)
+        x1, y1 = min(int(x1), self.width), min(int(y1), self.height)
+        channels = self.tiles.shape[4]
+        out = np.empty((max(y1 - y0, 0), max(x1 - x0, 0), channels), dtype=self.tiles.dtype)
+        t = self.tile_size
+        for ty in range(y0 // t, -(-y1 // t)):
+            for tx in range(x0 // t, -(-x1 // t)):
+                sy0, sy1 = max(y0, ty * t), min(y1, (ty + 1) * t)
+                sx0, sx1 = max(x0, tx * t), min(x1, (tx + 1) * t)
+                out[sy0 - y0:sy1 - y0, sx0 - x0:sx1 - x0] = \
+                    self.tiles[ty, tx, sy0 - ty * t:sy1 - ty * t, sx0 - tx * t:sx1 - tx * t]
+        return out if channels > 1 else out[:, :, 0]
+
+
+class ImagePyramid:
+    """Levels 1..n of an image; level 0 is the decoded full-resolution image itself."""
+
+    def __init__(self, width, height, levels):
+        self.width = width
+        self.height = height
+        self.levels = levels  # TiledLevel per level, index 0 is unused
+
+    def crop(self, level, rect, margin=2):
+        # Pixels of ``level`` covering the full-resolution ``rect``; returns (crop, x0, y0) in level pixels.
+        scale = 2 ** level
+        x_min, y_min, x_max, y_max = rect
+        x0 = int(math.floor(x_min / scale)) - margin
+        y0 = int(math.floor(y_min / scale)) - margin
+        x1 = int(math.ceil(x_max / scale)) + margin
+        y1 = int(math.ceil(y_max / scale)) + margin
+        tiled = self.levels[level]
+        x0, y0 = max(x0, 0), max(y0, 0)
+        return tiled.read(x0, y0, x1, y1), x0, y0
+
+
+class PyramidCache:
+    """On-disk pyramids under ``cache_dir``, keyed by image name, mtime and size.
+
+    Pyramids are built in a background pool, either from an already decoded image
+    or from an ``IMREAD_REDUCED_*`` decode; ``on_ready(name)`` is called from the
+    worker once one becomes available. Until then ``preview`` serves zoomed-out
+    views from a reduced decode, made in the background as well. Keys are read from the file system by ``ensure``,
+    once per loaded pair, not on every render.
+    """
+
+    def __init__(self, image_folder, cache_dir, on_ready=None, workers=PYRAMID_WORKERS, dimensions=None):
+        self.image_folder = image_folder
+        self.cache_dir = cache_dir
+        self.on_ready = on_ready
+        self.dimensions = dimensions
+        self._open = {}
+        self._pending = set()
+        self._small = set()
+        self._keys = {}
+        self._previews = OrderedDict()
+        self._pending_previews = set()
+        self._lock = threading.Lock()
+        self._executor = ThreadPoolExecutor(max_workers=workers, thread_name_prefix="pyramid")
+        # Separate from the builds, so a preview never waits for neighbour pyramids.
+        self._preview_executor = ThreadPoolExecutor(max_workers=1, thread_name_prefix="pyramid-preview")
+        os.makedirs(cache_dir, exist_ok=True)
+
+    def get(self, name):
+        """Return the cached pyramid of ``name`` if it is on disk and current, else None."""
+        if name in self._small:
+            return None
+        key = self._keys.get(name) or self._key(name)
+        if key is None:
+            return None
+        with self._lock:
+            cached = self._open.get(name)
+            if cached is not None and cached[0] == key:
+                return cached[1]
+
+        pyramid = self._load(key)
+        if pyramid is not None:
+            with self._lock:
+                self._open[name] = (key, pyramid)
+        return pyramid
+
+    def ensure(self, name, img=None):
+        """Schedule a background build unless the pyramid exists or is being built."""
+        if name is None:
+            return
+        with self._lock:
+            if name in self._pending or name in self._small:
+                return
+        self._keys[name] = self._key(name)
+        # Header dimensions spare small images the reduced decode that would find out the same.
+        size = self.dimensions(name) if self.dimensions is not None else None
+        if size is not None and max(size) < PYRAMID_MIN_IMAGE_SIZE:
+            with self._lock:
+                self._small.add(name)
+            return
+        if self.get(name) is not None:
+            return
+        with self._lock:
+            self._pending.add(name)
+        self._executor.submit(self._build, name, img)
+
+    def is_small(self, name):
+        return name in self._small
+
+    def preview(self, name, level):
+        """``name`` decoded at 1/2**level (level 1-3) for zoomed-out views before its pyramid exists.
+
+        Returns None while the decode is running; ``on_ready(name)`` is called once it is done.
+        """
+        key = (name, level)
+        with self._lock:
+            img = self._previews.get(key)
+            if img is not None:
+                self._previews.move_to_end(key)
+                return img
+            if key in self._pending_previews:
+                return None
+            self._pending_previews.add(key)
+        self._preview_executor.submit(self._decode_preview, name, level)
+        return None
+
+    def close(self):
+        self._executor.shutdown(wait=False, cancel_futures=True)
+        self._preview_executor.shutdown(wait=False, cancel_futures=True)
+
+    def _key(self, name):
+        try:
+            st = os.stat(os.path.join(self.image_folder, name))
+        except OSError:
+            return None
+        digest = hashlib.sha1(name.encode('utf-8')).hexdigest()[:16]
+        return f"{digest}-{st.st_mtime_ns}-{st.st_size}"
+
+    def _load(self, key):
+        directory = os.path.join(self.cache_dir, key)
+        try:
+            with open(os.path.join(directory, META_NAME)) as f:
+                meta = json.load(f)
+            levels = [None] + [TiledLevel.open(os.path.join(directory, f"level{k}.npy"), w, h)
+                               for k, (w, h) in enumerate(meta['sizes'][1:], start=1)]
+        except (OSError, ValueError, KeyError):
+            return None
+        return ImagePyramid(meta['width'], meta['height'], levels)
+
+    def _build(self, name, img):
+        import cv2
+
+        try:
+            key = self._key(name)
+            if key is None:
+                return
+            path = os.path.join(self.image_folder, name)
+            if img is None:
+                # Without a decoded image the first level comes straight from a reduced decode.
+                level_img = decode_reduced(path, 2)
+                if level_img is None:
+                    return
+                # Full size up to the rounding of odd dimensions; levels keep their exact sizes.
+                width, height = 2 * level_img.shape[1], 2 * level_img.shape[0]
+            else:
+                height, width = img.shape[:2]
+                level_img = None
+
+            # Images that fit the view at full resolution are rendered fine without a pyramid.
+            if max(width, height) < PYRAMID_MIN_IMAGE_SIZE:
+                with self._lock:
+                    self._small.add(name)
+                return
+            if level_img is None:
+                level_img = cv2.pyrDown(img)
+
+            directory = os.path.join(self.cache_dir, key)
+            tmp_dir = directory + ".tmp"
+            shutil.rmtree(tmp_dir, ignore_errors=True)
+            os.makedirs(tmp_dir)
+
+            sizes = [(width, height)]
+            for level in range(1, level_count(width, height)):
+                if level > 1:
+                    level_img = cv2.pyrDown(level_img)
+                TiledLevel.write(os.path.join(tmp_dir, f"level{level}.npy"), level_img)
+                sizes.append((level_img.shape[1], level_img.shape[0]))
+
+            with open(os.path.join(tmp_dir, META_NAME), 'w') as f:
+                json.dump({'name': name, 'width': width, 'height': height, 'sizes': sizes}, f)
+            self._remove_stale(key)
+            shutil.rmtree(directory, ignore_errors=True)
+            os.replace(tmp_dir, directory)
+            self._keys[name] = key
+            with self._lock:
+                for level in range(1, PREVIEW_LEVELS):
+                    self._previews.pop((name, level), None)
+        except Exception as e:
+            print(f"Failed to build pyramid for {name}: {e}")
+            return
+        finally:
+            with self._lock:
+                self._pending.discard(name)
+
+        if self.on_ready is not None:
+            self.on_ready(name)
+
+    def _decode_preview(self, name, level):
+        try:
+            img = decode_reduced(os.path.join(self.image_folder, name), 2 ** level)
+        except Exception as e:
+            print(f"Failed to decode a preview of {name}: {e}")
+            img = None
+        with self._lock:
+            self._pending_previews.discard((name, level))
+            if img is None:
+                return
+            self._previews[(name, level)] = img
+            while len(self._previews) > PYRAMID_PREVIEW_IMAGES:
+                self._previews.popitem(last=False)
+        if self.on_ready is not None:
+            self.on_ready(name)
+
+    def _remove_stale(self, key):
+        # Older pyramids of the same image (other mtime/size) are dropped.
+        prefix = key.split('-')[0] + '-'
+        for entry in os.listdir(self.cache_dir):
+            if entry.startswith(prefix) and entry != key and not entry.endswith('.tmp'):
+                shutil.rmtree(os.path.join(self.cache_dir, entry), ignore_errors=True)
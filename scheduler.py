@@ -0,0 +1,58 @@
+import threading
+import time
+
+from .constants import REDRAW_MAX_FPS
+from .profiling import profiler
+
+
+class RedrawScheduler:
+    """Coalesces redraw requests into at most one render per frame.
+
+    Requests only mark panes dirty; a single render callback is posted to the GUI
+    thread per frame, so intermediate drag positions are never rendered.
+    """
+
+    def __init__(self, app, window, render, max_fps=REDRAW_MAX_FPS):
+        self.app = app
+        self.window = window
+        self.render = render
+        self.min_interval = 1.0 / max_fps if max_fps and max_fps > 0 else 0.0
+
+        self._dirty = set()
+        self._scheduled = False
+        self._last_frame = 0.0
+        self._lock = threading.Lock()
+
+        self.requests = 0
+        self.frames = 0
+
+    def request(self, panes=(True, False)):
+        profiler.count('redraw.requests')
+        with self._lock:
+            self.requests += 1
+            self._dirty.update(panes)
+            if self._scheduled:
+                return
+            self._scheduled = True
+            delay = self._last_frame + self.min_interval - time.monotonic()
+
+        if delay > 0:
+            timer = threading.Timer(delay, self._post)
+            timer.daemon = True
+            timer.start()
+        else:
+            self._post()
+
+    def _post(self):
+        self.app.post_to_main_thread(self.window, self._flush)
+
+    def _flush(self):
+        with self._lock:
+            panes = self._dirty
+            self._dirty = set()
+            self._scheduled = False
+            self._last_frame = time.monotonic()
+
+        if panes:
+            self.frames += 1
+            self.render(panes)
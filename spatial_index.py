@@ -0,0 +1,88 @@
+import math
+
+import numpy as np
+
+from .constants import SPATIAL_CELL_SIZE
+
+
+class GridIndex:
+    """Uniform grid over image coordinates mapping cells to feature IDs."""
+
+    def __init__(self, cell_size=SPATIAL_CELL_SIZE):
+        self.cell_size = float(cell_size)
+        self._cells = {}
+
+    def _cell(self, x, y):
+        return math.floor(x / self.cell_size), math.floor(y / self.cell_size)
+
+    def build(self, fids, xs, ys):
+        self._cells = {}
+        self.add_many(fids, xs, ys)
+
+    def add(self, fid, x, y):
+        self._cells.setdefault(self._cell(x, y), set()).add(int(fid))
+
+    def add_many(self, fids, xs, ys):
+        if len(fids) == 0:
+            return
+        cx = np.floor(np.asarray(xs) / self.cell_size).astype(np.int64)
+        cy = np.floor(np.asarray(ys) / self.cell_size).astype(np.int64)
+        order = np.lexsort((cy, cx))
+        cx, cy, fids = cx[order], cy[order], np.asarray(fids)[order]
+
+        # One Python-level step per occupied cell rather than per point.
+        starts = np.flatnonzero(np.r_[True, (np.diff(cx) != 0) | (np.diff(cy) != 0)])
+        ends = np.r_[starts[1:], len(fids)]
+        for start, end in zip(starts.tolist(), ends.tolist()):
+            key = (int(cx[start]), int(cy[start]))
+            self._cells.setdefault(key, set()).update(fids[start:end].tolist())
+
+    def remove(self, fid, x, y):
+        key = self._cell(x, y)
+        cell = self._cells.get(key)
+        if cell is None:
+            return
+        cell.discard(int(fid))
+        if not cell:
+            del self._cells[key]
+
+    def remove_many(self, fids, xs, ys):
+        for fid, x, y in zip(np.asarray(fids).tolist(), np.asarray(xs).tolist(), np.asarray(ys).tolist()):
+            self.remove(fid, x, y)
+
+    def query_rect(self, x1, y1, x2, y2):
+        # Candidate IDs from every cell overlapping the rectangle; callers filter exactly.
+        cx1, cy1 = self._cell(min(x1, x2), min(y1, y2))
+        cx2, cy2 = self._cell(max(x1, x2), max(y1, y2))
+
+        candidates = []
+        if (cx2 - cx1 + 1) * (cy2 - cy1 + 1) > len(self._cells):
+            for (cx, cy), cell in self._cells.items():
+                if cx1 <= cx <= cx2 and cy1 <= cy <= cy2:
+                    candidates.extend(cell)
+        else:
+            for cx in range(cx1, cx2 + 1):
+                for cy in range(cy1, cy2 + 1):
+                    cell = self._cells.get((cx, cy))
+                    if cell:
+                        candidates.extend(cell)
+        return np.array(candidates, dtype=np.int64)
+
+    def query_rings(self, x, y, max_ring):
+        # Yields (ring, candidate IDs) for square rings of cells around (x, y).
+        cx0, cy0 = self._cell(x, y)
+        for ring in range(max_ring + 1):
+            candidates = []
+            for cx in range(cx0 - ring, cx0 + ring + 1):
+                for cy in (range(cy0 - ring, cy0 + ring + 1) if abs(cx - cx0) == ring else (cy0 - ring, cy0 + ring)):
+                    cell = self._cells.get((cx, cy))
+                    if cell:
+                        candidates.extend(cell)
+            yield ring, np.array(candidates, dtype=np.int64)
+
+    def extent_rings(self, x, y):
+        # Number of rings needed to cover every occupied cell from (x, y).
+        if not self._cells:
+            return 0
+        cx0, cy0 = self._cell(x, y)
+        return max(max(abs(cx - cx0), abs(cy - cy0)) for cx, cy in self._cells)
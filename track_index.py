@@ -0,0 +1,152 @@
+import numpy as np
+
+
+_NO_IDS = np.empty(0, dtype=np.int64)
+
+
+def _grow(array, needed):
+    grown = np.zeros(max(needed, 2 * len(array), 1024), dtype=array.dtype)
+    grown[:len(array)] = array
+    return grown
+
+
+def _contains_sorted(haystack, needles):
+    # Membership of ``needles`` in the sorted array ``haystack``.
+    if len(haystack) == 0:
+        return np.zeros(len(needles), dtype=bool)
+    rows = np.minimum(np.searchsorted(haystack, needles), len(haystack) - 1)
+    return haystack[rows] == needles
+
+
+class TrackIndex:
+    """Which images observe each ID of a record ``field``, kept up to date from annotation versions.
+
+    Keyed by ``fid`` it answers which images hold a feature ID and hands out new
+    IDs; keyed by ``point3d_id`` its tracks are the 3D points, which also covers
+    imported models whose keypoints all have distinct feature IDs. Per ID it stores
+    the track length and the sum of the indices of the images observing it; for a
+    one-image track that sum *is* the image, so the number of unmatched IDs per
+    image is maintained without per-ID lists. ``refresh`` only re-reads images
+    whose version changed since the last call. IDs <= 0 are ignored.
+    """
+
+    def __init__(self, names, field='fid', positions=None):
+        self.names = list(names)
+        self.field = field
+        self._positions = positions if positions is not None else dict(zip(self.names, range(len(self.names))))
+        # Images are given their own arrays once they have IDs; the arrays are replaced, never modified.
+        self._image_ids = [_NO_IDS] * len(self.names)
+        self._versions = np.zeros(len(self.names), dtype=np.int64)
+        self._lengths = np.zeros(0, dtype=np.int32)
+        self._image_sums = np.zeros(0, dtype=np.int64)
+        self._singles = np.zeros(len(self.names), dtype=np.int64)
+        self._next_id = 1
+        self._built = False
+
+    def refresh(self, annotations):
+        # Only images with an entry in the store can have changed, however large the folder.
+        changed = {}
+        for name, image in annotations.items():
+            i = self._positions.get(name)
+            if i is not None and image.version != self._versions[i]:
+                changed[i] = image
+        if not changed:
+            return
+        ids = {i: self._read_ids(image.records) for i, image in changed.items()}
+        if not self._built:
+            self._build(ids)
+        else:
+            for i, new in ids.items():
+                self._update(i, new)
+        for i, image in changed.items():
+            self._versions[i] = image.version
+        self._built = True
+
+    def allocate(self):
+        """An ID not used by any image seen so far; never handed out twice."""
+        track_id = self._next_id
+        self._next_id += 1
+        return track_id
+
+    def track_length(self, track_id):
+        return int(self._lengths[track_id]) if 0 <= track_id < len(self._lengths) else 0
+
+    def images_of(self, track_id):
+        length = self.track_length(track_id)
+        if length == 1:
+            return [self.names[int(self._image_sums[track_id])]]
+        found = []
+        for name, ids in zip(self.names, self._image_ids):
+            if len(found) == length:
+                break
+            row = np.searchsorted(ids, track_id)
+            if row < len(ids) and ids[row] == track_id:
+                found.append(name)
+        return found
+
+    def singles(self, idx):
+        # Sorted IDs of image ``idx`` not observed in any other image.
+        ids = self._image_ids[idx]
+        return ids[self._lengths[ids] == 1]
+
+    def under_observed(self, min_images=2):
+        return np.flatnonzero((self._lengths > 0) & (self._lengths < min_images))
+
+    def next_incomplete_pair(self, idx):
+        """First pair after ``idx`` (wrapping around) with an ID observed in only one image."""
+        pairs = len(self.names) - 1
+        if pairs <= 0:
+            return None
+        incomplete = (self._singles[:-1] + self._singles[1:]) > 0
+        candidates = np.flatnonzero(np.roll(incomplete, -(idx + 1)))
+        if len(candidates) == 0:
+            return None
+        return int((candidates[0] + idx + 1) % pairs)
+
+    def _read_ids(self, records):
+        ids = records[self.field]
+        if self.field == 'fid':
+            return ids[ids > 0].copy()
+        # Other fields are neither sorted nor unique within an image.
+        return np.unique(ids[ids > 0])
+
+    def _ensure_capacity(self, max_id):
+        if max_id >= len(self._lengths):
+            self._lengths = _grow(self._lengths, max_id + 1)
+            self._image_sums = _grow(self._image_sums, max_id + 1)
+        self._next_id = max(self._next_id, max_id + 1)
+
+    def _build(self, ids):
+        # First refresh: every image at once with bincount instead of per-image updates.
+        for i, new in ids.items():
+            self._image_ids[i] = new
+        all_ids = np.concatenate(self._image_ids) if self._image_ids else np.empty(0, dtype=np.int64)
+        all_images = np.repeat(np.arange(len(self.names)), [len(f) for f in self._image_ids])
+        if len(all_ids) == 0:
+            return
+        self._ensure_capacity(int(all_ids.max()))
+        size = len(self._lengths)
+        self._lengths[:] = np.bincount(all_ids, minlength=size)
+        self._image_sums[:] = np.bincount(all_ids, weights=all_images, minlength=size).astype(np.int64)
+        self._singles[:] = np.bincount(all_images[self._lengths[all_ids] == 1], minlength=len(self.names))
+
+    def _update(self, i, new):
+        old = self._image_ids[i]
+        self._image_ids[i] = new
+        added = new[~_contains_sorted(old, new)]
+        removed = old[~_contains_sorted(new, old)]
+        if len(added):
+            self._ensure_capacity(int(added.max()))
+
+        # A track growing from one image to two stops being single in its other image.
+        was_single = self._lengths[added] == 1
+        np.subtract.at(self._singles, self._image_sums[added[was_single]], 1)
+        self._singles[i] += int(np.count_nonzero(self._lengths[added] == 0))
+        self._lengths[added] += 1
+        self._image_sums[added] += i
+
+        self._singles[i] -= int(np.count_nonzero(self._lengths[removed] == 1))
+        self._lengths[removed] -= 1
+        self._image_sums[removed] -= i
+        now_single = self._lengths[removed] == 1
+        np.add.at(self._singles, self._image_sums[removed[now_single]], 1)
@@ -0,0 +1,80 @@
+import cv2
+import numpy as np
+
+from .constants import DEFAULT_ZOOM, MIN_ZOOM, MAX_ZOOM, VIEW_WIDTH, VIEW_HEIGHT, VIEW_BACKGROUND
+
+
+class Viewport:
+    """Pan/zoom transform between image pixels and a fixed-size view buffer."""
+
+    def __init__(self, width=VIEW_WIDTH, height=VIEW_HEIGHT, zoom=DEFAULT_ZOOM):
+        self.width = width
+        self.height = height
+        self.zoom = zoom
+        # image coordinate shown at the top-left corner of the view
+        self.origin_x = 0.0
+        self.origin_y = 0.0
+        self.image_size = None
+
+    def image_to_view(self, x, y):
+        return (x - self.origin_x) * self.zoom, (y - self.origin_y) * self.zoom
+
+    def view_to_image(self, vx, vy):
+        return vx / self.zoom + self.origin_x, vy / self.zoom + self.origin_y
+
+    def visible_rect(self):
+        return (self.origin_x, self.origin_y,
+                self.origin_x + self.width / self.zoom, self.origin_y + self.height / self.zoom)
+
+    def set_zoom(self, zoom, anchor=None):
+        # keep the image point under the view pixel ``anchor`` (default: centre) fixed
+        zoom = max(MIN_ZOOM, min(MAX_ZOOM, zoom))
+        if anchor is None:
+            anchor = (self.width / 2, self.height / 2)
+
+        img_x, img_y = self.view_to_image(*anchor)
+        self.zoom = zoom
+        self.origin_x = img_x - anchor[0] / zoom
+        self.origin_y = img_y - anchor[1] / zoom
+        self.clamp()
+
+    def pan(self, dx, dy):
+        self.origin_x -= dx / self.zoom
+        self.origin_y -= dy / self.zoom
+        self.clamp()
+
+    def fit(self, img_w, img_h):
+        self.image_size = (img_w, img_h)
+        self.zoom = max(MIN_ZOOM, min(MAX_ZOOM, min(self.width / img_w, self.height / img_h)))
+        self.origin_x = 0.0
+        self.origin_y = 0.0
+        self.clamp()
+
+    def clamp(self):
+        if self.image_size is None:
+            return
+        img_w, img_h = self.image_size
+        self.origin_x = self._clamp_axis(self.origin_x, img_w, self.width / self.zoom)
+        self.origin_y = self._clamp_axis(self.origin_y, img_h, self.height / self.zoom)
+
+    @staticmethod
+    def _clamp_axis(origin, img_len, visible_len):
+        # Centre the image when it is smaller than the view, otherwise keep the view inside it.
+        if visible_len >= img_len:
+            return (img_len - visible_len) / 2
+        return min(max(origin, 0.0), img_len - visible_len)
+
+    def render(self, img, scale=1.0, offset=(0, 0)):
+        # Only the visible part of the image is resampled, so cost depends on the view size.
+        # ``img`` may also be a crop of a pyramid level with ``scale`` full-resolution pixels
+        # per pixel and its top-left pixel at ``offset`` (in level pixels).
+        z = self.zoom
+        s = z * scale
+        # Map pixel centres so nearest-neighbour sampling matches image_to_view().
+        matrix = np.array([
+            [s, 0.0, z * (scale * offset[0] + 0.5 - self.origin_x) - 0.5],
+            [0.0, s, z * (scale * offset[1] + 0.5 - self.origin_y) - 0.5],
+        ])
+        interpolation = cv2.INTER_NEAREST if s >= 1.0 else cv2.INTER_LINEAR
+        return cv2.warpAffine(img, matrix, (self.width, self.height), flags=interpolation,
+                              borderMode=cv2.BORDER_CONSTANT, borderValue=VIEW_BACKGROUND)